@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -31,6 +32,8 @@ DEBUG = True
 
 ALLOWED_HOSTS = ['*']
 
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Application definition
 
@@ -47,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'space_explorer.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',    
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -77,13 +81,172 @@ TEMPLATES = [
     },
 ]
 
+# Two tiers: a small per-process LRU in front of a cache shared by every
+# worker. Set SHARED_CACHE_URL=redis://... in production; without it the shared
+# tier is file-based (and an in-memory stand-in while running the tests).
+SHARED_CACHE_URL = os.getenv('SHARED_CACHE_URL')
+if SHARED_CACHE_URL:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': SHARED_CACHE_URL,
+    }
+elif TESTING:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared-stand-in',
+    }
+else:
+    SHARED_CACHE = {
+        # Not Django's FileBasedCache: locks and counters need atomic add/incr
+        'BACKEND': 'space_explorer.cache_backends.LockingFileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',  # For development
-        'LOCATION': 'unique-snowflake',
-    }
+        'BACKEND': 'space_explorer.cache_backends.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',
+            'MAX_ENTRIES': 256,
+            'L1_TIMEOUT': 30,
+            'EPOCH_CHECK_INTERVAL': 1,
+        },
+    },
+    'shared': SHARED_CACHE,
 }
 
+# Stale-while-revalidate policies for the upstream-backed views. A value is
+# served as fresh until soft_ttl, served stale while one worker refreshes it
+# until hard_ttl, and only then dropped from the cache.
+CACHE_POLICIES = {
+    'apod': {'soft_ttl': 3600, 'hard_ttl': 86400},  # Today's; also cut off at the APOD day boundary
+    'apod_archive': {'soft_ttl': None, 'hard_ttl': None},  # Past days' APODs never change
+    'launches': {'soft_ttl': 3600, 'hard_ttl': 86400},
+    'asteroids': {'soft_ttl': 6 * 3600, 'hard_ttl': 86400},
+    'mars_weather': {'soft_ttl': 6 * 3600, 'hard_ttl': 86400},
+}
+CACHE_REFRESH_ASYNC = True  # Refresh stale entries on a background thread
+CACHE_REFRESH_WORKERS = 2
+CACHE_LOCK_TIMEOUT = 30  # Seconds before an abandoned refresh lock expires
+CACHE_WAIT_TIMEOUT = 10  # Seconds a cold miss waits on another worker's load
+CACHE_STALE_RETRY = 60  # Seconds before retrying an upstream after serving a fallback
+APOD_TIME_ZONE = 'America/New_York'  # APOD's day turns over at midnight US Eastern
+APOD_ERROR_TTL = 300  # Seconds NASA's rejection (4xx) of an APOD date is remembered
+FAVORITES_CACHE_TTL = 3600  # Seconds a page of a user's favorites is cached (writes invalidate it sooner)
+FAVORITES_BATCH_MAX = 500  # Most items one favorites/batch/ request may change
+SNAPSHOT_COMPRESS_MIN_SIZE = 512  # Bytes; smaller snapshots are only kept uncompressed
+
+# Refresh schedule for `manage.py run_ingestion`, in seconds. Intervals are kept
+# under each dataset's soft TTL so the cache is rewritten before it goes stale;
+# jitter spreads runs by +/- that fraction of the interval.
+INGEST_SCHEDULE = {
+    'launches': {'interval': 30 * 60, 'jitter': 0.1},
+    'asteroids': {'interval': 3 * 3600, 'jitter': 0.1},
+    'mars_weather': {'interval': 3 * 3600, 'jitter': 0.1},
+}
+INGEST_RETRY_DELAY = 5 * 60  # Seconds before retrying a failed refresh
+INGEST_BATCH_SIZE = 500  # Rows per INSERT ... ON CONFLICT statement
+
+# Retention for the cached tables (manage.py run_retention). Rows expire
+# max_age_days past date_field and/or beyond the newest max_rows by
+# order_field; with archive, deleted rows go to RETENTION_ARCHIVE_DIR first.
+RETENTION_POLICIES = {
+    'asteroids': {
+        'model': 'space_explorer.CachedAsteroid', 'date_field': 'close_approach_date', 'max_age_days': 400,
+        'order_field': 'close_approach_date', 'max_rows': 100_000, 'archive': True,
+    },
+    'launches': {
+        'model': 'space_explorer.CachedLaunch', 'date_field': 'net', 'max_age_days': 30, 'archive': False,
+    },
+    'mars_weather': {
+        'model': 'space_explorer.CachedMarsWeather', 'order_field': 'sol', 'max_rows': 5000, 'archive': True,
+    },
+    'tombstones': {
+        'model': 'space_explorer.Tombstone', 'date_field': 'deleted_at', 'max_age_days': 30, 'archive': False,
+    },
+}
+RETENTION_INTERVAL = 24 * 3600  # Seconds between retention runs
+RETENTION_CHUNK_SIZE = 500  # Rows deleted per transaction
+RETENTION_CHUNK_PAUSE = 0.05  # Seconds between chunks, so writers get the lock
+RETENTION_VACUUM_PAGES = 10_000  # Free pages returned per incremental vacuum
+RETENTION_ARCHIVE_DIR = BASE_DIR / 'var' / 'archive'
+
+# Content-addressed disk cache of APOD images (apod/media/<date>/)
+MEDIA_CACHE_DIR = BASE_DIR / 'var' / 'media'
+MEDIA_SOURCE_HOSTS = ('apod.nasa.gov',)  # Image URLs we'll fetch, through the apod_media upstream
+MEDIA_CACHE_MAX_BYTES = 2 * 1024 ** 3  # Least recently used images are evicted past this
+MEDIA_MAX_FILE_BYTES = 50 * 1024 ** 2  # Larger images are refused
+MEDIA_FILL_TIMEOUT = 60  # Seconds to wait for another worker's download
+MEDIA_PREFETCH = not TESTING  # Fetch new APOD images as their rows are written...
+MEDIA_PREFETCH_DAYS = 7  # ...if they're this recent
+
+# Upstream HTTP client. Each host gets its own pooled keep-alive session with
+# bounded retries; each endpoint has its own connect/read timeouts (seconds).
+UPSTREAM_HOSTS = {
+    'nasa': {
+        'base_url': 'https://api.nasa.gov',
+        'api_key_setting': 'NASA_API_KEY',
+        'pool_maxsize': 10,
+        'max_retries': 2,
+        'backoff_factor': 0.5,
+    },
+    'spacedevs': {
+        'base_url': 'https://lldev.thespacedevs.com',
+        'pool_maxsize': 4,
+        'max_retries': 2,
+        'backoff_factor': 0.5,
+    },
+    'apod_media': {
+        'base_url': 'https://apod.nasa.gov',
+        'pool_maxsize': 4,
+        'max_retries': 2,
+        'backoff_factor': 0.5,
+    },
+}
+
+UPSTREAM_ENDPOINTS = {
+    'apod': {'host': 'nasa', 'path': '/planetary/apod', 'connect_timeout': 3.05, 'read_timeout': 10},
+    'neo_feed': {'host': 'nasa', 'path': '/neo/rest/v1/feed', 'connect_timeout': 3.05, 'read_timeout': 20},
+    'insight_weather': {'host': 'nasa', 'path': '/insight_weather/', 'connect_timeout': 3.05, 'read_timeout': 10},
+    'launches_upcoming': {'host': 'spacedevs', 'path': '/2.3.0/launches/upcoming/', 'connect_timeout': 3.05, 'read_timeout': 15},
+    'apod_media': {'host': 'apod_media', 'path': '', 'connect_timeout': 3.05, 'read_timeout': 30},
+}
+
+# Shared request budgets per upstream host. Request handlers stop calling out
+# (and serve what's in the database) once only `reserve` requests are left;
+# scheduled refreshes may use the reserve.
+UPSTREAM_QUOTAS = {
+    'nasa': {'hourly_limit': int(os.getenv('NASA_API_HOURLY_LIMIT', 1000)), 'reserve': 100},
+}
+
+# Per-upstream circuit breakers: open after this many consecutive failures,
+# then let one probe through every recovery_timeout seconds.
+CIRCUIT_BREAKER = {'failure_threshold': 5, 'recovery_timeout': 30}
+
+# Paginated read API
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+ASTEROID_QUERY_MAX_DAYS = 366  # Widest date range one asteroid query may span
+APOD_RANGE_MAX_DAYS = 100  # Most APODs one range request may return
+NEO_FEED_WORKERS = 4  # Concurrent NeoWs feed requests when filling a range
+LAUNCH_SYNC_MAX_PAGES = 5  # Pages of launch changes fetched per sync; the rest wait for the next one
+LAUNCH_PRUNE_AFTER = 86400  # Seconds after its NET that a launch is dropped
+SYNC_OVERLAP = 5  # Seconds each sync_token overlaps the previous sync, for rows committed mid-read
+SYNC_PAGE_SIZE = 1000  # Most changed rows one since= response holds; has_more says to ask again
+SYNC_TOMBSTONE_DAYS = RETENTION_POLICIES['tombstones']['max_age_days']  # Older since= gets a full reset
+MARS_WEATHER_SOLS = 7  # Sols served by mars-weather/, like the InSight feed
+MARS_ROLLUP_MAX_POINTS = 200  # Longer rollups are downsampled into wider buckets
+DASHBOARD_WORKERS = 8  # Threads resolving dashboard sections, shared by all requests
+DASHBOARD_LAUNCHES = 5  # Upcoming launches in the dashboard summary
+APOD_BACKFILL_CHUNK_DAYS = 30  # Days per APOD request when backfilling the archive
+APOD_BACKFILL_WORKERS = 4  # Backfill requests in flight at once
+APOD_BACKFILL_BUDGET = 200  # Upstream requests one backfill run may make
+SEARCH_MAX_TERMS = 16  # Words of a search query used; the rest are ignored
+EXPORT_CHUNK_SIZE = 2000  # Rows fetched from the database at a time by the exports
+EXPORT_BUFFER_BYTES = 64 * 1024  # Exported rows are sent in blocks of about this size
+
 WSGI_APPLICATION = 'space_api.wsgi.application'
 
 LOGIN_URL = '/accounts/login/'  # Redirects unauthenticated users to this URL
@@ -94,9 +257,36 @@ LOGIN_REDIRECT_URL = '/'  # Redirects authenticated users after login
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'space_explorer.sqlite',  # Django's, with BEGIN IMMEDIATE write transactions
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 600,  # Keep connections open across requests...
+        'CONN_HEALTH_CHECKS': True,  # ...but check them before reuse
+    },
+    # Read-only endpoints read through here (see space_explorer.db). With WAL
+    # it's the same SQLite file, so reads never wait on a writer.
+    'replica': {
+        'ENGINE': 'space_explorer.sqlite',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'READ_ONLY': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['space_explorer.db.ReadWriteRouter']
+# Reads inside a transaction on the primary stay on it (see space_explorer.db).
+# Tests that spawn threads would otherwise reach the replica, which TestCase
+# doesn't allow, so tests read from the primary unless they opt in.
+DATABASE_READ_ALIAS = 'default' if TESTING else 'replica'
+
+# Applied to every SQLite connection as it's opened
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers don't block the writer or each other
+    'synchronous': 'NORMAL',  # Safe with WAL; fsyncs at checkpoints only
+    'busy_timeout': 5000,  # Milliseconds a writer waits for the lock before failing
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # In KiB when negative: 64 MiB of page cache
+    'temp_store': 'MEMORY',
 }
 
 
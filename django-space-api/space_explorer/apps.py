@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SpaceExplorerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'space_explorer'
+
+    def ready(self):
+        from . import db  # noqa: F401  Connects the SQLite pragma hook
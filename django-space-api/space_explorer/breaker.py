@@ -0,0 +1,90 @@
+"""
+Per-upstream circuit breakers.
+
+After ``failure_threshold`` consecutive failures (connection errors, timeouts
+or 5xx responses) a host's circuit opens and calls to it fail immediately with
+``CircuitOpen`` instead of waiting on the network. Once ``recovery_timeout``
+seconds have passed a single half-open probe is let through: success closes
+the circuit, failure opens it again for another ``recovery_timeout``.
+
+State is kept per process; each worker trips its own breaker from the
+failures it sees.
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, recovery_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise ``CircuitOpen`` unless a call may go out now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+        raise CircuitOpen(f'{self.name} is unavailable; not calling it for now')
+
+    def cancel_call(self):
+        """The call allowed by ``before_call`` never went out."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(host):
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(host)
+            if breaker is None:
+                config = settings.CIRCUIT_BREAKER
+                breaker = _breakers[host] = CircuitBreaker(
+                    host, config['failure_threshold'], config['recovery_timeout'],
+                )
+    return breaker
+
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
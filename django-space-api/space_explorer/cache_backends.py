@@ -0,0 +1,273 @@
+"""
+Two-tier cache backend: a small bounded in-process LRU (L1) in front of a
+cache shared by every worker (L2), e.g. Redis or ``LockingFileBasedCache``.
+
+Reads are served from L1 when possible and otherwise filled from L2. Writes go
+through to L2 and replace this worker's L1 copy; other workers' copies of the
+key age out within ``L1_TIMEOUT``. When every worker must see new data sooner,
+as when the ingestion scheduler publishes a dataset, ``invalidate()`` bumps a
+shared epoch: each worker checks it at most every ``EPOCH_CHECK_INTERVAL``
+seconds and drops its whole L1 when it has moved. ``add`` and ``incr`` are
+passed straight to L2, so locks and counters are exactly as atomic across
+workers as L2 makes them: Redis and ``LockingFileBasedCache`` do, Django's own
+file-based cache does not, and a LocMem cache is not shared between processes
+at all.
+
+Configure it with::
+
+    'default': {
+        'BACKEND': 'space_explorer.cache_backends.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'SHARED_ALIAS': 'shared',     # The CACHES alias used as L2
+            'MAX_ENTRIES': 256,           # L1 size
+            'L1_TIMEOUT': 30,             # Longest an L1 copy is trusted
+            'EPOCH_CHECK_INTERVAL': 1,
+        },
+    }
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+EPOCH_KEY = 'tiered-cache:epoch'
+
+# Like LocMemCache, the L1 store lives at module level (keyed by LOCATION)
+# because Django creates a backend instance per thread.
+_stores = {}
+_states = {}
+_locks = {}
+
+_missing = object()
+
+
+def consistent(backend):
+    """
+    The tier of ``backend`` that every worker sees immediately: L2 for a
+    ``TieredCache``, otherwise the backend itself. Use it for state that is
+    read-modify-written across workers, where an L1 copy could be stale.
+    """
+    return getattr(backend, 'shared', backend)
+
+
+def reload(backend, key):
+    """
+    ``backend.get(key)`` as L2 holds it now, for a ``TieredCache``: this
+    worker's L1 copy is replaced, since another worker may have written the
+    key since.
+    """
+    return getattr(backend, 'reload', backend.get)(key)
+
+
+def invalidate(backend):
+    """Make every worker drop its L1 copies, if ``backend`` is a ``TieredCache``."""
+    if hasattr(backend, 'invalidate'):
+        backend.invalidate()
+
+
+class TieredCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        # MAX_ENTRIES is read by BaseCache; keep the L1 small by default.
+        params = dict(params, OPTIONS={'MAX_ENTRIES': options.get('MAX_ENTRIES', 256)})
+        super().__init__(params)
+        self._shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self._l1_timeout = options.get('L1_TIMEOUT', 30)
+        self._epoch_check_interval = options.get('EPOCH_CHECK_INTERVAL', 1)
+        self._store = _stores.setdefault(location, OrderedDict())
+        self._state = _states.setdefault(location, {'epoch': None, 'checked_at': 0.0})
+        self._lock = _locks.setdefault(location, threading.Lock())
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    # L1 helpers
+
+    def _l1_get(self, key):
+        with self._lock:
+            item = self._store.get(key)
+            if item is None:
+                return _missing
+            pickled, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._store[key]
+                return _missing
+            self._store.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self._l1_timeout
+        backend_timeout = self.get_backend_timeout(timeout)
+        if backend_timeout is not None:
+            ttl = min(ttl, backend_timeout - time.time())
+        if ttl <= 0:
+            self._l1_delete(key)
+            return
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            self._store[key] = (pickled, time.monotonic() + ttl)
+            self._store.move_to_end(key)
+            while len(self._store) > self._max_entries:
+                self._store.popitem(last=False)
+
+    def _l1_delete(self, key):
+        with self._lock:
+            self._store.pop(key, None)
+
+    def _l1_clear(self):
+        with self._lock:
+            self._store.clear()
+
+    # Cross-worker invalidation
+
+    def _check_epoch(self):
+        now = time.monotonic()
+        if now - self._state['checked_at'] < self._epoch_check_interval:
+            return
+        epoch = self.shared.get(EPOCH_KEY)
+        with self._lock:
+            if epoch != self._state['epoch']:
+                self._store.clear()
+                self._state['epoch'] = epoch
+            self._state['checked_at'] = now
+
+    def _bump_epoch(self):
+        """Tell every other worker to drop its L1."""
+        # Start from the clock, so an epoch lost to clear() or eviction is never reused
+        self.shared.add(EPOCH_KEY, time.time_ns(), timeout=None)
+        try:
+            epoch = self.shared.incr(EPOCH_KEY)
+        except ValueError:  # Evicted between add and incr
+            return
+        with self._lock:
+            # Unless this was the only bump since we last looked, other
+            # workers have written too and our L1 may be out of date.
+            if self._state['epoch'] is None or epoch != self._state['epoch'] + 1:
+                self._store.clear()
+            self._state['epoch'] = epoch
+            self._state['checked_at'] = time.monotonic()
+
+    def invalidate(self):
+        """Drop every worker's L1 copy without touching the shared tier."""
+        self._l1_clear()
+        self._bump_epoch()
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        self._check_epoch()
+        value = self._l1_get(l1_key)
+        if value is not _missing:
+            return value
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            return default
+        self._l1_set(l1_key, value)
+        return value
+
+    def reload(self, key, default=None, version=None):
+        """Like ``get``, but read through to L2 and refresh the L1 copy."""
+        l1_key = self.make_and_validate_key(key, version=version)
+        value = self.shared.get(key, _missing, version=version)
+        if value is _missing:
+            self._l1_delete(l1_key)
+            return default
+        self._l1_set(l1_key, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout, version=version)
+        self._l1_set(l1_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._l1_delete(l1_key)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.incr(key, delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self.make_and_validate_key(key, version=version))
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        self.shared.clear()
+        self._l1_clear()
+        self._bump_epoch()
+
+
+class LockingFileBasedCache(FileBasedCache):
+    """
+    ``FileBasedCache`` whose ``add`` and ``incr`` (and so ``decr``) are atomic
+    across processes sharing the directory. Each holds a lock file next to the
+    key's cache file, created with ``O_CREAT | O_EXCL``; a lock older than
+    ``LOCK_TIMEOUT`` seconds was left by a process that died and is broken.
+    """
+    lock_suffix = '.lock'  # Not matched by the *.djcache glob used to cull and clear
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._lock_timeout = params.get('OPTIONS', {}).get('LOCK_TIMEOUT', 10)
+
+    @contextmanager
+    def _key_lock(self, key, version=None):
+        path = self._key_to_file(key, version) + self.lock_suffix
+        self._createdir()
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > self._lock_timeout:
+                        os.remove(path)
+                        continue
+                except FileNotFoundError:  # Released meanwhile
+                    continue
+                time.sleep(0.005)
+        try:
+            yield
+        finally:
+            os.remove(path)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._key_lock(key, version):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._key_lock(key, version):
+            return super().incr(key, delta, version)
@@ -0,0 +1,228 @@
+"""
+Stale-while-revalidate caching for the upstream-backed views.
+
+Each cache entry carries a soft and a hard expiry. Until the soft expiry the
+value is served as-is. Between the soft and the hard expiry the stale value is
+still served immediately, and exactly one worker (whoever wins the refresh
+lock) reloads it in the background. Only a cold miss blocks, and even then
+concurrent requests for the same key wait on the single in-flight load rather
+than all calling the upstream at once.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from . import metrics
+from .cache_backends import consistent, reload
+
+try:
+    import brotli
+except ImportError:  # Optional; only gzip variants are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CACHE_REFRESH_WORKERS', 2),
+    thread_name_prefix='cache-refresh',
+)
+
+
+class Stale:
+    """
+    Returned by a loader that couldn't reach its upstream and fell back to
+    older data. The value is cached with a ``stale`` flag and retried after
+    ``CACHE_STALE_RETRY`` seconds instead of the policy's soft TTL.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Until:
+    """
+    Returned by a loader whose value is only good until ``expires_at`` (a Unix
+    timestamp), such as today's APOD: the entry's soft and hard expiry are
+    both cut short to end there.
+    """
+
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+
+
+def get_policy(policy):
+    return settings.CACHE_POLICIES[policy]
+
+
+def get_or_refresh(key, loader, policy):
+    """
+    Return the cached value for ``key``, loading it with ``loader()`` on a cold
+    miss and refreshing it in the background once it is past its soft TTL.
+    """
+    return snapshot_value(get_entry(key, loader, policy))
+
+
+def get_entry(key, loader, policy):
+    """
+    Like ``get_or_refresh``, but return the whole cache entry: the encoded
+    snapshot (``body`` plus compressed variants), the ``etag`` and
+    ``stored_at`` validators used for conditional requests, and whether the
+    value is a ``stale`` fallback.
+    """
+    with metrics.phase('cache'):
+        entry = cache.get(key)
+    if entry is not None:
+        if time.time() >= entry['fresh_until']:
+            # This worker's copy may predate another worker's refresh
+            with metrics.phase('cache'):
+                entry = reload(cache, key) or entry
+        if time.time() >= entry['fresh_until']:
+            metrics.CACHE_LOOKUPS.inc(family=policy, result='stale')
+            _schedule_refresh(key, loader, policy)
+        else:
+            metrics.CACHE_LOOKUPS.inc(family=policy, result='hit')
+        return entry
+
+    metrics.CACHE_LOOKUPS.inc(family=policy, result='miss')
+    lock_key = _lock_key(key)
+    if consistent(cache).add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+        return _load(key, loader, policy, lock_key)
+
+    # Someone else is already loading this key; wait for their result instead
+    # of sending a second request upstream.
+    deadline = time.time() + settings.CACHE_WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if consistent(cache).get(lock_key) is None:
+            # The load finished without storing anything, so it failed. One
+            # waiter retries it straight away; the rest wait on that retry.
+            if consistent(cache).add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+                entry = cache.get(key)  # Stored just before the lock was released?
+                if entry is not None:
+                    consistent(cache).delete(lock_key)
+                    return entry
+                return _load(key, loader, policy, lock_key)
+
+    # Still loading: only take over if the lock has just been freed, so a slow
+    # upstream never gets every waiter's request at once
+    if consistent(cache).add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+        return _load(key, loader, policy, lock_key)
+    raise requests.exceptions.Timeout(f'Timed out waiting for {key} to be loaded')
+
+
+def _load(key, loader, policy, lock_key):
+    try:
+        return store(key, loader(), policy)
+    finally:
+        consistent(cache).delete(lock_key)
+
+
+def store(key, value, policy):
+    """
+    Snapshot ``value`` and write it under ``key`` with the soft/hard TTLs of
+    ``policy``. ``value`` must be exactly what the view responds with. A TTL
+    of ``None`` never expires.
+    """
+    ttls = get_policy(policy)
+    now = time.time()
+    expires_at = None if ttls['hard_ttl'] is None else now + ttls['hard_ttl']
+    if isinstance(value, Until):
+        expires_at = value.expires_at if expires_at is None else min(expires_at, value.expires_at)
+        value = value.value
+    stale = isinstance(value, Stale)
+    with metrics.phase('serialize'):
+        entry = build_snapshot(value.value if stale else value)
+    entry['stale'] = stale
+    entry['stored_at'] = now
+    entry['expires_at'] = expires_at
+    soft_ttl = settings.CACHE_STALE_RETRY if stale else ttls['soft_ttl']
+    entry['fresh_until'] = min(math.inf if soft_ttl is None else now + soft_ttl, expires_at or math.inf)
+    with metrics.phase('cache'):
+        cache.set(key, entry, _timeout(expires_at))
+    return entry
+
+
+def _timeout(expires_at):
+    # Django cache timeouts: None is forever, and 0 or less deletes the key
+    return None if expires_at is None else max(1, expires_at - time.time())
+
+
+def build_snapshot(value):
+    """
+    Encode ``value`` once into the bytes every request will be served: the
+    JSON ``body``, its ``gzip`` (and, if brotli is installed, ``br``)
+    variants, and an ``etag`` hashed from the body.
+    """
+    body = json.dumps(value, cls=DjangoJSONEncoder).encode()
+    snapshot = {
+        'body': body,
+        'etag': hashlib.blake2b(body, digest_size=16).hexdigest(),
+        'encodings': {},
+    }
+    if len(body) >= settings.SNAPSHOT_COMPRESS_MIN_SIZE:
+        snapshot['encodings']['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            snapshot['encodings']['br'] = brotli.compress(body)
+    return snapshot
+
+
+def snapshot_value(entry):
+    """Decode a snapshot's body back into Python data."""
+    return json.loads(entry['body'])
+
+
+def _lock_key(key):
+    return f'{key}:refresh-lock'
+
+
+def _schedule_refresh(key, loader, policy):
+    lock_key = _lock_key(key)
+    if not consistent(cache).add(lock_key, 1, settings.CACHE_LOCK_TIMEOUT):
+        return  # A refresh is already in flight somewhere
+    if settings.CACHE_REFRESH_ASYNC:
+        _executor.submit(_refresh, key, loader, policy, lock_key)
+    else:
+        _refresh(key, loader, policy, lock_key, close_connections=False)
+
+
+def _refresh(key, loader, policy, lock_key, close_connections=True):
+    try:
+        value = loader()
+        if isinstance(value, Stale):
+            # What we're already serving is at least as good as the fallback
+            _postpone_refresh(key)
+        else:
+            store(key, value, policy)
+    except Exception:
+        # Keep serving the stale value until the hard TTL runs out.
+        logger.exception('Background refresh of %s failed', key)
+        _postpone_refresh(key)
+    finally:
+        consistent(cache).delete(lock_key)
+        if close_connections:
+            # Connections are per thread; don't leak one per refresh worker.
+            connections.close_all()
+
+
+def _postpone_refresh(key):
+    """Don't retry a failed refresh on every request; wait CACHE_STALE_RETRY."""
+    entry = cache.get(key)
+    if entry is None:
+        return
+    if entry['expires_at'] is None or entry['expires_at'] > time.time():
+        entry['fresh_until'] = time.time() + settings.CACHE_STALE_RETRY
+        cache.set(key, entry, _timeout(entry['expires_at']))
@@ -0,0 +1,105 @@
+"""
+The home-screen dashboard: one compact summary of several datasets, each
+resolved through its own cache entry, concurrently.
+
+``gather`` runs every section's ``caching.get_entry`` on a worker thread, so
+on a cold cache the upstream calls overlap and the response takes as long as
+the slowest of them rather than their sum. A section that can't be loaded
+reports its error instead of failing the whole dashboard.
+"""
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+import requests
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from . import caching, queries
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'DASHBOARD_WORKERS', 8),
+    thread_name_prefix='dashboard',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def gather(sections):
+    """
+    Resolve ``sections``, a mapping of name to ``(cache_key, loader, policy,
+    summarize)``, concurrently. Returns ``{name: section}`` where each
+    section is ``{'data', 'stale', 'updated_at'}`` or ``{'error', 'status'}``.
+    """
+    # Each task runs in a copy of the request's context, so its cache and
+    # upstream time is still attributed to the request's metrics
+    futures = {
+        name: _executor.submit(contextvars.copy_context().run, _resolve, *section)
+        for name, section in sections.items()
+    }
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _resolve(cache_key, loader, policy, summarize):
+    try:
+        entry = caching.get_entry(cache_key, loader, policy)
+        return {
+            'data': summarize(caching.snapshot_value(entry)),
+            'stale': entry['stale'],
+            'updated_at': datetime.fromtimestamp(entry['stored_at'], dt_timezone.utc).isoformat(),
+        }
+    except requests.exceptions.RequestException as e:
+        # The error's text can include the request URL, API key and all
+        logger.warning('Dashboard section %s failed: %s', cache_key, e)
+        response = getattr(e, 'response', None)
+        return {'error': 'Upstream request failed', 'status': response.status_code if response is not None else 503}
+    except Exception:
+        logger.exception('Dashboard section %s failed', cache_key)
+        return {'error': 'Internal error', 'status': 500}
+    finally:
+        # Connections are per thread; don't keep one open per worker
+        connections.close_all()
+
+
+def summarize_apod(apod):
+    summary = {key: apod[key] for key in ('date', 'title', 'media_type', 'url') if key in apod}
+    if apod.get('media_type') == 'image':
+        summary['media_url'] = reverse('apod_media', args=[apod['date']])
+    return summary
+
+
+def summarize_launches(payload):
+    return [
+        {key: launch[key] for key in ('launch_id', 'name', 'net', 'status', 'agency')}
+        for launch in payload['results'][:settings.DASHBOARD_LAUNCHES]
+    ]
+
+
+def summarize_asteroids(rows):
+    today = queries.apod_today().isoformat()  # The same day as the dashboard's APOD
+    todays = [row for row in rows if row['close_approach_date'] == today]
+    closest = min(todays, key=lambda row: row['miss_distance_km'], default=None)
+    return {
+        'date': today,
+        'count': len(todays),
+        'hazardous_count': sum(1 for row in todays if row['is_potentially_hazardous']),
+        'closest': closest and {
+            key: closest[key] for key in ('name', 'miss_distance_km', 'diameter_max_meters', 'is_potentially_hazardous')
+        },
+    }
+
+
+def summarize_mars_weather(payload):
+    if not payload['sol_keys']:
+        return None
+    sol = payload['sol_keys'][-1]
+    latest = payload[sol]
+    return {
+        'sol': int(sol),
+        'temperature': latest['AT'],
+        'wind_speed': latest['HWS'],
+        'pressure': latest['PRE']['av'],
+        'first_utc': latest.get('First_UTC'),
+    }
@@ -0,0 +1,56 @@
+"""
+Database setup: the pragmas every SQLite connection gets, and the router that
+sends reads to the read alias and writes to the primary. Reads made inside a
+transaction on the primary stay on it, so they see the transaction's writes.
+
+With SQLite in WAL mode the read alias is a second connection to the same
+file, so readers never wait on an ingestion write. On a server database it
+can point at a replica instead, without changing any queries.
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if not connection.settings_dict.get('READ_ONLY'):
+            cursor.execute('PRAGMA page_count')
+            if cursor.fetchone()[0] == 0:
+                # A new database: turn on incremental vacuum for retention,
+                # which can only be chosen before the first table is created
+                # (`run_retention --full-vacuum` converts an existing one)
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if connection.settings_dict.get('READ_ONLY'):
+            # A write routed here by mistake fails instead of taking the lock
+            cursor.execute('PRAGMA query_only = ON')
+
+
+class ReadWriteRouter:
+    """
+    Reads go to ``DATABASE_READ_ALIAS``, unless this thread is inside a
+    transaction on ``default``; writes and migrations go to ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db  # Follow relations from where the object came from
+        if connections['default'].in_atomic_block:
+            return 'default'  # The read alias can't see uncommitted writes
+        return settings.DATABASE_READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Both aliases hold the same data
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,185 @@
+"""
+Delta sync (``since=``) and sparse fieldsets (``fields=``) for the list
+endpoints.
+
+A response with ``since`` holds only the rows changed after that point, by
+their ``last_updated`` (``created_at`` for favorites), plus the keys of the
+rows deleted since, from the ``Tombstone`` log. Every delta response carries
+a ``sync_token`` to send as the next ``since``. Tokens overlap the previous
+sync by ``SYNC_OVERLAP`` seconds, so a row committed just after a sync read
+the table is sent again rather than missed; clients upsert on the key.
+
+A delta holds at most ``SYNC_PAGE_SIZE`` changed rows, oldest change first.
+When more are waiting the response says ``"has_more": true``, and its
+``sync_token`` picks up from the last row sent.
+
+Tombstones are kept for ``SYNC_TOMBSTONE_DAYS``. A ``since`` older than that
+can't be answered as a delta, so the response is a full listing flagged with
+``"reset": true``.
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import CachedAsteroid, CachedLaunch, Favorite, Tombstone
+
+# dataset: (model, key field, change timestamp field)
+DATASETS = {
+    'launches': (CachedLaunch, 'launch_id', 'last_updated'),
+    'asteroids': (CachedAsteroid, 'neo_reference_id', 'last_updated'),
+    'favorites': (Favorite, 'id', 'created_at'),
+}
+
+FAVORITE_FIELDS = ('id', 'created_at')
+FAVORITE_APOD_FIELDS = ('id', 'title', 'explanation', 'url', 'hdurl', 'date', 'copyright', 'media_type')
+
+
+def dataset_for(model):
+    for name, (dataset_model, _, _) in DATASETS.items():
+        if dataset_model is model:
+            return name
+    return None
+
+
+def delete(queryset):
+    """
+    Delete ``queryset``, logging a tombstone for each row in the same
+    transaction if its model is a synced dataset. Returns the number of rows
+    deleted.
+    """
+    dataset = dataset_for(queryset.model)
+    with transaction.atomic(savepoint=False):
+        if dataset is not None:
+            key = DATASETS[dataset][1]
+            user_field = 'user_id' if dataset == 'favorites' else None
+            columns = (key, user_field) if user_field else (key,)
+            now = timezone.now()
+            Tombstone.objects.bulk_create([
+                Tombstone(dataset=dataset, key=str(row[0]), user_id=row[1] if user_field else None, deleted_at=now)
+                for row in queryset.values_list(*columns)
+            ], batch_size=settings.INGEST_BATCH_SIZE)
+        return queryset.delete()[0]
+
+
+def encode_token(moment):
+    raw = json.dumps({'t': moment.isoformat()}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def parse_since(params):
+    """
+    ``since`` as an aware datetime, from either a ``sync_token`` or an ISO
+    8601 timestamp, or ``None`` if absent. Raises ``ValueError`` on bad input.
+    """
+    value = params.get('since')
+    if not value:
+        return None
+    moment = _parse_timestamp(value)
+    if moment is None:
+        try:
+            padded = value + '=' * (-len(value) % 4)
+            moment = _parse_timestamp(json.loads(base64.urlsafe_b64decode(padded))['t'])
+        except (ValueError, KeyError, TypeError):
+            moment = None
+    if moment is None:
+        raise ValueError('since must be a sync_token or an ISO 8601 timestamp')
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.utc)
+    return moment
+
+
+def _parse_timestamp(value):
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        return None
+
+
+def parse_fields(params, allowed, key):
+    """
+    The columns named in ``fields`` (comma separated), always including
+    ``key`` so clients can merge rows, or ``None`` for every column. Raises
+    ``ValueError`` for unknown names.
+    """
+    value = params.get('fields')
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}; must be among: {", ".join(allowed)}')
+    return [key] + [name for name in fields if name != key]
+
+
+def model_fields(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def changes(dataset, queryset, since, fields=None, user=None):
+    """
+    The delta of ``queryset`` after ``since`` as ``{'results', 'deleted',
+    'sync_token'}`` (plus ``'reset'`` when ``since`` is older than the
+    tombstone log, and ``'has_more'`` when the delta is cut off at
+    ``SYNC_PAGE_SIZE`` rows), with ``results`` projected to ``fields``.
+    """
+    _, key, changed_field = DATASETS[dataset]
+    # Taken before reading, so a row written meanwhile shows up next time
+    token = encode_token(timezone.now() - timedelta(seconds=settings.SYNC_OVERLAP))
+    reset = since is not None and since < timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_DAYS)
+
+    if since is None or reset:
+        payload = {'results': list(queryset.values(*(fields or ()))), 'deleted': [], 'sync_token': token}
+        if reset:
+            payload['reset'] = True
+        return payload
+
+    tombstones = Tombstone.objects.filter(dataset=dataset, deleted_at__gt=since)
+    if user is not None:
+        tombstones = tombstones.filter(user=user)
+    deleted = list(tombstones.order_by('deleted_at').values_list('key', flat=True).distinct())
+
+    columns = list(fields or model_fields(queryset.model))
+    extra = [] if changed_field in columns else [changed_field]
+    changed = queryset.filter(**{f'{changed_field}__gt': since}).order_by(changed_field, 'pk')
+    rows = list(changed.values(*columns, *extra)[:settings.SYNC_PAGE_SIZE + 1])
+    has_more = len(rows) > settings.SYNC_PAGE_SIZE
+    if has_more:
+        rows = rows[:settings.SYNC_PAGE_SIZE]
+        # Resend the last row's instant, in case rows after it share it
+        token = encode_token(rows[-1][changed_field] - timedelta(microseconds=1))
+    if extra:
+        for row in rows:
+            del row[changed_field]
+
+    payload = {'results': rows, 'deleted': deleted, 'sync_token': token}
+    if has_more:
+        payload['has_more'] = True
+    return payload
+
+
+def favorite_fields(params):
+    """
+    ``fields`` for favorites: their own ``id``/``created_at`` and their
+    APOD's columns (``title``, ``date``...), as ``.values()`` lookups.
+    """
+    allowed = FAVORITE_FIELDS + tuple(f'apod.{name}' for name in FAVORITE_APOD_FIELDS)
+    fields = parse_fields(params, allowed, 'id')
+    if fields is None:
+        fields = list(allowed)
+    return [name.replace('.', '__') for name in fields]
+
+
+def nest_favorite(row):
+    """Turn a ``.values()`` row of ``favorite_fields`` into the API's shape."""
+    favorite = {}
+    for name, value in row.items():
+        if name.startswith('apod__'):
+            favorite.setdefault('apod', {})[name[len('apod__'):]] = value
+        else:
+            favorite[name] = value
+    return favorite
@@ -0,0 +1,227 @@
+"""
+In-process fake NASA (APOD, NeoWs, InSight) and SpaceDevs upstreams, for the
+test suite and ``manage.py benchmark``.
+
+``FakeUpstreams`` serves the same paths as the real APIs from a threaded HTTP
+server on localhost, with configurable latency and error rate, and counts the
+requests it receives. ``settings_override()`` returns the ``UPSTREAM_HOSTS``
+that point the upstream client at it.
+"""
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .queries import apod_today
+
+
+def apod_payload(day):
+    return {
+        'date': day.isoformat(),
+        'title': f'Astronomy Picture {day.isoformat()}',
+        'explanation': 'A fake picture of space. ' * 20,
+        'url': f'https://apod.nasa.gov/apod/image/{day:%y%m%d}.jpg',
+        'hdurl': f'https://apod.nasa.gov/apod/image/{day:%y%m%d}_hd.jpg',
+        'media_type': 'image',
+        'copyright': 'Fake Observatory',
+        'service_version': 'v1',
+    }
+
+
+def neo_feed_payload(start, end, per_day=15):
+    days = {}
+    day = start
+    while day <= end:
+        days[day.isoformat()] = [
+            {
+                'neo_reference_id': f'{day:%Y%m%d}{n:03d}',
+                'name': f'({day.year} {day:%m%d}-{n})',
+                'estimated_diameter': {'meters': {'estimated_diameter_max': 10.0 + n * 7.5}},
+                'is_potentially_hazardous_asteroid': n % 7 == 0,
+                'close_approach_data': [{
+                    'close_approach_date': day.isoformat(),
+                    'miss_distance': {'kilometers': str(250000.0 * (n + 1))},
+                }],
+            }
+            for n in range(per_day)
+        ]
+        day += timedelta(days=1)
+    return {'element_count': per_day * len(days), 'near_earth_objects': days}
+
+
+def insight_payload(first_sol=675, sols=7):
+    payload = {'sol_keys': []}
+    for offset in range(sols):
+        sol = str(first_sol + offset)
+        payload['sol_keys'].append(sol)
+        payload[sol] = {
+            'AT': {'av': -60.0 - offset, 'mn': -95.0 - offset, 'mx': -15.0 + offset},
+            'HWS': {'av': 6.5 + offset * 0.2, 'mx': 20.0 + offset},
+            'PRE': {'av': 750.0 + offset},
+            'First_UTC': f'2020-10-{10 + offset:02d}T18:00:00Z',
+            'Last_UTC': f'2020-10-{11 + offset:02d}T18:40:00Z',
+            'WD': {'most_common': {'compass_point': 'WNW', 'compass_degrees': 292.5}},
+            'Season': 'summer',
+        }
+    return payload
+
+
+def launches_payload(count=20):
+    base = date(2030, 1, 1)
+    return {
+        'count': count,
+        'next': None,
+        'results': [
+            {
+                'id': f'00000000-0000-0000-0000-{n:012d}',
+                'name': f'Rocket {n} | Payload {n}',
+                'net': f'{base + timedelta(days=n)}T12:00:00Z',
+                'last_updated': '2029-12-01T00:00:00Z',
+                'status': {'name': 'Go for Launch'},
+                'mission': {'name': f'Payload {n}'},
+                'rocket': {'configuration': {'name': f'Rocket {n % 4}'}},
+                'pad': {'name': f'Pad {n % 3}'},
+                'launch_service_provider': {'name': f'Agency {n % 5}'},
+            }
+            for n in range(count)
+        ],
+    }
+
+
+def image_payload(path, size=256 * 1024):
+    # Deterministic bytes per path, standing in for a JPEG
+    seed = path.encode()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class FakeUpstreams:
+    """
+    A fake upstream server. ``latency`` (seconds) is added to every response;
+    ``error_rate`` is the fraction of requests answered with a 503.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def total_requests(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real upstreams
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def settings_override(self):
+        """``UPSTREAM_HOSTS`` with every host pointed at this server."""
+        return {
+            name: dict(config, base_url=self.base_url)
+            for name, config in settings.UPSTREAM_HOSTS.items()
+        }
+
+    def _handle(self, handler):
+        url = urlparse(handler.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self._lock:
+            self.requests[url.path] = self.requests.get(url.path, 0) + 1
+            fail = self._random.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return self._respond(handler, 503, {'error': 'Service Unavailable'})
+
+        if url.path.startswith('/apod/image/'):
+            return self._respond(handler, 200, image_payload(url.path), 'image/jpeg')
+        payload = self._payload(url.path, params)
+        if payload is None:
+            return self._respond(handler, 404, {'error': 'Not Found'})
+        self._respond(handler, 200, payload)
+
+    def _payload(self, path, params):
+        if path == '/planetary/apod':
+            if 'start_date' in params:
+                start = date.fromisoformat(params['start_date'])
+                end = date.fromisoformat(params.get('end_date', apod_today().isoformat()))
+                return [apod_payload(start + timedelta(days=n)) for n in range((end - start).days + 1)]
+            # Like NASA, "today" is the date where APOD publishes
+            day = date.fromisoformat(params['date']) if 'date' in params else apod_today()
+            return apod_payload(day)
+        if path == '/neo/rest/v1/feed':
+            start = date.fromisoformat(params['start_date']) if 'start_date' in params else date.today()
+            end = date.fromisoformat(params['end_date']) if 'end_date' in params else start + timedelta(days=7)
+            return neo_feed_payload(start, end)
+        if path == '/insight_weather/':
+            return insight_payload()
+        if path.endswith('/launches/upcoming/'):
+            return self._launches_page(params)
+        return None
+
+    def _launches_page(self, params):
+        launches = launches_payload()['results']
+        if 'last_updated__gte' in params:
+            since = parse_datetime(params['last_updated__gte'])
+            launches = [launch for launch in launches if parse_datetime(launch['last_updated']) >= since]
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 10))
+        more = offset + limit < len(launches)
+        return {
+            'count': len(launches),
+            'next': f'{self.base_url}/?offset={offset + limit}' if more else None,
+            'results': launches[offset:offset + limit],
+        }
+
+    def _respond(self, handler, status, payload, content_type='application/json'):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.send_header('X-RateLimit-Remaining', '1000')
+        handler.end_headers()
+        handler.wfile.write(body)
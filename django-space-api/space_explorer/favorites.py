@@ -0,0 +1,198 @@
+"""
+Per-user favorites: cached list pages with versioned invalidation, and
+batch favorite/unfavorite.
+
+Favorites name APODs by date only. The APOD rows they point at are the stored
+ones, or fetched from NASA; never built from what the client sent, since
+every other user is served those rows.
+
+Every user has a version number in the shared cache, and each cached page of
+their list is keyed by it. A write bumps the version, which orphans every
+cached page at once; nothing has to find and delete them, and they age out
+after ``FAVORITES_CACHE_TTL``. Because an entry under a given version never
+changes, pages are written straight to the shared tier and no worker's L1
+copy of one is ever out of date.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from . import caching, delta, ingest, metrics, queries
+from .cache_backends import consistent
+from .models import APOD, Favorite
+
+SORTS = ('created_at', '-created_at')
+
+
+def _version_key(user_id):
+    return f'favorites:{user_id}:version'
+
+
+def version(user_id):
+    shared = consistent(cache)
+    current = shared.get(_version_key(user_id))
+    if current is None:
+        # Start from the clock, so a version lost to eviction is never reused
+        shared.add(_version_key(user_id), time.time_ns(), None)
+        current = shared.get(_version_key(user_id))
+    return current
+
+
+def invalidate(user_id):
+    """Orphan every cached page of the user's favorites."""
+    try:
+        consistent(cache).incr(_version_key(user_id))
+    except ValueError:
+        consistent(cache).add(_version_key(user_id), time.time_ns(), None)
+
+
+def list_key(user_id, params):
+    """Cache key of one page: the user's current version plus the normalized query."""
+    query = '&'.join(f'{name}={params.get(name, "")}' for name in ('fields', 'explanation', 'sort', 'limit', 'cursor'))
+    digest = hashlib.blake2b(query.encode(), digest_size=12).hexdigest()
+    return f'favorites:{user_id}:v{version(user_id)}:{digest}'
+
+
+def get_entry(user_id, params, loader):
+    """The cached snapshot of a list page, built with ``loader()`` on a miss."""
+    key = list_key(user_id, params)
+    with metrics.phase('cache'):
+        entry = cache.get(key)
+    if entry is not None:
+        metrics.CACHE_LOOKUPS.inc(family='favorites', result='hit')
+        return entry
+
+    metrics.CACHE_LOOKUPS.inc(family='favorites', result='miss')
+    value = loader()
+    with metrics.phase('serialize'):
+        entry = caching.build_snapshot(value)
+    entry.update(stale=False, stored_at=time.time())
+    with metrics.phase('cache'):
+        consistent(cache).set(key, entry, settings.FAVORITES_CACHE_TTL)
+    return entry
+
+
+def parse_list_params(params):
+    """
+    ``(fields, sort)`` for a list request. ``explanation=false`` defers each
+    APOD's explanation, the longest column, to ``apod/?date=``. Raises
+    ``ValueError`` on bad input.
+    """
+    fields = delta.favorite_fields(params)
+    if params.get('explanation', '').lower() in ('0', 'false', 'no'):
+        fields = [name for name in fields if name != 'apod__explanation']
+    sort = params.get('sort', 'created_at')
+    if sort not in SORTS:
+        raise ValueError(f'sort must be one of: {", ".join(SORTS)}')
+    return fields, sort
+
+
+def list_page(user, fields, sort, params):
+    """
+    The user's favorites as the list endpoint returns them. Paged by a
+    ``created_at`` cursor when ``limit`` or ``cursor`` is given; otherwise
+    the whole list, as before pagination existed.
+    """
+    favorites = Favorite.objects.filter(user=user)
+    if 'limit' not in params and 'cursor' not in params:
+        rows = favorites.order_by(sort, 'id' if sort == 'created_at' else '-id').values(*fields)
+        return {'status': 'success', 'favorites': [delta.nest_favorite(row) for row in rows]}
+
+    limit = queries.parse_limit(params)
+    columns = fields if 'created_at' in fields else fields + ['created_at']
+    rows, next_cursor = queries.keyset_page(favorites.values(*columns), sort, params.get('cursor'), limit)
+    if 'created_at' not in fields:
+        for row in rows:
+            del row['created_at']
+    return {
+        'status': 'success',
+        'favorites': [delta.nest_favorite(row) for row in rows],
+        'next_cursor': next_cursor,
+    }
+
+
+def parse_favorite_date(entry, today):
+    """The APOD date an ``{'date': ...}`` favorite names. Raises ``ValueError``."""
+    if not isinstance(entry, dict) or not entry.get('date'):
+        raise ValueError('Each favorite needs a date')
+    try:
+        return queries.parse_apod_date(entry, today)
+    except TypeError:
+        raise ValueError('date must be a YYYY-MM-DD date')
+
+
+def resolve_apods(days):
+    """
+    ``{date: APOD id}`` for ``days``: the stored APODs, with the missing ones
+    fetched from NASA a range request at a time. Days NASA has no APOD for
+    are left out. Upstream failures propagate.
+    """
+    days = sorted(set(days))
+    if not days:
+        return {}
+    resolved = dict(APOD.objects.filter(date__in=days).values_list('date', 'id'))
+    missing = [day for day in days if day not in resolved]
+    if missing:
+        for start, end in ingest.apod_chunks(missing[0], missing[-1], settings.APOD_RANGE_MAX_DAYS):
+            wanted = [day for day in missing if start <= day <= end]
+            if wanted:
+                ingest.fetch_apod_range(wanted[0], wanted[-1])
+        resolved.update(APOD.objects.using('default').filter(date__in=missing).values_list('date', 'id'))
+    return resolved
+
+
+def validate_batch(data, today):
+    """
+    ``(days, apod_ids)`` from a batch request body: the dates of APODs to
+    favorite, as ``{'date': ...}`` objects, and APOD ids to unfavorite. Any
+    other fields of a favorite are ignored. Raises ``ValueError`` on bad
+    input.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    entries = data.get('favorite', [])
+    apod_ids = data.get('unfavorite', [])
+    if not isinstance(entries, list) or not isinstance(apod_ids, list):
+        raise ValueError('favorite and unfavorite must be lists')
+    if len(entries) + len(apod_ids) > settings.FAVORITES_BATCH_MAX:
+        raise ValueError(f'Batches are limited to {settings.FAVORITES_BATCH_MAX} items')
+    days = [parse_favorite_date(entry, today) for entry in entries]
+    if not all(isinstance(apod_id, int) for apod_id in apod_ids):
+        raise ValueError('unfavorite must list APOD ids')
+    return days, apod_ids
+
+
+def apply_batch(user, favorite_ids, apod_ids):
+    """
+    Favorite the APODs ``favorite_ids`` and unfavorite ``apod_ids`` for
+    ``user`` in one transaction, with a handful of queries however large the
+    batch. Returns ``(favorited, unfavorited)``: ``{'apod_id',
+    'favorite_id'}`` for every favorite asked for (new or existing), and the
+    APOD ids actually removed.
+    """
+    # Every read in here is pinned to the primary: the read alias can't see
+    # the rows this transaction has just written
+    with transaction.atomic(using='default'):
+        favorited = []
+        if favorite_ids:
+            # A bulk insert that skips favorites already there, then one read back
+            Favorite.objects.bulk_create(
+                [Favorite(user=user, apod_id=apod_id) for apod_id in favorite_ids],
+                batch_size=settings.INGEST_BATCH_SIZE, ignore_conflicts=True,
+            )
+            favorited = [
+                {'apod_id': apod_id, 'favorite_id': favorite_id}
+                for favorite_id, apod_id in Favorite.objects.using('default').filter(user=user, apod_id__in=favorite_ids)
+                .order_by('apod_id').values_list('id', 'apod_id')
+            ]
+
+        unfavorited = []
+        if apod_ids:
+            removed = Favorite.objects.using('default').filter(user=user, apod_id__in=apod_ids)
+            unfavorited = sorted(removed.values_list('apod_id', flat=True))
+            delta.delete(removed)
+
+    invalidate(user.id)
+    return favorited, unfavorited
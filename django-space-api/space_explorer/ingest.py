@@ -0,0 +1,395 @@
+"""
+Upstream ingestion for the cached datasets.
+
+The ``fetch_*`` functions pull a dataset from its upstream and write it to the
+database. ``refresh`` additionally primes the view's cache key, and is what the
+``run_ingestion`` scheduler calls so request handlers only ever read.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import cache_backends, caching, delta, media, upstream
+from .models import APOD, CachedAsteroid, CachedLaunch, CachedMarsWeather, SyncCheckpoint
+from .queries import APOD_FIRST_DATE
+
+logger = logging.getLogger(__name__)
+
+INSIGHT_PARAMS = {'feedtype': 'json', 'ver': '1.0'}
+NEO_FEED_MAX_DAYS = 7  # Longest window NeoWs serves in one feed request
+NEO_FEED_DAY_TTL = 86400
+LAUNCH_PAGE_SIZE = 100  # Largest page SpaceDevs serves
+
+
+class EmptyFeed(requests.exceptions.RequestException):
+    """An upstream answered with no data; handled like the upstream being down."""
+
+
+def bulk_upsert(model, rows, unique_fields):
+    """
+    Insert or update ``rows`` (dicts of field values) in one transaction,
+    using batched ``INSERT ... ON CONFLICT DO UPDATE`` keyed on
+    ``unique_fields``. Returns the rows as written, with ``last_updated``
+    filled in, so callers can serve them without reading them back.
+    """
+    if not rows:
+        return []
+
+    objs = [model(**row) for row in rows]
+    update_fields = [name for name in rows[0] if name not in unique_fields]
+    update_fields.append('last_updated')
+    with transaction.atomic():
+        model.objects.bulk_create(
+            objs,
+            batch_size=settings.INGEST_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
+        )
+
+    # auto_now is applied to the instances during the insert
+    for row, obj in zip(rows, objs):
+        row['last_updated'] = obj.last_updated
+    return rows
+
+
+def get_checkpoint(name):
+    """The saved state of the named sync, or ``{}`` if it has never run."""
+    checkpoint = SyncCheckpoint.objects.filter(name=name).first()
+    return checkpoint.state if checkpoint else {}
+
+
+def save_checkpoint(name, state):
+    SyncCheckpoint.objects.update_or_create(name=name, defaults={'state': state})
+
+
+def launch_row(launch):
+    """Map a SpaceDevs launch onto ``CachedLaunch`` fields, or ``None``."""
+    net = parse_datetime(launch.get('net') or '')
+    if not launch.get('id') or net is None:
+        return None  # Can't be keyed or scheduled
+    return {
+        'launch_id': launch['id'],
+        'name': launch.get('name', 'Unnamed Launch'),
+        'net': net,
+        'status': launch.get('status', {}).get('name', 'Status unknown'),
+        'mission': (launch.get('mission') or {}).get('name', 'No mission'),
+        'rocket': launch.get('rocket', {}).get('configuration', {}).get('name', 'Unknown rocket'),
+        'pad': launch.get('pad', {}).get('name', 'Unknown pad'),
+        'agency': launch.get('launch_service_provider', {}).get('name', 'Unknown agency'),
+        'upstream_updated': parse_datetime(launch.get('last_updated') or ''),
+    }
+
+
+def fetch_launches():
+    """
+    Sync upcoming launches: ask SpaceDevs only for launches updated since the
+    last sync (all of them on the first), page through the changes, upsert
+    them on their launch id and prune launches that have flown. Returns the
+    rows that changed.
+    """
+    since = get_checkpoint('launches').get('last_updated')
+    params = {
+        'mode': 'detailed',
+        'limit': LAUNCH_PAGE_SIZE,
+        'ordering': 'last_updated',  # Oldest change first, so a cut-short sync can resume
+        'hide_recent_previous': 'true',
+    }
+    if since:
+        params['last_updated__gte'] = since
+
+    changed = {}
+    newest = parse_datetime(since) if since else None
+    for page in range(settings.LAUNCH_SYNC_MAX_PAGES):
+        response = upstream.get_json('launches_upcoming', dict(params, offset=page * LAUNCH_PAGE_SIZE))
+        for launch in response.get('results', []):
+            row = launch_row(launch)
+            if row is None:
+                continue
+            changed[row['launch_id']] = row  # Paging over moving data can repeat a launch
+            if row['upstream_updated'] and (newest is None or row['upstream_updated'] > newest):
+                newest = row['upstream_updated']
+        if not response.get('next'):
+            break
+
+    rows = bulk_upsert(CachedLaunch, list(changed.values()), ['launch_id'])
+    prune_launches()
+    save_checkpoint('launches', {'last_updated': newest.isoformat() if newest else None})
+    return rows
+
+
+def prune_launches():
+    """Drop launches whose NET passed more than ``LAUNCH_PRUNE_AFTER`` ago."""
+    cutoff = timezone.now() - timedelta(seconds=settings.LAUNCH_PRUNE_AFTER)
+    return delta.delete(CachedLaunch.objects.filter(net__lt=cutoff))
+
+
+def upcoming_launches():
+    cutoff = timezone.now() - timedelta(seconds=settings.LAUNCH_PRUNE_AFTER)
+    return list(CachedLaunch.objects.filter(net__gte=cutoff).order_by('net').values())
+
+
+def fetch_mars_weather():
+    data = upstream.get_json('insight_weather', INSIGHT_PARAMS)
+
+    # Validate response
+    sol_keys = data.get('sol_keys', [])
+    if not sol_keys:
+        raise EmptyFeed('No Mars weather data available')
+
+    rows = []
+    for sol in sol_keys:
+        sol_data = data.get(sol, {})
+        row = {
+            'sol': int(sol),  # Convert sol to an integer
+            'temperature': sol_data.get('AT', {}).get('av', None),
+            'temperature_min': sol_data.get('AT', {}).get('mn', None),
+            'temperature_max': sol_data.get('AT', {}).get('mx', None),
+            'wind_speed': sol_data.get('HWS', {}).get('av', None),
+            'wind_speed_max': sol_data.get('HWS', {}).get('mx', None),
+            'pressure': sol_data.get('PRE', {}).get('av', None),
+            'first_utc': parse_datetime(sol_data.get('First_UTC') or ''),
+            'last_utc': parse_datetime(sol_data.get('Last_UTC') or ''),
+            'most_common_wind_direction': sol_data.get('WD', {}).get('most_common', {}).get('compass_point', None),
+        }
+        if None in (row['temperature'], row['wind_speed'], row['pressure']):
+            continue  # Sols with missing sensor averages can't be stored
+        rows.append(row)
+    return bulk_upsert(CachedMarsWeather, rows, ['sol'])
+
+
+def apod_row(entry):
+    """Map an APOD API entry onto ``APOD`` model fields."""
+    return {
+        'date': parse_date(entry['date']),
+        'title': entry['title'],
+        'explanation': entry['explanation'],
+        'url': entry['url'],
+        'hdurl': entry.get('hdurl', ''),
+        'media_type': entry.get('media_type', 'image'),
+        'copyright': entry.get('copyright', ''),
+    }
+
+
+def save_apods(entries):
+    """
+    Store APOD API entries that aren't in the database yet. APODs never change
+    once published, so existing dates are left alone. Recent images are
+    prefetched into the media cache.
+    """
+    objs = [APOD(**apod_row(entry)) for entry in entries]
+    APOD.objects.bulk_create(objs, batch_size=settings.INGEST_BATCH_SIZE, ignore_conflicts=True)
+    media.prefetch(entries)
+
+
+def fetch_apod_range(start, end):
+    """Fetch and store every APOD from ``start`` to ``end`` in one request."""
+    entries = upstream.get_json('apod', {
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+    })
+    save_apods(entries)
+    return entries
+
+
+def apod_chunks(start, end, chunk_days):
+    """
+    Split [start, end] into (start, end) windows of ``chunk_days`` days. The
+    windows are aligned to the first APOD, so runs over overlapping ranges
+    split them the same way.
+    """
+    origin = APOD_FIRST_DATE
+    offset = (start - origin).days // chunk_days * chunk_days
+    chunk_start = origin + timedelta(days=offset)
+    chunks = []
+    while chunk_start <= end:
+        chunk_end = chunk_start + timedelta(days=chunk_days - 1)
+        chunks.append((max(chunk_start, start), min(chunk_end, end)))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def stored_apod_days(start, end):
+    return APOD.objects.filter(date__range=(start, end)).count()
+
+
+def parse_neo_feed(data):
+    rows = []
+    for neo in data['near_earth_objects'].values():
+        for item in neo:
+            rows.append({
+                'neo_reference_id': item['neo_reference_id'],
+                'name': item['name'],
+                'diameter_max_meters': item['estimated_diameter']['meters']['estimated_diameter_max'],
+                'is_potentially_hazardous': item['is_potentially_hazardous_asteroid'],
+                'close_approach_date': parse_date(item['close_approach_data'][0]['close_approach_date']),
+                'miss_distance_km': float(item['close_approach_data'][0]['miss_distance']['kilometers']),
+            })
+    return rows
+
+
+def fetch_asteroids():
+    data = upstream.get_json('neo_feed')
+    return bulk_upsert(CachedAsteroid, parse_neo_feed(data), ['neo_reference_id'])
+
+
+def neo_feed_windows(dates):
+    """
+    Group sorted ``dates`` into (start, end) windows of consecutive days no
+    longer than the 7 days a single NeoWs feed request may span.
+    """
+    windows = []
+    for day in dates:
+        if windows:
+            start, end = windows[-1]
+            if day == end + timedelta(days=1) and (day - start).days < NEO_FEED_MAX_DAYS:
+                windows[-1] = (start, day)
+                continue
+        windows.append((day, day))
+    return windows
+
+
+def fetch_asteroid_dates(dates):
+    """
+    Fetch the NeoWs feed for every date in ``dates``, one request per 7-day
+    window, with the windows requested concurrently. Each window's rows are
+    written, and its days recorded as fetched, as soon as it comes back, so a
+    failed window doesn't waste the requests that succeeded.
+
+    Returns ``(rows, missing)``: the rows written and the days of the windows
+    that failed. Raises the first error if every window failed.
+    """
+    windows = neo_feed_windows(sorted(dates))
+    if not windows:
+        return [], []
+
+    def fetch_window(window):
+        start, end = window
+        return upstream.get_json('neo_feed', {
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+        })
+
+    rows = []
+    missing = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=settings.NEO_FEED_WORKERS) as executor:
+        futures = {executor.submit(fetch_window, window): window for window in windows}
+        for future in as_completed(futures):
+            start, end = futures[future]
+            days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+            try:
+                feed = future.result()
+            except requests.exceptions.RequestException as e:
+                errors.append(e)
+                missing.extend(days)
+                continue
+            # Written from this thread only, as each window arrives
+            rows.extend(bulk_upsert(CachedAsteroid, parse_neo_feed(feed), ['neo_reference_id']))
+            # Remember which days were fetched, so days with no close
+            # approaches aren't requested again on every query.
+            cache.set_many({f'neo_feed_day_{day}': True for day in days}, NEO_FEED_DAY_TTL)
+
+    if len(errors) == len(windows):
+        raise errors[0]
+    if errors:
+        logger.warning('%d of %d NeoWs windows failed', len(errors), len(windows), exc_info=errors[0])
+    return rows, sorted(missing)
+
+
+def missing_asteroid_dates(start, end):
+    """Dates in [start, end] that have neither stored rows nor a recent fetch."""
+    stored = set(
+        CachedAsteroid.objects.filter(close_approach_date__range=(start, end))
+        .values_list('close_approach_date', flat=True)
+        .distinct()
+    )
+    days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+    candidates = [day for day in days if day not in stored]
+    fetched = cache.get_many([f'neo_feed_day_{day}' for day in candidates])
+    return [day for day in candidates if f'neo_feed_day_{day}' not in fetched]
+
+
+COMPASS_POINTS = ('N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE', 'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW')
+
+
+def recent_mars_weather():
+    """The latest ``MARS_WEATHER_SOLS`` stored sols, oldest first."""
+    rows = CachedMarsWeather.objects.order_by('-sol').values()[:settings.MARS_WEATHER_SOLS]
+    return list(rows)[::-1]
+
+
+def insight_payload(rows):
+    """Stored sols in the InSight API's shape, which the app reads."""
+    payload = {'sol_keys': []}
+    for row in rows:
+        sol = str(row['sol'])
+        temperature = {'av': row['temperature']}
+        if row['temperature_min'] is not None:
+            temperature['mn'] = row['temperature_min']
+        if row['temperature_max'] is not None:
+            temperature['mx'] = row['temperature_max']
+        wind = {'av': row['wind_speed']}
+        if row['wind_speed_max'] is not None:
+            wind['mx'] = row['wind_speed_max']
+        data = {'AT': temperature, 'HWS': wind, 'PRE': {'av': row['pressure']}}
+        if row['first_utc']:
+            data['First_UTC'] = row['first_utc'].strftime('%Y-%m-%dT%H:%M:%SZ')
+        if row['last_utc']:
+            data['Last_UTC'] = row['last_utc'].strftime('%Y-%m-%dT%H:%M:%SZ')
+        point = row['most_common_wind_direction']
+        if point:
+            most_common = {'compass_point': point}
+            if point in COMPASS_POINTS:
+                most_common['compass_degrees'] = COMPASS_POINTS.index(point) * 22.5
+            data['WD'] = {'most_common': most_common}
+        payload['sol_keys'].append(sol)
+        payload[sol] = data
+    return payload
+
+
+def mars_weather_payload(rows):
+    # The fetched sols have been merged into the store; serve the latest
+    # ones from there, so a sol the feed has since dropped is still shown.
+    return insight_payload(recent_mars_weather())
+
+
+def launches_payload(rows):
+    # The launches endpoint wraps its rows in an object
+    return {'results': rows}
+
+
+def synced_launches_payload(rows):
+    # A sync returns only the launches that changed; serve every stored one
+    return launches_payload(upcoming_launches())
+
+
+DATASETS = {
+    'launches': {
+        'fetch': fetch_launches, 'cache_key': 'launches_data', 'policy': 'launches',
+        'payload': synced_launches_payload,
+    },
+    'asteroids': {'fetch': fetch_asteroids, 'cache_key': 'asteroids_data', 'policy': 'asteroids'},
+    'mars_weather': {
+        'fetch': fetch_mars_weather, 'cache_key': 'mars_weather_data', 'policy': 'mars_weather',
+        'payload': mars_weather_payload,
+    },
+}
+
+
+def refresh(name):
+    """Fetch the named dataset, write it to the DB and prime its cache key."""
+    dataset = DATASETS[name]
+    rows = dataset['fetch']()
+    payload = dataset['payload'](rows) if 'payload' in dataset else rows
+    caching.store(dataset['cache_key'], payload, dataset['policy'])
+    # Every worker serves it now, not once its L1 copy ages out
+    cache_backends.invalidate(cache)
+    return rows
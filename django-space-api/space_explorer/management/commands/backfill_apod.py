@@ -0,0 +1,122 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from space_explorer import ingest, upstream
+from space_explorer.breaker import CircuitOpen
+from space_explorer.quota import QuotaExceeded
+from space_explorer.queries import APOD_FIRST_DATE, apod_today
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT = 'apod_backfill'
+
+
+def date_argument(value):
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+
+class Command(BaseCommand):
+    help = (
+        'Backfill the APOD archive: fetch a date range in start_date/end_date '
+        'chunks on a bounded pool of workers, store each chunk as it arrives '
+        'and checkpoint it, so an interrupted run picks up where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date_argument, default=APOD_FIRST_DATE, help='First date (YYYY-MM-DD).')
+        parser.add_argument('--end', type=date_argument, help='Last date (default: today).')
+        parser.add_argument(
+            '--chunk-days', type=int, default=settings.APOD_BACKFILL_CHUNK_DAYS, help='Days fetched per request.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.APOD_BACKFILL_WORKERS, help='Requests in flight at once.',
+        )
+        parser.add_argument(
+            '--budget', type=int, default=settings.APOD_BACKFILL_BUDGET,
+            help='Most upstream requests this run may make; rerun to continue.',
+        )
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and refetch every chunk.')
+
+    def handle(self, *args, **options):
+        today = apod_today()  # NASA's today, which isn't always UTC's
+        start = max(options['start'], APOD_FIRST_DATE)
+        end = min(options['end'] or today, today)
+        if end < start:
+            raise CommandError('--end must not be before --start')
+        if options['chunk_days'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-days and --workers must be at least 1')
+
+        done = [] if options['restart'] else ingest.get_checkpoint(CHECKPOINT).get('done', [])
+        pending = [
+            chunk for chunk in ingest.apod_chunks(start, end, options['chunk_days'])
+            if not self.is_done(chunk, done)
+        ]
+        self.stdout.write(f'{len(pending)} chunks to fetch between {start} and {end}')
+
+        budget = options['budget']
+        failed = []
+        stopped = None
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='apod-backfill') as executor:
+            in_flight = {}
+            try:
+                while pending or in_flight:
+                    # Keep the pool full while there's budget for more requests
+                    while pending and len(in_flight) < options['workers'] and budget > 0 and stopped is None:
+                        chunk = pending.pop(0)
+                        in_flight[executor.submit(self.fetch, *chunk)] = chunk
+                        budget -= 1
+                    if not in_flight:
+                        break
+
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        chunk = in_flight.pop(future)
+                        try:
+                            entries = future.result()
+                        except (QuotaExceeded, CircuitOpen) as e:
+                            stopped = str(e)
+                            pending.insert(0, chunk)
+                            continue
+                        except requests.exceptions.RequestException as e:
+                            logger.warning('Fetching APODs %s to %s failed: %s', *chunk, e)
+                            failed.append(chunk)
+                            continue
+                        # Written here, one chunk at a time, so the workers
+                        # never compete for the database's write lock
+                        ingest.save_apods(entries)
+                        done.append([chunk[0].isoformat(), chunk[1].isoformat()])
+                        ingest.save_checkpoint(CHECKPOINT, {'done': done})
+                        self.stdout.write(f'{chunk[0]} to {chunk[1]}: {len(entries)} APODs')
+            except KeyboardInterrupt:
+                for future in in_flight:
+                    future.cancel()
+                self.stdout.write('Interrupted; rerun to resume from the checkpoint.')
+                return
+
+        remaining = len(pending) + len(failed)
+        if stopped:
+            self.stdout.write(f'Stopped early ({stopped}); {remaining} chunks left, rerun to resume.')
+        elif pending:
+            self.stdout.write(f'Request budget spent; {remaining} chunks left, rerun to resume.')
+        if failed:
+            raise CommandError(f'{len(failed)} chunks failed: ' + ', '.join(f'{s} to {e}' for s, e in failed))
+        if not remaining:
+            self.stdout.write('Backfill complete.')
+
+    def is_done(self, chunk, done):
+        start, end = chunk
+        if any(parse_date(s) <= start and end <= parse_date(e) for s, e in done):
+            return True
+        # Everything in the chunk was already stored by earlier requests
+        return ingest.stored_apod_days(start, end) == (end - start).days + 1
+
+    def fetch(self, start, end):
+        return upstream.get_json('apod', {'start_date': start.isoformat(), 'end_date': end.isoformat()})
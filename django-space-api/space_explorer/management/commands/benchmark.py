@@ -0,0 +1,335 @@
+import json
+import logging
+import math
+import os
+import platform
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from space_explorer import breaker, upstream
+from space_explorer.fake_upstreams import FakeUpstreams, apod_payload
+from space_explorer.queries import apod_today
+from space_explorer.models import APOD, CachedAsteroid, CachedLaunch, CachedMarsWeather, Favorite
+
+# (name, url name, url kwargs, method, query params, needs login)
+SCENARIOS = [
+    ('apod', 'apod', {}, 'GET', {}, False),
+    ('apod_range', 'apod_range', {}, 'GET', {'count': 30}, False),
+    ('apod_media', 'apod_media', {}, 'GET', {}, False),
+    ('launches', 'launches', {}, 'GET', {}, False),
+    ('mars_weather', 'mars_weather', {}, 'GET', {}, False),
+    ('mars_weather_rollup', 'mars_weather_rollup', {}, 'GET', {'bucket': 3}, False),
+    ('asteroids', 'asteroids', {}, 'GET', {}, False),
+    ('dashboard', 'dashboard', {}, 'GET', {}, False),
+    ('query_asteroids', 'query_asteroids', {}, 'GET', {'hazardous': 'true', 'range_days': 28}, False),
+    ('export_asteroids', 'export_asteroids', {}, 'GET', {}, False),
+    ('search_apods', 'search_apods', {}, 'GET', {'q': 'picture'}, False),
+    ('export_apods', 'export_apods', {}, 'GET', {}, False),
+    ('metrics', 'metrics', {}, 'GET', {}, False),
+    ('list_favorites', 'list_favorites', {}, 'GET', {}, True),
+    ('favorite_apod', 'favorite_apod', {}, 'POST', {}, True),
+    ('unfavorite_apod', 'unfavorite_apod', {'apod_id': 1}, 'DELETE', {}, True),
+    ('batch_favorites', 'batch_favorites', {}, 'POST', {}, True),
+]
+# Routes without a scenario: the login page is Django's LoginView, and this
+# project ships no template for it
+UNBENCHMARKED = {'login'}
+
+FAVORITE_SCENARIOS = ('list_favorites', 'favorite_apod', 'unfavorite_apod', 'batch_favorites')
+ARCHIVE_SCENARIOS = ('search_apods', 'export_apods')
+ARCHIVE_DAYS = 365  # APODs seeded for searching and exporting
+BATCH_SIZE = 5  # APODs each batch_favorites request favorites, and as many unfavorited
+
+# Emptied for each cold phase. APOD rows are only deleted in the throwaway
+# database: deleting them cascades to users' favorites.
+CACHED_MODELS = (CachedAsteroid, CachedLaunch, CachedMarsWeather)
+APOD_FIELDS = ('date', 'title', 'explanation', 'url', 'hdurl', 'media_type', 'copyright')
+
+
+def apod_fields(day):
+    return dict({key: value for key, value in apod_payload(day).items() if key in APOD_FIELDS}, date=day)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test every route against in-process fake NASA/SpaceDevs '
+        'upstreams, cold and warm, and print latency percentiles, throughput '
+        'and DB queries per request as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Warm requests per route.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients.')
+        parser.add_argument('--latency', type=float, default=0.05, help='Fake upstream latency, seconds.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of fake upstream 503s.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the fake upstream errors.')
+        parser.add_argument('--only', nargs='*', help='Run only these scenarios.')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+        parser.add_argument(
+            '--current-database', action='store_true',
+            help='Run against the already configured database instead of a throwaway copy (it is modified).',
+        )
+
+    def handle(self, *args, **options):
+        scenarios = [s for s in SCENARIOS if not options['only'] or s[0] in options['only']]
+        if options['current_database'] and options['concurrency'] > 1 and connection.vendor == 'sqlite' \
+                and connection.is_in_memory_db():
+            # Concurrent writers to a shared-cache in-memory database fail
+            # with "database table is locked" instead of waiting
+            raise CommandError('An in-memory database only supports --concurrency 1.')
+        self.current_database = options['current_database']
+        last_apod_id = None
+        if options['current_database']:
+            # Every APOD after this one is fake, added by the run
+            last_apod_id = APOD.objects.aggregate(last=Max('id'))['last'] or 0
+
+        work_dir = tempfile.mkdtemp(prefix='space-bench-')
+        old_config = None
+        if not options['current_database']:
+            # A throwaway on-disk database, so concurrent writers behave like production
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(work_dir, 'bench.sqlite3')
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            # Mirrors (the read replica) only switch files on reconnecting
+            connections.close_all()
+
+        fake = FakeUpstreams(latency=options['latency'], error_rate=options['error_rate'], seed=options['seed'])
+        fake.start()
+        # Failed requests are counted in the report, not logged one by one
+        request_logger = logging.getLogger('django.request')
+        old_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            overrides = override_settings(
+                UPSTREAM_HOSTS=fake.settings_override(),
+                MEDIA_CACHE_DIR=os.path.join(work_dir, 'media'),
+                CACHES={
+                    'default': dict(settings.CACHES['default']),
+                    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+                },
+            )
+            with overrides:
+                upstream.reset_sessions()
+                report = self.run_all(scenarios, fake, options)
+        finally:
+            request_logger.setLevel(old_level)
+            fake.stop()
+            upstream.reset_sessions()
+            if last_apod_id is not None:
+                # Don't leave fake data to be served as real: the cached
+                # tables are refetched on demand, the APODs are the run's own
+                APOD.objects.filter(id__gt=last_apod_id).delete()
+                for model in CACHED_MODELS:
+                    model.objects.all().delete()
+                caches['default'].clear()
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_all(self, scenarios, fake, options):
+        from django.contrib.auth.models import User
+
+        user, _ = User.objects.get_or_create(username='benchmark')
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'config': {
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'upstream_latency': options['latency'],
+                'upstream_error_rate': options['error_rate'],
+                'python': platform.python_version(),
+                'database': connection.vendor,
+            },
+            'scenarios': {},
+        }
+        for scenario in scenarios:
+            name = scenario[0]
+            report['scenarios'][name] = {
+                # Cold: empty cache and tables, every client arriving at once
+                'cold': self.run_phase(scenario, user, fake, options['concurrency'], options['concurrency'], cold=True),
+                'warm': self.run_phase(scenario, user, fake, options['requests'], options['concurrency'], cold=False),
+            }
+            self.stderr.write(f"{name}: warm p50 {report['scenarios'][name]['warm']['latency_ms']['p50']} ms")
+        return report
+
+    def prepare(self, scenario, user, total, cold):
+        """Reset state for a cold phase and return the APODs the requests use."""
+        name = scenario[0]
+        if cold:
+            caches['default'].clear()
+            for model in CACHED_MODELS:
+                model.objects.all().delete()
+            if not self.current_database:
+                APOD.objects.all().delete()
+            shutil.rmtree(settings.MEDIA_CACHE_DIR, ignore_errors=True)
+            breaker.reset_breakers()
+        if name == 'apod_media':
+            today = apod_today()
+            apod_obj, _ = APOD.objects.get_or_create(date=today, defaults=apod_fields(today))
+            return [apod_obj]
+        if name in ARCHIVE_SCENARIOS:
+            # Seeded once; the warm phase searches the same archive
+            return APOD.objects.bulk_create(self.new_apods(ARCHIVE_DAYS)) if cold else []
+        if name not in FAVORITE_SCENARIOS:
+            return []
+
+        if name == 'favorite_apod':
+            return self.new_apods(total)
+        if name == 'batch_favorites':
+            # The first half is favorited for the batches to remove, the rest they add
+            apods = APOD.objects.bulk_create(self.new_apods(2 * BATCH_SIZE * total))
+            favorited = apods[:BATCH_SIZE * total]
+        else:
+            apods = favorited = APOD.objects.bulk_create(self.new_apods(total))
+        Favorite.objects.bulk_create([Favorite(user=user, apod=apod_obj) for apod_obj in favorited])
+        return apods
+
+    def new_apods(self, count):
+        """Unsaved APODs for ``count`` days before the oldest stored one."""
+        # Distinct dates, so every favorite/unfavorite request does real work
+        first = APOD.objects.order_by('date').values_list('date', flat=True).first() or apod_today()
+        return [APOD(**apod_fields(first - timedelta(days=n + 1))) for n in range(count)]
+
+    def build_requests(self, scenario, apods, total):
+        name, url_name, kwargs, method, params, _ = scenario
+        params = dict(params)
+        if 'range_days' in params:
+            end = timezone.now().date()
+            params['start_date'] = (end - timedelta(days=params.pop('range_days'))).isoformat()
+            params['end_date'] = end.isoformat()
+
+        built = []
+        for n in range(total):
+            body = ''
+            if name == 'apod_media':
+                kwargs = {'date': apods[0].date.isoformat()}
+            elif name == 'unfavorite_apod':
+                kwargs = {'apod_id': apods[n].id}
+            elif name == 'favorite_apod':
+                body = json.dumps(apod_payload(apods[n].date))
+            elif name == 'batch_favorites':
+                removed = apods[n * BATCH_SIZE:(n + 1) * BATCH_SIZE]
+                added = apods[(total + n) * BATCH_SIZE:(total + n + 1) * BATCH_SIZE]
+                body = json.dumps({
+                    'favorite': [{'date': apod_obj.date.isoformat()} for apod_obj in added],
+                    'unfavorite': [apod_obj.id for apod_obj in removed],
+                })
+            path = reverse(url_name, kwargs=kwargs)
+            built.append((method, path, params, body))
+        return built
+
+    def run_phase(self, scenario, user, fake, total, concurrency, cold):
+        apods = self.prepare(scenario, user, total, cold)
+
+        jobs = queue.Queue()
+        for job in self.build_requests(scenario, apods, total):
+            jobs.put(job)
+        results = []
+        results_lock = threading.Lock()
+        errors = []
+        # Logged in up front, so the workers' only writes are the requests'
+        clients = [Client(raise_request_exception=False) for _ in range(min(concurrency, total))]
+        if scenario[5]:
+            for client in clients:
+                client.force_login(user)
+        barrier = threading.Barrier(len(clients))
+
+        def worker(client):
+            counter = QueryCounter()
+            local = []
+            try:
+                barrier.wait()
+                with ExitStack() as stack:
+                    for alias_connection in connections.all():
+                        stack.enter_context(alias_connection.execute_wrapper(counter))
+                    while True:
+                        try:
+                            method, path, params, body = jobs.get_nowait()
+                        except queue.Empty:
+                            break
+                        before = counter.count
+                        started = time.perf_counter()
+                        if method == 'GET':
+                            response = client.get(path, params)
+                        else:
+                            response = client.generic(method, path, body, content_type='application/json')
+                        local.append((time.perf_counter() - started, response.status_code, counter.count - before))
+            except threading.BrokenBarrierError:
+                pass  # Another worker failed; its error is reported
+            except Exception as error:
+                barrier.abort()  # Don't leave the others waiting for this one
+                with results_lock:
+                    errors.append(error)
+            finally:
+                connections.close_all()
+            with results_lock:
+                results.extend(local)
+
+        fake.reset_counts()
+        threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'{len(errors)} benchmark worker(s) failed: {errors[0]!r}') from errors[0]
+
+        latencies = sorted(result[0] * 1000 for result in results)
+        statuses = {}
+        for _, status, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(results),
+            'errors': sum(1 for _, status, _ in results if status >= 500),
+            'statuses': statuses,
+            'throughput_rps': round(len(results) / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'max': round(latencies[-1], 2),
+            },
+            'db_queries_per_request': round(sum(result[2] for result in results) / len(results), 2),
+            'upstream_requests': fake.total_requests,
+        }
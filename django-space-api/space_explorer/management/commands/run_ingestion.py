@@ -0,0 +1,85 @@
+import heapq
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from space_explorer import ingest, quota
+
+logger = logging.getLogger(__name__)
+
+
+def jittered(interval, jitter):
+    return interval * (1 + random.uniform(-jitter, jitter))
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the cached datasets (launches, asteroids, Mars weather) on '
+        'their own jittered intervals so request handlers only read.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'datasets', nargs='*',
+            help='Datasets to refresh (default: every dataset in INGEST_SCHEDULE).',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Refresh each dataset once and exit instead of looping.',
+        )
+
+    def handle(self, *args, **options):
+        names = options['datasets'] or list(settings.INGEST_SCHEDULE)
+        unknown = set(names) - set(ingest.DATASETS)
+        if unknown:
+            raise CommandError(f"Unknown dataset(s): {', '.join(sorted(unknown))}")
+
+        if options['once']:
+            failed = [name for name in names if not self.run(name)]
+            if failed:
+                raise CommandError(f"Refresh failed for: {', '.join(failed)}")
+            return
+
+        # Stagger the first runs so every dataset doesn't hit its upstream at
+        # the same moment when the scheduler starts.
+        now = time.monotonic()
+        queue = []
+        for name in names:
+            schedule = settings.INGEST_SCHEDULE[name]
+            first_run = now + random.uniform(0, schedule['interval'] * schedule['jitter'])
+            heapq.heappush(queue, (first_run, name))
+
+        try:
+            while True:
+                due, name = heapq.heappop(queue)
+                time.sleep(max(0, due - time.monotonic()))
+
+                schedule = settings.INGEST_SCHEDULE[name]
+                if self.run(name):
+                    delay = jittered(schedule['interval'], schedule['jitter'])
+                else:
+                    delay = min(settings.INGEST_RETRY_DELAY, schedule['interval'])
+                heapq.heappush(queue, (time.monotonic() + delay, name))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping ingestion scheduler.')
+
+    def run(self, name):
+        close_old_connections()
+        started = time.monotonic()
+        try:
+            with quota.scheduled():
+                rows = ingest.refresh(name)
+        except Exception:
+            logger.exception('Refreshing %s failed', name)
+            self.stderr.write(f'{name}: refresh failed')
+            return False
+        finally:
+            close_old_connections()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'{name}: refreshed {len(rows)} rows in {elapsed:.2f}s')
+        return True
@@ -0,0 +1,80 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from space_explorer import retention
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired rows from the cached tables (archiving them if their '
+        'policy says so), then ANALYZE and vacuum the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'policies', nargs='*',
+            help='Policies to apply (default: every policy in RETENTION_POLICIES).',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run once and exit instead of every RETENTION_INTERVAL seconds.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted; change nothing.')
+        parser.add_argument('--no-archive', action='store_true', help="Don't archive deleted rows.")
+        parser.add_argument(
+            '--full-vacuum', action='store_true',
+            help='Rewrite the whole file with VACUUM (and enable incremental vacuum from then on).',
+        )
+
+    def handle(self, *args, **options):
+        names = options['policies'] or list(settings.RETENTION_POLICIES)
+        unknown = set(names) - set(settings.RETENTION_POLICIES)
+        if unknown:
+            raise CommandError(f"Unknown retention polic(ies): {', '.join(sorted(unknown))}")
+
+        if options['once'] or options['dry_run']:
+            self.run(names, options)
+            return
+
+        try:
+            while True:
+                self.run(names, options)
+                time.sleep(settings.RETENTION_INTERVAL)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping retention.')
+
+    def run(self, names, options):
+        close_old_connections()
+        try:
+            for name in names:
+                started = time.monotonic()
+                rows = retention.prune(
+                    name, settings.RETENTION_POLICIES[name],
+                    archive=not options['no_archive'], dry_run=options['dry_run'],
+                )
+                verb = 'would delete' if options['dry_run'] else 'deleted'
+                self.stdout.write(f'{name}: {verb} {rows} rows in {time.monotonic() - started:.2f}s')
+
+            if not options['dry_run']:
+                size, free = retention.database_size()
+                if options['full_vacuum'] or retention.incremental_vacuum():
+                    reclaimed = retention.compact(full=options['full_vacuum'])
+                    self.stdout.write(f'database: reclaimed {reclaimed} of {size} bytes')
+                else:
+                    retention.compact()  # Still refreshes the planner statistics
+                    self.stdout.write(
+                        f'database: compaction is off, {free} of {size} bytes free; '
+                        'run once with --full-vacuum to turn on incremental vacuum'
+                    )
+        except Exception:
+            logger.exception('Retention run failed')
+            if options['once']:
+                raise
+        finally:
+            close_old_connections()
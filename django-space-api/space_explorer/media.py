@@ -0,0 +1,180 @@
+"""
+On-disk cache of APOD images, served by ``apod/media/<date>/``.
+
+Files are content-addressed: each is stored under ``MEDIA_CACHE_DIR/objects``
+named by the SHA-256 of its bytes, and ``MEDIA_CACHE_DIR/refs`` maps each
+source URL to its object. The first request for an image downloads it (one
+worker per URL; the rest wait for it), and every later one is served from
+disk. Reading an object bumps its mtime, and once the store outgrows
+``MEDIA_CACHE_MAX_BYTES`` the least recently used objects are evicted.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.dateparse import parse_date
+
+from . import queries, upstream
+from .cache_backends import consistent
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='media-prefetch')
+
+
+class MediaError(ValueError):
+    """The URL can't be cached: not on the APOD media host, or too large."""
+
+
+def _root():
+    return Path(settings.MEDIA_CACHE_DIR)
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _object_path(digest):
+    return _root() / 'objects' / digest[:2] / digest
+
+
+def lookup(url):
+    """
+    The stored media for ``url`` as ``{'path', 'digest', 'content_type',
+    'size'}``, or ``None`` if it hasn't been fetched or has been evicted.
+    """
+    try:
+        ref = json.loads((_root() / 'refs' / f'{_url_key(url)}.json').read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    path = _object_path(ref['digest'])
+    try:
+        os.utime(path)  # Mark as recently used
+    except FileNotFoundError:
+        return None
+    return dict(ref, path=path)
+
+
+def fetch(url):
+    """
+    Return the stored media for ``url``, downloading it first if need be.
+    Concurrent callers for the same URL wait for a single download.
+    """
+    lock_key = f'media-fill:{_url_key(url)}'
+    deadline = time.monotonic() + settings.MEDIA_FILL_TIMEOUT
+    while True:
+        media = lookup(url)
+        if media is not None:
+            return media
+        if consistent(cache).add(lock_key, 1, settings.MEDIA_FILL_TIMEOUT):
+            try:
+                return _download(url)
+            finally:
+                consistent(cache).delete(lock_key)
+        if time.monotonic() >= deadline:
+            raise requests.exceptions.Timeout(f'Timed out waiting for {url} to be fetched')
+        time.sleep(0.1)
+
+
+def _download(url):
+    source = urlsplit(url)
+    if source.hostname not in settings.MEDIA_SOURCE_HOSTS:
+        raise MediaError(f'{url} is not APOD media')
+    path = source.path + (f'?{source.query}' if source.query else '')
+
+    tmp_dir = _root() / 'tmp'
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with upstream.get('apod_media', path=path, stream=True) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as download:
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > settings.MEDIA_MAX_FILE_BYTES:
+                        raise MediaError(f'{url} is larger than {settings.MEDIA_MAX_FILE_BYTES} bytes')
+                    digest.update(chunk)
+                    download.write(chunk)
+            except BaseException:
+                os.unlink(download.name)
+                raise
+
+    # Renames are atomic, so readers only ever see complete files
+    object_path = _object_path(digest.hexdigest())
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(download.name, object_path)
+    ref = {'url': url, 'digest': digest.hexdigest(), 'content_type': content_type, 'size': size}
+    ref_path = _root() / 'refs' / f'{_url_key(url)}.json'
+    ref_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=tmp_dir, delete=False) as ref_file:
+        json.dump(ref, ref_file)
+    os.replace(ref_file.name, ref_path)
+
+    evict()
+    return dict(ref, path=object_path)
+
+
+def evict():
+    """
+    Delete least recently used objects until the store fits in
+    ``MEDIA_CACHE_MAX_BYTES``. Returns the bytes freed.
+    """
+    objects = []
+    for path in (_root() / 'objects').glob('*/*'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        objects.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in objects)
+    freed = 0
+    for _, size, path in sorted(objects):
+        if total <= settings.MEDIA_CACHE_MAX_BYTES:
+            break
+        path.unlink(missing_ok=True)  # Its ref now misses, and refetches
+        total -= size
+        freed += size
+    return freed
+
+
+def media_url(entry, size=None):
+    """The image URL the app shows for an APOD entry: HD unless ``size='standard'``."""
+    if size == 'standard':
+        return entry['url']
+    return entry.get('hdurl') or entry['url']
+
+
+def prefetch(entries):
+    """
+    Download recent image APODs' media in the background when they're
+    stored, so the first view is already served from disk.
+    """
+    if not settings.MEDIA_PREFETCH:
+        return
+    cutoff = queries.apod_today() - timedelta(days=settings.MEDIA_PREFETCH_DAYS)
+    for entry in entries:
+        if entry.get('media_type', 'image') != 'image' or parse_date(entry['date']) < cutoff:
+            continue
+        _executor.submit(_prefetch, media_url(entry))
+
+
+def _prefetch(url):
+    try:
+        fetch(url)
+    except Exception:
+        logger.warning('Prefetching %s failed', url, exc_info=True)
@@ -0,0 +1,189 @@
+"""
+In-process request metrics, exposed in the Prometheus text format at
+``/metrics``.
+
+``RequestMetricsMiddleware`` times every request and splits it into phases:
+time spent in cache reads and writes (``cache``), calls to the upstream APIs
+(``upstream``), SQL (``db``), encoding snapshots (``serialize``) and
+everything else (``other``). The upstream client and the cache layer record
+their own histograms and counters too, whether or not a request is being
+served (background refreshes, ingestion).
+
+Like the circuit breakers, metrics are kept per process; scrape each worker.
+"""
+import math
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.http import HttpResponse
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+PHASES = ('cache', 'upstream', 'db', 'serialize')
+
+# Phase durations and query count of the request being served, if any
+_current = ContextVar('request_metrics', default=None)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {_number(value)}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = '+Inf' if bound == math.inf else _number(bound)
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), key + (le,))} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUEST_DURATION = Histogram(
+    'space_request_duration_seconds', 'Time to serve a request.', ('view', 'method', 'status'),
+)
+REQUEST_PHASE_DURATION = Histogram(
+    'space_request_phase_duration_seconds', 'Time spent in each phase of a request.', ('view', 'phase'),
+)
+REQUEST_DB_QUERIES = Histogram(
+    'space_request_db_queries', 'SQL queries run to serve a request.', ('view',), QUERY_COUNT_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    'space_cache_lookups_total', 'Cache lookups by key family and result (hit, stale, miss).', ('family', 'result'),
+)
+UPSTREAM_DURATION = Histogram(
+    'space_upstream_request_duration_seconds', 'Time for a call to an upstream API.', ('host', 'endpoint', 'status'),
+)
+UPSTREAM_REJECTED = Counter(
+    'space_upstream_rejected_total', 'Upstream calls not sent (open circuit, spent quota).', ('host', 'reason'),
+)
+
+REGISTRY = (
+    REQUEST_DURATION, REQUEST_PHASE_DURATION, REQUEST_DB_QUERIES,
+    CACHE_LOOKUPS, UPSTREAM_DURATION, UPSTREAM_REJECTED,
+)
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to the current request's ``name`` phase."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = _current.get()
+        if current is not None:
+            current['phases'][name] += time.perf_counter() - started
+
+
+def render():
+    return '\n'.join(line for metric in REGISTRY for line in metric.collect()) + '\n'
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.clear()
+
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class RequestMetricsMiddleware:
+    """Record the duration, phase breakdown and query count of every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current = {'phases': dict.fromkeys(PHASES, 0.0), 'queries': 0}
+        token = _current.set(current)
+        started = time.perf_counter()
+        try:
+            with _count_queries(current):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.url_name or match.view_name if match else 'unmatched'
+        REQUEST_DURATION.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        REQUEST_DB_QUERIES.observe(current['queries'], view=view)
+        phases = current['phases']
+        for name, seconds in phases.items():
+            REQUEST_PHASE_DURATION.observe(seconds, view=view, phase=name)
+        REQUEST_PHASE_DURATION.observe(max(0.0, elapsed - sum(phases.values())), view=view, phase='other')
+        return response
+
+
+@contextmanager
+def _count_queries(current):
+    def wrapper(execute, sql, params, many, context):
+        current['queries'] += 1
+        with phase('db'):
+            return execute(sql, params, many, context)
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space_explorer', '0005_apod_copyright_apod_hdurl_apod_media_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cachedasteroid',
+            index=models.Index(fields=['close_approach_date', 'id'], name='asteroid_approach_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cachedasteroid',
+            index=models.Index(fields=['is_potentially_hazardous', 'close_approach_date'], name='asteroid_hazardous_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cachedasteroid',
+            index=models.Index(fields=['miss_distance_km'], name='asteroid_miss_distance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cachedasteroid',
+            index=models.Index(fields=['last_updated'], name='asteroid_last_updated_idx'),
+        ),
+    ]
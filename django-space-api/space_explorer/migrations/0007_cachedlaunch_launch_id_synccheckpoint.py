@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+def clear_unkeyed_launches(apps, schema_editor):
+    # Rows written before the launch id was stored can't be matched to their
+    # upstream launch (duplicates of one launch included); the next sync
+    # fetches them again.
+    apps.get_model('space_explorer', 'CachedLaunch').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space_explorer', '0006_cachedasteroid_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_unkeyed_launches, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='cachedlaunch',
+            name='launch_id',
+            field=models.CharField(default='', max_length=36, unique=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='cachedlaunch',
+            name='upstream_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='cachedlaunch',
+            index=models.Index(fields=['net'], name='launch_net_idx'),
+        ),
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('state', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+# An external-content FTS5 index over APOD.title and APOD.explanation: the
+# text lives only in space_explorer_apod, and the triggers keep the index in
+# step with every insert, upsert and delete, whatever path wrote the row.
+CREATE = [
+    """
+    CREATE VIRTUAL TABLE space_explorer_apod_fts USING fts5(
+        title, explanation,
+        content='space_explorer_apod', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER space_explorer_apod_fts_insert AFTER INSERT ON space_explorer_apod BEGIN
+        INSERT INTO space_explorer_apod_fts(rowid, title, explanation)
+        VALUES (new.id, new.title, new.explanation);
+    END
+    """,
+    """
+    CREATE TRIGGER space_explorer_apod_fts_delete AFTER DELETE ON space_explorer_apod BEGIN
+        INSERT INTO space_explorer_apod_fts(space_explorer_apod_fts, rowid, title, explanation)
+        VALUES ('delete', old.id, old.title, old.explanation);
+    END
+    """,
+    """
+    CREATE TRIGGER space_explorer_apod_fts_update AFTER UPDATE OF title, explanation ON space_explorer_apod BEGIN
+        INSERT INTO space_explorer_apod_fts(space_explorer_apod_fts, rowid, title, explanation)
+        VALUES ('delete', old.id, old.title, old.explanation);
+        INSERT INTO space_explorer_apod_fts(rowid, title, explanation)
+        VALUES (new.id, new.title, new.explanation);
+    END
+    """,
+    # Index the rows already stored
+    "INSERT INTO space_explorer_apod_fts(space_explorer_apod_fts) VALUES ('rebuild')",
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS space_explorer_apod_fts_update',
+    'DROP TRIGGER IF EXISTS space_explorer_apod_fts_delete',
+    'DROP TRIGGER IF EXISTS space_explorer_apod_fts_insert',
+    'DROP TABLE IF EXISTS space_explorer_apod_fts',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return  # FTS5 is SQLite's; search isn't available elsewhere
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space_explorer', '0008_tombstone'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 13:14
+
+from django.db import migrations, models
+from django.db.models import Min
+from django.utils import timezone
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    # Keep the first favorite of each (user, apod); tombstone the rest so
+    # clients syncing with since= drop them too
+    Favorite = apps.get_model('space_explorer', 'Favorite')
+    Tombstone = apps.get_model('space_explorer', 'Tombstone')
+    keep = Favorite.objects.values('user', 'apod').annotate(keep_id=Min('id')).values('keep_id')
+    duplicates = Favorite.objects.exclude(id__in=keep)
+    now = timezone.now()
+    Tombstone.objects.bulk_create([
+        Tombstone(dataset='favorites', key=str(favorite_id), user_id=user_id, deleted_at=now)
+        for favorite_id, user_id in duplicates.values_list('id', 'user_id')
+    ])
+    duplicates.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('space_explorer', '0009_apod_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='favorite_user_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'apod'), name='unique_user_apod_favorite'),
+        ),
+    ]
@@ -19,6 +19,14 @@ class Favorite(models.Model):
     apod = models.ForeignKey(APOD, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'apod'], name='unique_user_apod_favorite'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='favorite_user_created_idx'),
+        ]
+
 class CachedAsteroid(models.Model):
     neo_reference_id = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=200)
@@ -28,6 +36,14 @@ class CachedAsteroid(models.Model):
     miss_distance_km = models.FloatField()
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['close_approach_date', 'id'], name='asteroid_approach_date_idx'),
+            models.Index(fields=['is_potentially_hazardous', 'close_approach_date'], name='asteroid_hazardous_idx'),
+            models.Index(fields=['miss_distance_km'], name='asteroid_miss_distance_idx'),
+            models.Index(fields=['last_updated'], name='asteroid_last_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -48,6 +64,7 @@ class CachedMarsWeather(models.Model):
         return f"Mars Weather Sol {self.sol}"
 
 class CachedLaunch(models.Model):
+    launch_id = models.CharField(max_length=36, unique=True)  # SpaceDevs' stable launch id; ingestion upserts on it
     name = models.CharField(max_length=200)
     net = models.DateTimeField()
     status = models.CharField(max_length=100)
@@ -55,7 +72,37 @@ class CachedLaunch(models.Model):
     rocket = models.CharField(max_length=200)
     pad = models.CharField(max_length=200)
     agency = models.CharField(max_length=200)
+    upstream_updated = models.DateTimeField(null=True, blank=True)  # SpaceDevs' last_updated
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['net'], name='launch_net_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class SyncCheckpoint(models.Model):
+    """Where an incremental sync or backfill left off, keyed by job name."""
+    name = models.CharField(max_length=100, unique=True)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class Tombstone(models.Model):
+    """A deleted row of a synced dataset, reported to clients syncing with ``since``."""
+    dataset = models.CharField(max_length=32)
+    key = models.CharField(max_length=64)  # The row's key field, e.g. the launch id
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE)  # For per-user datasets
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'deleted_at'], name='tombstone_dataset_idx'),
+        ]
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"{self.dataset} {self.key}"
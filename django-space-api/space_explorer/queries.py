@@ -0,0 +1,288 @@
+"""
+Query-string filtering, sorting and keyset pagination for the read API.
+"""
+import base64
+import json
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Min, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+APOD_FIRST_DATE = date(1995, 6, 16)  # The APOD archive starts here
+
+ASTEROID_SORTS = {
+    'close_approach_date', '-close_approach_date',
+    'miss_distance_km', '-miss_distance_km',
+    'diameter_max_meters', '-diameter_max_meters',
+    'last_updated', '-last_updated',
+}
+
+
+def _parse_float(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+
+
+def _parse_date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f'{name} must be a YYYY-MM-DD date')
+    return parsed
+
+
+def parse_limit(params):
+    try:
+        limit = int(params.get('limit', settings.API_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    return max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+
+
+def apod_today():
+    """Today's date where APOD publishes, which may not be UTC's."""
+    return timezone.now().astimezone(ZoneInfo(settings.APOD_TIME_ZONE)).date()
+
+
+def next_apod_day():
+    """Unix timestamp of the next APOD day boundary."""
+    tomorrow = apod_today() + timedelta(days=1)
+    return datetime.combine(tomorrow, time.min, tzinfo=ZoneInfo(settings.APOD_TIME_ZONE)).timestamp()
+
+
+def parse_apod_date(params, today):
+    """
+    The APOD ``date`` requested (default ``today``). Raises ``ValueError``
+    for anything NASA would reject, so it is never sent upstream.
+    """
+    day = _parse_date(params, 'date') or today
+    if not APOD_FIRST_DATE <= day <= today:
+        raise ValueError(f'date must be between {APOD_FIRST_DATE} and {today}')
+    return day
+
+
+def parse_apod_range(params, today):
+    """
+    Resolve APOD range parameters to a (start, end) pair of dates: either
+    ``start_date``/``end_date`` or ``count`` days ending at ``end_date``
+    (default ``today``). Raises ``ValueError`` on bad input.
+    """
+    end = _parse_date(params, 'end_date') or today
+    if 'count' in params:
+        try:
+            count = int(params['count'])
+        except ValueError:
+            raise ValueError('count must be an integer')
+        if not 1 <= count <= settings.APOD_RANGE_MAX_DAYS:
+            raise ValueError(f'count must be between 1 and {settings.APOD_RANGE_MAX_DAYS}')
+        start = end - timedelta(days=count - 1)
+    else:
+        start = _parse_date(params, 'start_date')
+        if start is None:
+            raise ValueError('Either start_date or count is required')
+
+    if end < start:
+        raise ValueError('end_date must not be before start_date')
+    if start < APOD_FIRST_DATE or end > today:
+        raise ValueError(f'Dates must be between {APOD_FIRST_DATE} and {today}')
+    if (end - start).days >= settings.APOD_RANGE_MAX_DAYS:
+        raise ValueError(f'Date ranges are limited to {settings.APOD_RANGE_MAX_DAYS} days')
+    return start, end
+
+
+def parse_asteroid_filters(params, limit_range=True):
+    """
+    Validate the asteroid filter parameters from a QueryDict. Raises
+    ``ValueError`` with a client-facing message on bad input. Date ranges are
+    capped at ``ASTEROID_QUERY_MAX_DAYS`` unless ``limit_range`` is false.
+    """
+    filters = {
+        'start_date': _parse_date(params, 'start_date'),
+        'end_date': _parse_date(params, 'end_date'),
+        'hazardous': params.get('hazardous', '').lower() in ('1', 'true', 'yes'),
+        'min_diameter': _parse_float(params, 'min_diameter'),
+        'max_miss_distance': _parse_float(params, 'max_miss_distance'),
+    }
+    start, end = filters['start_date'], filters['end_date']
+    if start and end:
+        if end < start:
+            raise ValueError('end_date must not be before start_date')
+        if limit_range and end - start > timedelta(days=settings.ASTEROID_QUERY_MAX_DAYS):
+            raise ValueError(f'Date ranges are limited to {settings.ASTEROID_QUERY_MAX_DAYS} days')
+    return filters
+
+
+def parse_apod_filters(params):
+    """
+    Validate APOD filter parameters (``start_date``, ``end_date``,
+    ``media_type``) from a QueryDict. Raises ``ValueError`` on bad input.
+    """
+    filters = {
+        'start_date': _parse_date(params, 'start_date'),
+        'end_date': _parse_date(params, 'end_date'),
+        'media_type': params.get('media_type') or None,
+    }
+    start, end = filters['start_date'], filters['end_date']
+    if start and end and end < start:
+        raise ValueError('end_date must not be before start_date')
+    return filters
+
+
+def filter_apods(queryset, filters):
+    if filters['start_date']:
+        queryset = queryset.filter(date__gte=filters['start_date'])
+    if filters['end_date']:
+        queryset = queryset.filter(date__lte=filters['end_date'])
+    if filters['media_type']:
+        queryset = queryset.filter(media_type=filters['media_type'])
+    return queryset
+
+
+def _parse_int(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def parse_sol_rollup(params, queryset):
+    """
+    Resolve Mars weather rollup parameters to ``(start_sol, end_sol,
+    bucket)``. The range defaults to every stored sol in ``queryset``, and
+    the bucket (``bucket`` sols, default 1) is widened so the range yields at
+    most ``max_points`` buckets. Raises ``ValueError`` on bad input; the
+    sols are ``None`` when nothing is stored.
+    """
+    start, end = _parse_int(params, 'start_sol'), _parse_int(params, 'end_sol')
+    bucket = _parse_int(params, 'bucket') or 1
+    max_points = _parse_int(params, 'max_points') or settings.MARS_ROLLUP_MAX_POINTS
+    if bucket < 1 or max_points < 1:
+        raise ValueError('bucket and max_points must be positive')
+    max_points = min(max_points, settings.MARS_ROLLUP_MAX_POINTS)
+
+    if start is None or end is None:
+        stored = queryset.aggregate(first=Min('sol'), last=Max('sol'))
+        start = stored['first'] if start is None else start
+        end = stored['last'] if end is None else end
+        if start is None or end is None:
+            return None, None, bucket
+    if end < start:
+        raise ValueError('end_sol must not be before start_sol')
+
+    # Downsample: never return more than max_points buckets
+    span = end - start + 1
+    bucket = max(bucket, -(-span // max_points))
+    return start, end, bucket
+
+
+def rollup_mars_weather(queryset, start, end, bucket):
+    """
+    Aggregate sols ``start``..``end`` into ``bucket``-sol buckets in SQL:
+    min/avg/max temperature, wind speed and pressure per bucket, for sols
+    that are stored.
+    """
+    rows = (
+        queryset.filter(sol__range=(start, end))
+        .annotate(bucket=(F('sol') - start) / bucket)
+        .values('bucket')
+        .annotate(
+            first_sol=Min('sol'),
+            last_sol=Max('sol'),
+            sols=Count('id'),
+            temperature_min=Min(Coalesce('temperature_min', 'temperature')),
+            temperature_avg=Avg('temperature'),
+            temperature_max=Max(Coalesce('temperature_max', 'temperature')),
+            wind_speed_avg=Avg('wind_speed'),
+            wind_speed_max=Max(Coalesce('wind_speed_max', 'wind_speed')),
+            pressure_min=Min('pressure'),
+            pressure_avg=Avg('pressure'),
+            pressure_max=Max('pressure'),
+        )
+        .order_by('bucket')
+    )
+    results = []
+    for row in rows:
+        index = row.pop('bucket')
+        row['start_sol'] = start + index * bucket
+        row['end_sol'] = min(end, row['start_sol'] + bucket - 1)
+        for name, value in row.items():
+            if isinstance(value, float):
+                row[name] = round(value, 2)
+        results.append(row)
+    return results
+
+
+def filter_asteroids(queryset, filters):
+    if filters['start_date']:
+        queryset = queryset.filter(close_approach_date__gte=filters['start_date'])
+    if filters['end_date']:
+        queryset = queryset.filter(close_approach_date__lte=filters['end_date'])
+    if filters['hazardous']:
+        queryset = queryset.filter(is_potentially_hazardous=True)
+    if filters['min_diameter'] is not None:
+        queryset = queryset.filter(diameter_max_meters__gte=filters['min_diameter'])
+    if filters['max_miss_distance'] is not None:
+        queryset = queryset.filter(miss_distance_km__lte=filters['max_miss_distance'])
+    return queryset
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def keyset_page(queryset, sort, cursor, limit):
+    """
+    Order ``queryset`` by ``sort`` (a field name, optionally prefixed with
+    ``-``) with ``id`` as the tie-breaker, and return one page of rows after
+    ``cursor`` plus the cursor for the next page, if any. ``queryset`` must be
+    a ``.values()`` queryset that includes ``id`` and the sort field.
+    """
+    field = sort.lstrip('-')
+    descending = sort.startswith('-')
+    queryset = queryset.order_by(sort, '-id' if descending else 'id')
+
+    if cursor:
+        try:
+            value, last_id = decode_cursor(cursor)
+            value = queryset.model._meta.get_field(field).to_python(value)
+        except Exception:
+            raise ValueError('Invalid cursor')
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': last_id})
+        )
+
+    page = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor([last[field], last['id']])
+    return page, next_cursor
+
@@ -0,0 +1,128 @@
+"""
+Cross-process request budget for rate-limited upstreams (the NASA API key).
+
+Each host listed in ``settings.UPSTREAM_QUOTAS`` gets a token bucket kept in
+the shared cache, so every worker and the ingestion scheduler draw from the
+same budget. The bucket refills at ``hourly_limit`` tokens per hour and is
+pulled down to whatever ``X-RateLimit-Remaining`` the upstream reports.
+Ad-hoc lookups (from request handlers) may not dip into the last ``reserve``
+tokens, which are kept for scheduled refreshes.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache_backends import consistent
+
+ADHOC = 'adhoc'
+SCHEDULED = 'scheduled'
+
+_priority = contextvars.ContextVar('upstream_priority', default=ADHOC)
+
+LOCK_TIMEOUT = 2
+LOCK_WAIT = 0.5
+
+
+class QuotaExceeded(requests.exceptions.RequestException):
+    """Raised instead of calling an upstream whose budget is spent."""
+
+
+@contextmanager
+def scheduled():
+    """Mark upstream calls made inside the block as scheduled refreshes."""
+    token = _priority.set(SCHEDULED)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def _state_key(host):
+    return f'quota:{host}'
+
+
+@contextmanager
+def _locked(host):
+    """
+    Serialize bucket updates across processes. If the lock can't be had
+    quickly the update goes ahead anyway: an occasional lost update is better
+    than stalling requests on a wedged lock.
+    """
+    lock_key = f'quota:{host}:lock'
+    deadline = time.monotonic() + LOCK_WAIT
+    acquired = consistent(cache).add(lock_key, 1, LOCK_TIMEOUT)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.01)
+        acquired = consistent(cache).add(lock_key, 1, LOCK_TIMEOUT)
+    try:
+        yield
+    finally:
+        if acquired:
+            consistent(cache).delete(lock_key)
+
+
+def _load(host, config):
+    """Return the host's bucket, refilled up to now."""
+    capacity = config['hourly_limit']
+    now = time.time()
+    state = consistent(cache).get(_state_key(host)) or {'tokens': capacity, 'updated': now}
+    elapsed = max(0.0, now - state['updated'])
+    state['tokens'] = min(capacity, state['tokens'] + elapsed * capacity / 3600)
+    state['updated'] = now
+    return state
+
+
+def _save(host, state):
+    consistent(cache).set(_state_key(host), state, 2 * 3600)
+
+
+def acquire(host):
+    """
+    Take one request's worth of budget for ``host``, or raise
+    ``QuotaExceeded``. Hosts without a configured quota are unlimited.
+    """
+    config = settings.UPSTREAM_QUOTAS.get(host)
+    if config is None:
+        return
+    floor = 0 if current_priority() == SCHEDULED else config['reserve']
+    with _locked(host):
+        state = _load(host, config)
+        if state['tokens'] - 1 < floor:
+            raise QuotaExceeded(f'Request budget for {host} is exhausted')
+        state['tokens'] -= 1
+        _save(host, state)
+
+
+def observe(host, response):
+    """Sync the bucket with the budget the upstream says is left."""
+    config = settings.UPSTREAM_QUOTAS.get(host)
+    if config is None:
+        return
+    if response.status_code == 429:
+        remaining = 0
+    else:
+        try:
+            remaining = int(response.headers['X-RateLimit-Remaining'])
+        except (KeyError, ValueError):
+            return
+    with _locked(host):
+        state = _load(host, config)
+        if remaining < state['tokens']:
+            state['tokens'] = remaining
+            _save(host, state)
+
+
+def remaining(host):
+    """Budget currently left for ``host`` (``None`` if it has no quota)."""
+    config = settings.UPSTREAM_QUOTAS.get(host)
+    if config is None:
+        return None
+    return _load(host, config)['tokens']
@@ -0,0 +1,149 @@
+"""
+Response helpers for the read endpoints: serving pre-encoded cache
+snapshots with content negotiation, conditional GET (ETag /
+Last-Modified / 304), and streaming cached files with Range support.
+"""
+import os
+import re
+from functools import wraps
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers, set_response_etag
+from django.utils.http import http_date, quote_etag
+
+from . import metrics
+
+ENCODING_PREFERENCE = ('br', 'gzip')
+FILE_CHUNK_SIZE = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def cached_json_response(request, entry):
+    """
+    Respond with a cache entry from ``caching.get_entry``. The snapshot's
+    bytes are sent as-is, in the best encoding the client accepts. The
+    validators come from the entry itself, so a matching ``If-None-Match``
+    or ``If-Modified-Since`` gets a bodyless 304.
+    """
+    encoding = negotiate_encoding(request, entry['encodings'])
+    # Each encoding is a different representation, so it gets its own ETag
+    etag = quote_etag(f"{entry['etag']}-{encoding}" if encoding else entry['etag'])
+    last_modified = int(entry['stored_at'])
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        body = entry['encodings'][encoding] if encoding else entry['body']
+        response = HttpResponse(body, content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if entry.get('stale'):
+        # Served from stored rows because the upstream couldn't be reached
+        response['X-Data-Stale'] = 'true'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def negotiate_encoding(request, available):
+    """
+    Pick the preferred encoding in ``available`` that the request's
+    ``Accept-Encoding`` allows, or ``None`` for the identity body.
+    """
+    accepted = {}
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def conditional(view):
+    """
+    For read views without a cache entry to take validators from: tag
+    successful responses with an ETag hashed from the body and answer a
+    matching ``If-None-Match`` with a bodyless 304.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if not response.has_header('ETag'):
+            with metrics.phase('serialize'):
+                set_response_etag(response)
+        return get_conditional_response(request, etag=response['ETag'], response=response)
+    return wrapper
+
+
+def file_response(request, path, content_type, etag):
+    """
+    Stream the file at ``path``, which never changes under ``etag``: with
+    long-lived immutable caching headers, a 304 for a matching
+    ``If-None-Match``, and a 206 partial response for a single-range
+    ``Range`` request.
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        size = os.path.getsize(path)
+        byte_range = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if byte_range and (if_range is None or if_range == etag):
+            response = _range_response(path, content_type, size, byte_range)
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+            response.block_size = FILE_CHUNK_SIZE
+    response['ETag'] = etag
+    response['Cache-Control'] = IMMUTABLE
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _range_response(path, content_type, size, header):
+    """A 206 (or 416) for a ``Range`` header, or ``None`` to send it all."""
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None  # Multiple or malformed ranges: ignoring them is allowed
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(0, size - int(last)), size - 1  # The final N bytes
+    else:
+        return None
+    if start > end or start >= size:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    response = StreamingHttpResponse(
+        _read_range(path, start, end - start + 1), status=206, content_type=content_type,
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(FILE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
@@ -0,0 +1,121 @@
+"""
+Retention for the cached tables, and compaction of the SQLite file.
+
+Each policy in ``settings.RETENTION_POLICIES`` names a model and when its rows
+expire: ``max_age_days`` past ``date_field``, and/or beyond the newest
+``max_rows`` by ``order_field``. Expired rows are deleted in chunks of
+``RETENTION_CHUNK_SIZE``, one short transaction each, so request handlers are
+never locked out of the database for long. With ``archive`` set, each chunk
+is first appended to a gzipped NDJSON file under ``RETENTION_ARCHIVE_DIR``.
+
+``compact`` refreshes the planner statistics (``ANALYZE``) and returns free
+pages to the filesystem with an incremental vacuum. New databases are created
+with incremental vacuum on (see ``space_explorer.db``); older ones need one full
+vacuum first, and until then ``incremental_vacuum()`` is false.
+"""
+import gzip
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import delta
+
+
+def expired(policy):
+    """Queryset of the rows ``policy`` no longer keeps."""
+    model = apps.get_model(policy['model'])
+    queryset = model.objects.none()
+    if policy.get('max_age_days') is not None:
+        cutoff = timezone.now() - timedelta(days=policy['max_age_days'])
+        queryset = model.objects.filter(**{f"{policy['date_field']}__lt": cutoff})
+    if policy.get('max_rows') is not None:
+        kept = model.objects.order_by(f"-{policy['order_field']}").values('pk')[:policy['max_rows']]
+        queryset = queryset | model.objects.exclude(pk__in=kept)
+    return queryset
+
+
+def prune(name, policy, archive=True, dry_run=False):
+    """
+    Delete the rows ``policy`` has expired, a chunk at a time. Returns the
+    number of rows deleted (or, with ``dry_run``, that would be).
+    """
+    queryset = expired(policy)
+    if dry_run:
+        return queryset.count()
+
+    archive_file = None
+    if archive and policy.get('archive'):
+        archive_dir = Path(settings.RETENTION_ARCHIVE_DIR)
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_file = archive_dir / f"{name}-{timezone.now():%Y%m%dT%H%M%S}.ndjson.gz"
+
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:settings.RETENTION_CHUNK_SIZE])
+            if not ids:
+                break
+            chunk = queryset.model.objects.filter(pk__in=ids)
+            if archive_file is not None:
+                with gzip.open(archive_file, 'at', encoding='utf-8') as f:
+                    for row in chunk.values():
+                        f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            deleted += delta.delete(chunk)  # Synced clients are told about the deletions
+        # Let writers waiting on the lock in between chunks
+        time.sleep(settings.RETENTION_CHUNK_PAUSE)
+    return deleted
+
+
+def database_size():
+    """``(file bytes, free bytes)`` of the SQLite database."""
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_count')
+        pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        free = cursor.fetchone()[0]
+    return pages * page_size, free * page_size
+
+
+def incremental_vacuum():
+    """Whether ``compact`` can reclaim free pages without a full vacuum."""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        return cursor.fetchone()[0] == 2
+
+
+def compact(full=False):
+    """
+    ``ANALYZE`` and reclaim free pages. SQLite only reclaims incrementally
+    once ``auto_vacuum`` is ``INCREMENTAL``; ``full`` switches it over with a
+    one-off ``VACUUM``, which rewrites the whole file and holds the write
+    lock while it does. Returns the bytes reclaimed.
+    """
+    if connection.vendor != 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return 0
+
+    before, _ = database_size()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+        incremental = incremental_vacuum()
+        if full:
+            if not incremental:
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        elif incremental:
+            cursor.execute(f'PRAGMA incremental_vacuum({settings.RETENTION_VACUUM_PAGES})')
+            cursor.fetchall()  # The pragma frees pages as its rows are stepped through
+    after, _ = database_size()
+    return before - after
@@ -0,0 +1,94 @@
+"""
+Full-text search over APOD titles and explanations.
+
+The index is an SQLite FTS5 table, ``space_explorer_apod_fts``, kept in sync
+with ``APOD`` by triggers (see migration 0010), so rows written by the views,
+ingestion or a backfill are searchable as soon as they commit. Results are
+ranked by BM25, with title matches weighted above explanation matches, and
+paged with a keyset cursor on ``(rank, id)``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router
+
+from .models import APOD
+from .queries import decode_cursor, encode_cursor
+
+FTS_TABLE = 'space_explorer_apod_fts'
+TITLE_WEIGHT = 10.0
+EXPLANATION_WEIGHT = 1.0
+SNIPPET_TOKENS = 24
+HIGHLIGHT = ('<mark>', '</mark>')
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def available():
+    return connections[router.db_for_read(APOD)].vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query: every word must match, and the last
+    one may be a prefix, for search-as-you-type. Quoting each term means
+    FTS5 syntax in the input (quotes, ``NEAR``, ``*``) is searched for as
+    text instead of failing the query. Raises ``ValueError`` if there are no
+    words to search for.
+    """
+    terms = TERM_RE.findall(query)[:settings.SEARCH_MAX_TERMS]
+    if not terms:
+        raise ValueError('q must contain at least one word')
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_apods(query, filters, cursor, limit):
+    """
+    One page of APODs matching ``query`` as ``(rows, next_cursor)``, best
+    match first. ``filters`` are ``queries.parse_apod_filters``'s. Each row
+    has the APOD's ``id``, ``date``, ``title``, ``media_type`` and ``url``,
+    its ``rank`` (lower is better) and a highlighted ``snippet`` of the
+    explanation.
+    """
+    rank = f'bm25({FTS_TABLE}, {TITLE_WEIGHT}, {EXPLANATION_WEIGHT})'
+    conditions = [f'{FTS_TABLE} MATCH %s']
+    params = [match_expression(query)]
+    if filters['start_date']:
+        conditions.append('apod.date >= %s')
+        params.append(filters['start_date'].isoformat())
+    if filters['end_date']:
+        conditions.append('apod.date <= %s')
+        params.append(filters['end_date'].isoformat())
+    if filters['media_type']:
+        conditions.append('apod.media_type = %s')
+        params.append(filters['media_type'])
+    if cursor:
+        try:
+            last_rank, last_id = decode_cursor(cursor)
+            last_rank, last_id = float(last_rank), int(last_id)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        conditions.append(f'({rank} > %s OR ({rank} = %s AND apod.id > %s))')
+        params.extend([last_rank, last_rank, last_id])
+
+    sql = f"""
+        SELECT apod.id, apod.date, apod.title, apod.media_type, apod.url, {rank} AS rank,
+               snippet({FTS_TABLE}, 1, %s, %s, '…', {SNIPPET_TOKENS}) AS snippet
+        FROM {FTS_TABLE}
+        JOIN space_explorer_apod AS apod ON apod.id = {FTS_TABLE}.rowid
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank, apod.id
+        LIMIT %s
+    """
+    with connections[router.db_for_read(APOD)].cursor() as db_cursor:
+        db_cursor.execute(sql, [*HIGHLIGHT, *params, limit + 1])
+        columns = [column[0] for column in db_cursor.description]
+        rows = [dict(zip(columns, row)) for row in db_cursor.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['rank'], rows[-1]['id']])
+    return rows, next_cursor
@@ -0,0 +1,21 @@
+"""
+Django's SQLite backend, with write transactions that take the write lock as
+they begin.
+
+Django opens transactions with a plain (deferred) ``BEGIN``, so a transaction
+that reads before it writes, such as ``get_or_create`` or a batch of favorite
+changes, upgrades its read lock on its first write. In WAL mode that upgrade
+fails at once with "database is locked" if another connection committed in
+the meantime; ``busy_timeout`` doesn't apply to it. ``BEGIN IMMEDIATE`` waits
+up to ``busy_timeout`` for the lock instead. Read-only connections keep the
+deferred ``BEGIN``, so they never queue behind writers.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict.get('READ_ONLY'):
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute('BEGIN IMMEDIATE')
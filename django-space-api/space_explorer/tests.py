@@ -1,7 +1,100 @@
-from django.test import TestCase
+import gzip
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+import requests
+
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connections, router, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import breaker, cache_backends, caching, delta, favorites, ingest, media, metrics, queries, quota, retention, upstream, urls
+from .management.commands import benchmark
+from .fake_upstreams import FakeUpstreams, image_payload
+from .models import APOD, CachedAsteroid, CachedLaunch, CachedMarsWeather, Favorite, Tombstone
+
+LAUNCHES_FEED = {
+    'results': [
+        {
+            'id': 'e3df2ecd-c239-472f-95e4-2b89b4f75800',
+            'name': 'Falcon 9 | Starlink Group 1',
+            'net': '2030-01-01T12:00:00Z',
+            'last_updated': '2029-12-01T00:00:00Z',
+            'status': {'name': 'Go for Launch'},
+            'mission': {'name': 'Starlink Group 1'},
+            'rocket': {'configuration': {'name': 'Falcon 9'}},
+            'pad': {'name': 'SLC-40'},
+            'launch_service_provider': {'name': 'SpaceX'},
+        },
+    ],
+}
+
+NEO_FEED = {
+    'near_earth_objects': {
+        '2030-01-01': [
+            {
+                'neo_reference_id': '1000001',
+                'name': '(2030 AA)',
+                'estimated_diameter': {'meters': {'estimated_diameter_max': 120.5}},
+                'is_potentially_hazardous_asteroid': True,
+                'close_approach_data': [
+                    {'close_approach_date': '2030-01-01', 'miss_distance': {'kilometers': '7500000.25'}},
+                ],
+            },
+        ],
+    },
+}
+
+INSIGHT_FEED = {
+    'sol_keys': ['675'],
+    '675': {
+        'AT': {'av': -62.3, 'mn': -96.9, 'mx': -15.9},
+        'HWS': {'av': 7.2, 'mx': 22.5},
+        'PRE': {'av': 750.6},
+        'First_UTC': '2020-10-19T18:32:20Z',
+        'Last_UTC': '2020-10-20T19:11:55Z',
+        'WD': {'most_common': {'compass_point': 'WNW'}},
+    },
+}
+
+UPSTREAM_FEEDS = {
+    'launches_upcoming': LAUNCHES_FEED,
+    'neo_feed': NEO_FEED,
+    'insight_weather': INSIGHT_FEED,
+}
+
+
+def fake_get_json(endpoint, params=None):
+    return UPSTREAM_FEEDS[endpoint]
 
 class SpaceExplorerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.upstreams = FakeUpstreams().start()
+        cls.addClassCleanup(cls.upstreams.stop)
+
+    def setUp(self):
+        overrides = override_settings(UPSTREAM_HOSTS=self.upstreams.settings_override())
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(upstream.reset_sessions)
+        upstream.reset_sessions()
+        breaker.reset_breakers()
+        cache.clear()
+
     def test_apod_endpoint(self):
         response = self.client.get(reverse('apod'))
         self.assertEqual(response.status_code, 200)
@@ -17,3 +110,1381 @@ class SpaceExplorerTests(TestCase):
     def test_asteroids_endpoint(self):
         response = self.client.get(reverse('asteroids'))
         self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class MarsWeatherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def store_sols(self, sols):
+        for sol in sols:
+            CachedMarsWeather.objects.create(
+                sol=sol, temperature=-60.0 - sol % 10, temperature_min=-90.0, temperature_max=-10.0 + sol % 10,
+                wind_speed=5.0, pressure=700.0 + sol % 10, most_common_wind_direction='WNW',
+            )
+
+    def test_served_in_insight_shape_merged_with_stored_sols(self):
+        self.store_sols([673, 674])
+        CachedMarsWeather.objects.update(last_updated=timezone.now() - timedelta(days=2))
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            response = self.client.get(reverse('mars_weather'))
+
+        data = response.json()
+        self.assertEqual(data['sol_keys'], ['673', '674', '675'])
+        self.assertEqual(data['675']['AT'], {'av': -62.3, 'mn': -96.9, 'mx': -15.9})
+        self.assertEqual(data['675']['First_UTC'], '2020-10-19T18:32:20Z')
+        self.assertEqual(data['673']['WD']['most_common'], {'compass_point': 'WNW', 'compass_degrees': 292.5})
+
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            self.assertEqual(self.client.get(reverse('mars_weather')).json(), data)
+        get_json.assert_not_called()
+
+    def test_empty_feed_serves_stored_sols_as_stale(self):
+        self.store_sols([673, 674])
+        CachedMarsWeather.objects.update(last_updated=timezone.now() - timedelta(days=2))
+        with mock.patch('space_explorer.upstream.get_json', return_value={'sol_keys': []}):
+            response = self.client.get(reverse('mars_weather'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Data-Stale'], 'true')
+        self.assertEqual(response.json()['sol_keys'], ['673', '674'])
+
+        cache.clear()
+        CachedMarsWeather.objects.all().delete()
+        with mock.patch('space_explorer.upstream.get_json', return_value={'sol_keys': []}), \
+                self.assertLogs('space_explorer.views', 'WARNING'):
+            self.assertEqual(self.client.get(reverse('mars_weather')).status_code, 503)
+
+    def test_rollup_buckets_and_downsamples(self):
+        self.store_sols(range(100, 110))
+
+        data = self.client.get(reverse('mars_weather_rollup'), {'bucket': 5}).json()
+        self.assertEqual((data['start_sol'], data['end_sol'], data['bucket_sols']), (100, 109, 5))
+        first = data['results'][0]
+        self.assertEqual((first['start_sol'], first['end_sol'], first['sols']), (100, 104, 5))
+        self.assertEqual(first['temperature_avg'], -62.0)
+        self.assertEqual(first['temperature_max'], -6.0)
+        self.assertEqual(first['pressure_min'], 700.0)
+
+        data = self.client.get(reverse('mars_weather_rollup'), {'start_sol': 100, 'end_sol': 109, 'max_points': 2}).json()
+        self.assertEqual(data['bucket_sols'], 5)
+        self.assertEqual(len(data['results']), 2)
+
+    def test_rollup_rejects_bad_range(self):
+        response = self.client.get(reverse('mars_weather_rollup'), {'start_sol': 10, 'end_sol': 5})
+        self.assertEqual(response.status_code, 400)
+
+
+def slow(value, delay=0.2):
+    def loader(*args):
+        time.sleep(delay)
+        return value
+    return loader
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        today = queries.apod_today().isoformat()
+        loaders = {
+            'load_apod': slow(apod_entry(today)),
+            'load_launches': slow(ingest.launches_payload([{
+                'launch_id': 'abc', 'name': 'Falcon 9', 'net': '2030-01-01T12:00:00Z',
+                'status': 'Go', 'agency': 'SpaceX', 'mission': 'Starlink', 'pad': 'SLC-40',
+            }])),
+            'load_asteroids': slow([
+                {'name': 'near', 'close_approach_date': today, 'miss_distance_km': 10.0,
+                 'diameter_max_meters': 5.0, 'is_potentially_hazardous': True},
+                {'name': 'far', 'close_approach_date': today, 'miss_distance_km': 99.0,
+                 'diameter_max_meters': 5.0, 'is_potentially_hazardous': False},
+                {'name': 'later', 'close_approach_date': '2099-01-01', 'miss_distance_km': 1.0,
+                 'diameter_max_meters': 5.0, 'is_potentially_hazardous': True},
+            ]),
+            'load_mars_weather': slow(INSIGHT_FEED),
+        }
+        for name, loader in loaders.items():
+            patcher = mock.patch(f'space_explorer.views.{name}', side_effect=loader)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sections_load_concurrently(self):
+        started = time.perf_counter()
+        response = self.client.get(reverse('dashboard'))
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.6)  # Four 0.2s loads, overlapped
+        sections = response.json()['sections']
+        self.assertEqual(set(sections), {'apod', 'launches', 'asteroids', 'mars_weather'})
+        self.assertEqual(sections['apod']['data']['media_url'], reverse('apod_media', args=[queries.apod_today().isoformat()]))
+        self.assertEqual(sections['launches']['data'][0]['launch_id'], 'abc')
+        asteroids = sections['asteroids']['data']
+        self.assertEqual((asteroids['count'], asteroids['hazardous_count']), (2, 1))
+        self.assertEqual(asteroids['closest']['name'], 'near')
+        self.assertEqual(sections['mars_weather']['data']['sol'], 675)
+        self.assertFalse(sections['mars_weather']['stale'])
+        self.assertNotIn('X-Data-Stale', response)
+
+    def test_sections_parameter(self):
+        data = self.client.get(reverse('dashboard'), {'sections': 'apod,mars_weather'}).json()
+        self.assertEqual(set(data['sections']), {'apod', 'mars_weather'})
+
+        response = self.client.get(reverse('dashboard'), {'sections': 'apod,weather'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_section_does_not_fail_dashboard(self):
+        error = requests.exceptions.ConnectionError('down')
+        with mock.patch('space_explorer.views.load_launches', side_effect=error), \
+                self.assertLogs('space_explorer.dashboard', 'WARNING'):
+            response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Data-Stale'], 'true')
+        sections = response.json()['sections']
+        self.assertEqual(sections['launches']['status'], 503)
+        self.assertIn('data', sections['apod'])
+
+
+class MediaCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.upstreams = FakeUpstreams().start()
+        cls.addClassCleanup(cls.upstreams.stop)
+
+    def setUp(self):
+        media_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_dir)
+        overrides = override_settings(UPSTREAM_HOSTS=self.upstreams.settings_override(), MEDIA_CACHE_DIR=media_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(upstream.reset_sessions)
+        upstream.reset_sessions()
+        breaker.reset_breakers()
+        cache.clear()
+        self.upstreams.reset_counts()
+        ingest.save_apods([apod_entry('2024-03-01'), dict(apod_entry('2024-03-02'), media_type='video')])
+        self.image = image_payload('/apod/image/2024-03-01.jpg')
+
+    def get(self, date='2024-03-01', **headers):
+        response = self.client.get(reverse('apod_media', args=[date]), **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_first_request_fills_the_store_and_later_ones_read_it(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(b''.join(first.streaming_content), self.image)
+        self.assertEqual(first['Content-Type'], 'image/jpeg')
+        self.assertEqual(first['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        again = self.get()
+        self.assertEqual(b''.join(again.streaming_content), self.image)
+        self.assertEqual(self.upstreams.requests, {'/apod/image/2024-03-01.jpg': 1})
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_range_requests(self):
+        partial = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 10-19/{len(self.image)}')
+        self.assertEqual(b''.join(partial.streaming_content), self.image[10:20])
+
+        tail = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(tail.streaming_content), self.image[-5:])
+        self.assertEqual(self.get(HTTP_RANGE=f'bytes={len(self.image)}-').status_code, 416)
+
+    def test_least_recently_used_media_is_evicted(self):
+        ingest.save_apods([apod_entry('2024-03-03')])
+        with override_settings(MEDIA_CACHE_MAX_BYTES=len(self.image) + 1):
+            self.get('2024-03-01')
+            self.get('2024-03-03')
+            self.get('2024-03-01')
+        self.assertEqual(self.upstreams.requests['/apod/image/2024-03-01.jpg'], 2)
+
+    def test_only_stored_apod_images_are_proxied(self):
+        self.assertEqual(self.get('2024-03-02').status_code, 404)  # A video
+        self.assertEqual(self.get('2024-02-01').status_code, 404)
+        APOD.objects.filter(date='2024-03-01').update(url='https://example.com/x.jpg')
+        self.assertEqual(self.get().status_code, 502)
+        self.assertEqual(self.upstreams.total_requests, 0)
+
+    @override_settings(MEDIA_PREFETCH=True)
+    def test_recent_images_prefetched_when_stored(self):
+        recent = timezone.now().date().isoformat()
+        with mock.patch.object(media, '_executor') as executor:
+            ingest.save_apods([apod_entry(recent), apod_entry('2020-01-01')])
+        executor.submit.assert_called_once_with(media._prefetch, f'https://apod.nasa.gov/apod/image/{recent}.jpg')
+
+
+class DatabaseSetupTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def pragma(self, alias, name):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_to_new_connections(self):
+        self.assertEqual(self.pragma('default', 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma('default', 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('default', 'query_only'), 0)
+        self.assertEqual(self.pragma('replica', 'query_only'), 1)
+        self.assertEqual(self.pragma('default', 'auto_vacuum'), 2)  # INCREMENTAL
+
+
+
+@override_settings(DATABASE_READ_ALIAS='replica')
+class ReadRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def test_reads_routed_to_read_alias_and_writes_to_primary(self):
+        self.assertEqual(router.db_for_read(APOD), 'replica')
+        self.assertEqual(router.db_for_write(APOD), 'default')
+        self.assertEqual(APOD.objects.all().db, 'replica')
+        self.assertFalse(router.allow_migrate('replica', 'space_explorer'))
+
+    def test_reads_inside_a_transaction_stay_on_primary(self):
+        with transaction.atomic():
+            APOD.objects.create(**apod_entry('2020-01-01'))
+            self.assertEqual(router.db_for_read(APOD), 'default')
+            self.assertTrue(APOD.objects.filter(date='2020-01-01').exists())
+        self.assertEqual(APOD.objects.all().db, 'replica')
+        self.assertTrue(APOD.objects.filter(date='2020-01-01').exists())
+
+
+@override_settings(RETENTION_CHUNK_SIZE=2, RETENTION_CHUNK_PAUSE=0)
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        overrides = override_settings(RETENTION_ARCHIVE_DIR=self.archive_dir)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_age_policy_deletes_and_archives_in_chunks(self):
+        today = timezone.now().date()
+        for n, age in enumerate([500, 450, 420, 10]):
+            CachedAsteroid.objects.create(
+                neo_reference_id=str(n), name=f'({n})', diameter_max_meters=10, is_potentially_hazardous=False,
+                close_approach_date=today - timedelta(days=age), miss_distance_km=1e6,
+            )
+        policy = {'model': 'space_explorer.CachedAsteroid', 'date_field': 'close_approach_date',
+                  'max_age_days': 400, 'archive': True}
+
+        self.assertEqual(retention.prune('asteroids', policy, dry_run=True), 3)
+        # Two chunks of SAVEPOINT, ids, archive read, tombstone keys and
+        # INSERT, DELETE, RELEASE; then an empty one
+        with self.assertNumQueries(2 * 7 + 3):
+            deleted = retention.prune('asteroids', policy)
+        self.assertEqual(deleted, 3)
+        self.assertEqual(list(CachedAsteroid.objects.values_list('neo_reference_id', flat=True)), ['3'])
+        self.assertEqual(sorted(Tombstone.objects.values_list('key', flat=True)), ['0', '1', '2'])
+
+        [archive] = os.listdir(self.archive_dir)
+        with gzip.open(os.path.join(self.archive_dir, archive), 'rt') as f:
+            archived = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row['neo_reference_id'] for row in archived), ['0', '1', '2'])
+
+    def test_count_policy_keeps_newest_rows(self):
+        for sol in range(1, 6):
+            CachedMarsWeather.objects.create(sol=sol, temperature=-60, wind_speed=5, pressure=700)
+        policy = {'model': 'space_explorer.CachedMarsWeather', 'order_field': 'sol', 'max_rows': 2}
+
+        self.assertEqual(retention.prune('mars_weather', policy), 3)
+        self.assertEqual(sorted(CachedMarsWeather.objects.values_list('sol', flat=True)), [4, 5])
+        self.assertEqual(os.listdir(self.archive_dir), [])
+
+    def test_command_reports_rows_and_bytes(self):
+        out = StringIO()
+        call_command('run_retention', '--once', stdout=out)
+        self.assertIn('asteroids: deleted 0 rows', out.getvalue())
+        self.assertIn('database: reclaimed', out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('run_retention', 'favorites', '--once')
+
+    def test_command_reports_when_compaction_is_off(self):
+        out = StringIO()
+        with mock.patch('space_explorer.retention.incremental_vacuum', return_value=False), \
+                mock.patch('space_explorer.retention.compact', return_value=0) as compact:
+            call_command('run_retention', '--once', stdout=out)
+        compact.assert_called_once_with()
+        self.assertIn('compaction is off', out.getvalue())
+        self.assertNotIn('reclaimed', out.getvalue())
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    def test_reports_every_scenario(self):
+        out = StringIO()
+        call_command(
+            'benchmark', '--requests', '4', '--concurrency', '1', '--latency', '0',
+            '--only', 'launches', 'list_favorites', '--current-database',
+            stdout=out, stderr=StringIO(),
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {'launches', 'list_favorites'})
+        warm = report['scenarios']['launches']['warm']
+        self.assertEqual(warm['requests'], 4)
+        self.assertEqual(warm['errors'], 0)
+        self.assertEqual(warm['upstream_requests'], 0)
+        self.assertEqual(report['scenarios']['launches']['cold']['statuses'], {'200': 1})
+
+    def test_cold_phase_keeps_apods_and_favorites_in_current_database(self):
+        from django.contrib.auth.models import User
+
+        user = User.objects.create(username='kept')
+        Favorite.objects.create(user=user, apod=APOD.objects.create(**apod_entry('2020-01-01')))
+        call_command(
+            'benchmark', '--requests', '1', '--concurrency', '1', '--latency', '0',
+            '--only', 'launches', '--current-database', stdout=StringIO(), stderr=StringIO(),
+        )
+        self.assertTrue(Favorite.objects.filter(user=user, apod__date='2020-01-01').exists())
+
+    def test_new_scenarios_succeed(self):
+        out = StringIO()
+        names = ['search_apods', 'export_apods', 'export_asteroids', 'metrics', 'batch_favorites']
+        call_command(
+            'benchmark', '--requests', '3', '--concurrency', '1', '--latency', '0',
+            '--only', *names, '--current-database', stdout=out, stderr=StringIO(),
+        )
+        report = json.loads(out.getvalue())
+        for name in names:
+            self.assertEqual(set(report['scenarios'][name]['warm']['statuses']), {'200'}, name)
+
+    def test_every_route_has_a_scenario(self):
+        routes = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual({scenario[1] for scenario in benchmark.SCENARIOS} | benchmark.UNBENCHMARKED, routes)
+
+    def test_current_database_is_left_without_fake_data(self):
+        kept = APOD.objects.create(**apod_entry('2020-01-01'))
+        call_command(
+            'benchmark', '--requests', '2', '--concurrency', '1', '--latency', '0',
+            '--only', 'apod_range', 'search_apods', 'unfavorite_apod', 'asteroids', '--current-database',
+            stdout=StringIO(), stderr=StringIO(),
+        )
+        self.assertEqual(list(APOD.objects.all()), [kept])
+        self.assertFalse(CachedAsteroid.objects.exists())
+
+    def test_refuses_concurrent_writers_on_in_memory_database(self):
+        with self.assertRaisesMessage(CommandError, '--concurrency 1'):
+            call_command('benchmark', '--concurrency', '2', '--current-database', stdout=StringIO())
+
+    def test_worker_failure_is_raised_instead_of_hanging(self):
+        with mock.patch('space_explorer.management.commands.benchmark.Client.get', side_effect=RuntimeError('boom')):
+            with self.assertRaisesMessage(CommandError, 'boom'):
+                call_command(
+                    'benchmark', '--requests', '2', '--concurrency', '1', '--latency', '0',
+                    '--only', 'launches', '--current-database', stdout=StringIO(), stderr=StringIO(),
+                )
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cold_miss_loads_once_and_caches(self):
+        loader = mock.Mock(return_value=['fresh'])
+        self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['fresh'])
+        self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['fresh'])
+        loader.assert_called_once()
+
+    def test_stale_value_served_while_refreshing(self):
+        caching.store('swr_test', ['old'], 'launches')
+        entry = cache.get('swr_test')
+        entry['fresh_until'] = time.time() - 1
+        cache.set('swr_test', entry)
+
+        loader = mock.Mock(return_value=['new'])
+        self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['old'])
+        loader.assert_called_once()
+        self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['new'])
+
+    def test_refresh_skipped_while_locked(self):
+        caching.store('swr_test', ['old'], 'launches')
+        entry = cache.get('swr_test')
+        entry['fresh_until'] = time.time() - 1
+        cache.set('swr_test', entry)
+        cache.add('swr_test:refresh-lock', 1)
+
+        loader = mock.Mock(return_value=['new'])
+        self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['old'])
+        loader.assert_not_called()
+
+    def test_failed_refresh_keeps_stale_value(self):
+        caching.store('swr_test', ['old'], 'launches')
+        entry = cache.get('swr_test')
+        entry['fresh_until'] = time.time() - 1
+        cache.set('swr_test', entry)
+
+        loader = mock.Mock(side_effect=RuntimeError('upstream down'))
+        with self.assertLogs('space_explorer.caching', level='ERROR'):
+            self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['old'])
+        self.assertEqual(caching.snapshot_value(cache.get('swr_test')), ['old'])
+
+    def test_waiter_retries_as_soon_as_a_failed_load_releases_the_lock(self):
+        lock_key = 'swr_test:refresh-lock'
+        cache_backends.consistent(cache).add(lock_key, 1)
+        # The other worker's load fails: its lock goes, and nothing is stored
+        releaser = threading.Timer(0.1, cache_backends.consistent(cache).delete, [lock_key])
+        releaser.start()
+        self.addCleanup(releaser.cancel)
+
+        loader = mock.Mock(return_value=['fresh'])
+        started = time.monotonic()
+        self.assertEqual(caching.get_or_refresh('swr_test', loader, 'launches'), ['fresh'])
+        self.assertLess(time.monotonic() - started, 1)
+        loader.assert_called_once()
+        self.assertIsNone(cache_backends.consistent(cache).get(lock_key))
+
+
+    @override_settings(CACHE_WAIT_TIMEOUT=0.2)
+    def test_waiters_time_out_instead_of_loading_alongside_a_slow_load(self):
+        cache_backends.consistent(cache).add('swr_test:refresh-lock', 1)  # Held by a slow load
+        loader = mock.Mock(return_value=['fresh'])
+        with self.assertRaises(requests.exceptions.Timeout):
+            caching.get_or_refresh('swr_test', loader, 'launches')
+        loader.assert_not_called()
+
+
+class UpstreamClientTests(TestCase):
+    def tearDown(self):
+        upstream.reset_sessions()
+
+    @override_settings(NASA_API_KEY='test-key')
+    def test_get_uses_pooled_session_with_timeouts(self):
+        with mock.patch('requests.Session.get', return_value=mock.Mock(status_code=200, headers={})) as session_get:
+            upstream.get('apod', {'date': '2024-01-01'})
+            upstream.get('insight_weather')
+
+        self.assertEqual(session_get.call_count, 2)
+        args, kwargs = session_get.call_args_list[0]
+        self.assertEqual(args[0], 'https://api.nasa.gov/planetary/apod')
+        self.assertEqual(kwargs['params'], {'date': '2024-01-01', 'api_key': 'test-key'})
+        self.assertEqual(kwargs['timeout'], (3.05, 10))
+        self.assertIs(upstream.get_session('nasa'), upstream.get_session('nasa'))
+
+    def test_sessions_are_per_host_with_bounded_retries(self):
+        nasa = upstream.get_session('nasa')
+        spacedevs = upstream.get_session('spacedevs')
+        self.assertIsNot(nasa, spacedevs)
+        adapter = nasa.get_adapter('https://api.nasa.gov/')
+        self.assertEqual(adapter.max_retries.total, 2)
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class IngestionSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_run_once_writes_tables_and_primes_cache(self):
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            call_command('run_ingestion', '--once', stdout=StringIO())
+
+        self.assertEqual(CachedLaunch.objects.count(), 1)
+        self.assertEqual(CachedAsteroid.objects.count(), 1)
+        self.assertEqual(CachedMarsWeather.objects.count(), 1)
+        self.assertEqual(caching.snapshot_value(cache.get('mars_weather_data'))['sol_keys'], ['675'])
+
+    def test_views_only_read_after_prewarm(self):
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            call_command('run_ingestion', 'asteroids', '--once', stdout=StringIO())
+
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            response = self.client.get(reverse('asteroids'))
+        get_json.assert_not_called()
+        self.assertEqual(response.json()[0]['neo_reference_id'], '1000001')
+
+    def test_unknown_dataset_is_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command('run_ingestion', 'comets', '--once')
+
+
+class BulkIngestionTests(TestCase):
+    def test_week_of_asteroids_is_upserted_in_a_handful_of_queries(self):
+        feed = {'near_earth_objects': {}}
+        for day in range(1, 8):
+            date = f'2030-01-0{day}'
+            feed['near_earth_objects'][date] = [
+                {
+                    'neo_reference_id': f'{day}{n:04d}',
+                    'name': f'({date} {n})',
+                    'estimated_diameter': {'meters': {'estimated_diameter_max': 10.0 + n}},
+                    'is_potentially_hazardous_asteroid': n % 5 == 0,
+                    'close_approach_data': [
+                        {'close_approach_date': date, 'miss_distance': {'kilometers': str(1e6 + n)}},
+                    ],
+                }
+                for n in range(20)
+            ]
+
+        with mock.patch('space_explorer.upstream.get_json', return_value=feed):
+            with self.assertNumQueries(3):  # SAVEPOINT, INSERT ... ON CONFLICT, RELEASE
+                rows = ingest.fetch_asteroids()
+        self.assertEqual(len(rows), 140)
+        self.assertIsNotNone(rows[0]['last_updated'])
+        self.assertEqual(CachedAsteroid.objects.count(), 140)
+
+    def test_upsert_updates_existing_rows_in_place(self):
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            ingest.fetch_launches()
+            ingest.fetch_mars_weather()
+
+        slipped = {'results': [dict(LAUNCHES_FEED['results'][0], status={'name': 'Hold'})]}
+        with mock.patch('space_explorer.upstream.get_json', return_value=slipped):
+            ingest.fetch_launches()
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            ingest.fetch_mars_weather()
+
+        self.assertEqual(CachedLaunch.objects.get().status, 'Hold')
+        self.assertEqual(CachedMarsWeather.objects.count(), 1)
+
+
+class LaunchSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def launch(self, launch_id, net, last_updated='2029-12-01T00:00:00Z', **fields):
+        return dict(LAUNCHES_FEED['results'][0], id=launch_id, net=net, last_updated=last_updated, **fields)
+
+    def test_slipped_launch_updates_its_row(self):
+        feed = {'results': [self.launch('a', '2030-01-01T12:00:00Z')]}
+        with mock.patch('space_explorer.upstream.get_json', return_value=feed):
+            ingest.fetch_launches()
+        slipped = self.launch('a', '2030-01-03T12:00:00Z', '2029-12-02T00:00:00Z')
+        with mock.patch('space_explorer.upstream.get_json', return_value={'results': [slipped]}):
+            ingest.fetch_launches()
+
+        launch = CachedLaunch.objects.get()
+        self.assertEqual(launch.net.day, 3)
+        self.assertEqual(launch.upstream_updated.day, 2)
+
+    def test_sync_pages_through_changes_since_the_last_sync(self):
+        pages = [
+            {'results': [self.launch('a', '2030-01-01T12:00:00Z', '2029-12-01T00:00:00Z')], 'next': 'page-2'},
+            {'results': [self.launch('b', '2030-01-02T12:00:00Z', '2029-12-05T00:00:00Z')], 'next': None},
+        ]
+        with mock.patch('space_explorer.upstream.get_json', side_effect=pages) as get_json:
+            rows = ingest.fetch_launches()
+        self.assertEqual(len(rows), 2)
+        self.assertNotIn('last_updated__gte', get_json.call_args_list[0].args[1])
+        self.assertEqual(get_json.call_args_list[1].args[1]['offset'], ingest.LAUNCH_PAGE_SIZE)
+
+        with mock.patch('space_explorer.upstream.get_json', return_value={'results': []}) as get_json:
+            self.assertEqual(ingest.fetch_launches(), [])
+        self.assertEqual(get_json.call_args.args[1]['last_updated__gte'], '2029-12-05T00:00:00+00:00')
+        self.assertEqual(CachedLaunch.objects.count(), 2)
+
+    def test_flown_launches_are_pruned_and_not_served(self):
+        flown = self.launch('flown', (timezone.now() - timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%SZ'))
+        upcoming = self.launch('upcoming', '2030-01-01T12:00:00Z')
+        with mock.patch('space_explorer.upstream.get_json', return_value={'results': [flown, upcoming]}):
+            response = self.client.get(reverse('launches'))
+
+        self.assertEqual([row['launch_id'] for row in response.json()['results']], ['upcoming'])
+        self.assertEqual(list(CachedLaunch.objects.values_list('launch_id', flat=True)), ['upcoming'])
+
+
+def apod_range_feed(endpoint, params):
+    start, end = parse_date(params['start_date']), parse_date(params['end_date'])
+    return [apod_entry((start + timedelta(days=n)).isoformat()) for n in range((end - start).days + 1)]
+
+
+class BackfillCommandTests(TestCase):
+    def backfill(self, *args):
+        out = StringIO()
+        call_command('backfill_apod', '--start', '2024-01-01', '--end', '2024-01-10', '--chunk-days', '3', *args, stdout=out)
+        return out.getvalue()
+
+    def test_resumes_from_checkpoint_within_budget(self):
+        chunks = ingest.apod_chunks(date(2024, 1, 1), date(2024, 1, 10), 3)
+        with mock.patch('space_explorer.upstream.get_json', side_effect=apod_range_feed) as get_json:
+            output = self.backfill('--budget', '2')
+        self.assertEqual(get_json.call_count, 2)
+        self.assertIn('rerun to resume', output)
+        self.assertEqual(len(ingest.get_checkpoint('apod_backfill')['done']), 2)
+
+        with mock.patch('space_explorer.upstream.get_json', side_effect=apod_range_feed) as get_json:
+            self.assertIn('Backfill complete', self.backfill())
+        self.assertEqual(get_json.call_count, len(chunks) - 2)
+        self.assertEqual(APOD.objects.filter(date__range=('2024-01-01', '2024-01-10')).count(), 10)
+
+    def test_ends_at_nasas_today_not_utcs(self):
+        # 02:00 UTC on the 9th is still the 8th where APOD publishes
+        late = timezone.make_aware(datetime(2024, 1, 9, 2), dt_timezone.utc)
+        with mock.patch('space_explorer.queries.timezone.now', return_value=late), \
+                mock.patch('space_explorer.upstream.get_json', side_effect=apod_range_feed) as get_json:
+            call_command('backfill_apod', '--start', '2024-01-05', '--chunk-days', '3', stdout=StringIO())
+        self.assertEqual(max(call.args[1]['end_date'] for call in get_json.call_args_list), '2024-01-08')
+
+    def test_skips_stored_days_and_reports_failures(self):
+        ingest.save_apods(apod_range_feed('apod', {'start_date': '2024-01-01', 'end_date': '2024-01-10'}))
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            self.backfill()
+        get_json.assert_not_called()
+
+        def first_chunk_fails(endpoint, params):
+            if params['start_date'] == '2024-01-01':
+                raise requests.exceptions.HTTPError('500 Server Error')
+            return apod_range_feed(endpoint, params)
+
+        APOD.objects.all().delete()
+        with mock.patch('space_explorer.upstream.get_json', side_effect=first_chunk_fails):
+            with self.assertRaises(CommandError), self.assertLogs('space_explorer.management', 'WARNING'):
+                self.backfill('--restart')
+        self.assertFalse(APOD.objects.filter(date='2024-01-01').exists())
+        self.assertTrue(APOD.objects.filter(date='2024-01-10').exists())
+
+
+class FavoritesTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        cache.clear()
+        self.user = User.objects.create_user('collector')
+        self.client.force_login(self.user)
+        self.apods = [APOD.objects.create(**apod_entry(f'2024-02-0{day}')) for day in (1, 2, 3)]
+        for apod_obj in self.apods:
+            Favorite.objects.create(user=self.user, apod=apod_obj)
+
+    def test_list_is_cached_until_a_write(self):
+        with mock.patch('space_explorer.favorites.list_page', wraps=favorites.list_page) as list_page:
+            first = self.client.get(reverse('list_favorites'))
+            self.assertEqual(self.client.get(reverse('list_favorites')).json(), first.json())
+            self.assertEqual(list_page.call_count, 1)
+            self.assertIn('private', first['Cache-Control'])
+
+            self.client.delete(reverse('unfavorite_apod', args=[self.apods[0].id]))
+            self.assertEqual(len(self.client.get(reverse('list_favorites')).json()['favorites']), 2)
+            self.assertEqual(list_page.call_count, 2)
+
+    def test_cursor_pages_by_created_at_and_defers_explanation(self):
+        params = {'limit': 2, 'sort': '-created_at', 'explanation': 'false'}
+        first = self.client.get(reverse('list_favorites'), params).json()
+        self.assertNotIn('explanation', first['favorites'][0]['apod'])
+        self.assertIn('title', first['favorites'][0]['apod'])
+        second = self.client.get(reverse('list_favorites'), dict(params, cursor=first['next_cursor'])).json()
+        self.assertIsNone(second['next_cursor'])
+        dates = [favorite['apod']['date'] for favorite in first['favorites'] + second['favorites']]
+        self.assertEqual(dates, ['2024-02-03', '2024-02-02', '2024-02-01'])
+
+        self.assertEqual(self.client.get(reverse('list_favorites'), {'sort': 'title'}).status_code, 400)
+
+    def test_batch_applies_in_one_transaction(self):
+        body = {
+            'favorite': [apod_entry('2024-02-03'), apod_entry('2024-02-04'), apod_entry('2024-02-05')],
+            'unfavorite': [self.apods[0].id, 99999],
+        }
+        with mock.patch('space_explorer.upstream.get_json', side_effect=apod_range_feed) as get_json:
+            # Session and user; look up, fetch and read back the missing APODs; then
+            # the same eight in the transaction however large the batch
+            with self.assertNumQueries(13):
+                response = self.client.post(reverse('batch_favorites'), body, content_type='application/json')
+        get_json.assert_called_once_with('apod', {'start_date': '2024-02-04', 'end_date': '2024-02-05'})
+        data = response.json()
+        self.assertEqual(len(data['favorited']), 3)
+        self.assertEqual((data['unfavorited'], data['not_found']), ([self.apods[0].id], [99999]))
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 4)
+
+        bad = {'favorite': [apod_entry('2024-02-06'), {'title': 'No date'}], 'unfavorite': [self.apods[1].id]}
+        response = self.client.post(reverse('batch_favorites'), bad, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(APOD.objects.filter(date='2024-02-06').exists())
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 4)
+
+    def test_favorite_stores_nasas_apod_not_the_clients(self):
+        planted = apod_entry('2024-02-10', title='Planted', url='https://example.com/planted.jpg')
+        with mock.patch('space_explorer.upstream.get_json', side_effect=apod_range_feed):
+            response = self.client.post(reverse('favorite_apod'), planted, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(APOD.objects.get(date='2024-02-10').title, 'APOD 2024-02-10')
+
+        with mock.patch('space_explorer.upstream.get_json', return_value=[]):
+            response = self.client.post(reverse('favorite_apod'), apod_entry('2024-02-11'), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(APOD.objects.filter(date='2024-02-11').exists())
+
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            batch = {'favorite': [{'date': '2024-02-10', 'title': 'Planted again'}]}
+            response = self.client.post(reverse('batch_favorites'), batch, content_type='application/json')
+        get_json.assert_not_called()
+        self.assertEqual(len(response.json()['favorited']), 1)
+        self.assertEqual(APOD.objects.get(date='2024-02-10').title, 'APOD 2024-02-10')
+
+    def test_favorite_is_unique_per_user_and_apod(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Favorite.objects.create(user=self.user, apod=self.apods[0])
+
+
+
+@override_settings(DATABASE_READ_ALIAS='replica')
+class FavoritesBatchReplicaTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def test_batch_reads_its_own_writes(self):
+        from django.contrib.auth.models import User
+
+        user = User.objects.create_user('replicated')
+        kept = APOD.objects.create(**apod_entry('2024-02-01'))
+        Favorite.objects.create(user=user, apod=kept)
+        added = [APOD.objects.create(**apod_entry(day)).id for day in ('2024-02-02', '2024-02-03')]
+        favorited, unfavorited = favorites.apply_batch(user, added, [kept.id])
+        self.assertEqual(len(favorited), 2)
+        self.assertEqual(unfavorited, [kept.id])
+        self.assertEqual(
+            sorted(str(day) for day in Favorite.objects.filter(user=user).values_list('apod__date', flat=True)),
+            ['2024-02-02', '2024-02-03'],
+        )
+
+class SearchTests(TestCase):
+    def setUp(self):
+        entries = [
+            apod_entry('2024-01-01', title='The Andromeda Galaxy', explanation='Our nearest large spiral neighbour.'),
+            apod_entry('2024-01-02', title='Jupiter Clouds', explanation='Storms on Jupiter, seen by Juno.'),
+            apod_entry('2024-01-03', title='Spiral Arms', explanation='A galaxy seen face on.', media_type='video'),
+            apod_entry('2024-01-04', title='Dark Sky', explanation='The galaxy over a desert.'),
+        ]
+        ingest.save_apods(entries)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_apods'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_ranks_title_matches_first_and_highlights(self):
+        data = self.search(q='galaxy')
+        self.assertEqual([row['date'] for row in data['results']][0], '2024-01-01')
+        self.assertEqual(len(data['results']), 3)
+        self.assertIn('<mark>galaxy</mark>', data['results'][1]['snippet'])
+
+    def test_prefix_filters_and_keyset_pages(self):
+        self.assertEqual([row['date'] for row in self.search(q='galax', media_type='video')['results']], ['2024-01-03'])
+        self.assertEqual(len(self.search(q='galaxy', end_date='2024-01-02')['results']), 1)
+
+        first = self.search(q='galaxy', limit=2)
+        second = self.search(q='galaxy', limit=2, cursor=first['next_cursor'])
+        self.assertIsNone(second['next_cursor'])
+        dates = [row['date'] for row in first['results'] + second['results']]
+        self.assertEqual(dates, [row['date'] for row in self.search(q='galaxy')['results']])
+
+    def test_index_follows_updates_and_deletes(self):
+        APOD.objects.filter(date='2024-01-02').update(title='Saturn Rings', explanation='Rings.')
+        self.assertEqual(self.search(q='jupiter')['results'], [])
+        self.assertEqual(len(self.search(q='saturn')['results']), 1)
+        APOD.objects.filter(date='2024-01-02').delete()
+        self.assertEqual(self.search(q='saturn')['results'], [])
+
+    def test_query_syntax_is_searched_as_text(self):
+        self.assertEqual(len(self.search(q='galaxy"(')['results']), 3)
+        self.assertEqual(self.client.get(reverse('search_apods'), {'q': '**'}).status_code, 400)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2, EXPORT_BUFFER_BYTES=100)
+class ExportTests(TestCase):
+    def setUp(self):
+        for day in range(1, 6):
+            APOD.objects.create(**apod_entry(f'2024-01-0{day}', media_type='video' if day == 3 else 'image'))
+
+    def content(self, response):
+        body = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return body.decode()
+
+    def test_apod_ndjson_filtered(self):
+        response = self.client.get(reverse('export_apods'), {'start_date': '2024-01-02', 'media_type': 'image'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['date'] for row in rows], ['2024-01-02', '2024-01-04', '2024-01-05'])
+        self.assertIn('explanation', rows[0])
+
+    def test_apod_csv_gzipped_with_fields(self):
+        response = self.client.get(
+            reverse('export_apods'), {'format': 'csv', 'fields': 'title'}, HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('apod.csv', response['Content-Disposition'])
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0], 'date,title')
+        self.assertEqual(lines[1], '2024-01-01,APOD 2024-01-01')
+        self.assertEqual(len(lines), 6)
+
+    def test_asteroids_export_ignores_query_range_limit(self):
+        CachedAsteroid.objects.create(
+            neo_reference_id='1', name='(1)', diameter_max_meters=10, is_potentially_hazardous=True,
+            close_approach_date='2020-01-01', miss_distance_km=1e6,
+        )
+        response = self.client.get(
+            reverse('export_asteroids'), {'start_date': '2000-01-01', 'end_date': '2030-01-01', 'hazardous': 'true'},
+        )
+        [row] = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(row['neo_reference_id'], '1')
+
+    def test_bad_parameters_rejected(self):
+        self.assertEqual(self.client.get(reverse('export_apods'), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_asteroids'), {'start_date': 'soon'}).status_code, 400)
+
+
+@override_settings(SYNC_OVERLAP=0)
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def launch(self, launch_id, net, last_updated='2029-12-01T00:00:00Z'):
+        return dict(LAUNCHES_FEED['results'][0], id=launch_id, net=net, last_updated=last_updated)
+
+    def test_launches_since_returns_changes_and_deletions(self):
+        feed = {'results': [self.launch('a', '2030-01-01T12:00:00Z'), self.launch('b', '2030-01-02T12:00:00Z')]}
+        with mock.patch('space_explorer.upstream.get_json', return_value=feed):
+            first = self.client.get(reverse('launches'), {'fields': 'name'}).json()
+        self.assertEqual(first['results'][0], {'launch_id': 'a', 'name': LAUNCHES_FEED['results'][0]['name']})
+
+        flown = (timezone.now() - timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        changed = {'results': [self.launch('a', flown, '2029-12-03T00:00:00Z'),
+                               self.launch('b', '2030-01-05T12:00:00Z', '2029-12-03T00:00:00Z')]}
+        with mock.patch('space_explorer.upstream.get_json', return_value=changed):
+            ingest.fetch_launches()
+
+        data = self.client.get(reverse('launches'), {'since': first['sync_token'], 'fields': 'net'}).json()
+        self.assertEqual([row['launch_id'] for row in data['results']], ['b'])
+        self.assertEqual(set(data['results'][0]), {'launch_id', 'net'})
+        self.assertEqual(data['deleted'], ['a'])
+
+        data = self.client.get(reverse('launches'), {'since': data['sync_token']}).json()
+        self.assertEqual((data['results'], data['deleted']), ([], []))
+
+    def test_since_older_than_tombstones_resets(self):
+        with mock.patch('space_explorer.upstream.get_json', return_value=LAUNCHES_FEED):
+            data = self.client.get(reverse('launches'), {'since': '2000-01-01T00:00:00Z'}).json()
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['results']), 1)
+
+    def test_bad_since_or_fields_rejected(self):
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            self.assertEqual(self.client.get(reverse('asteroids'), {'since': 'yesterday'}).status_code, 400)
+            self.assertEqual(self.client.get(reverse('asteroids'), {'fields': 'name,secret'}).status_code, 400)
+            data = self.client.get(reverse('asteroids'), {'fields': 'miss_distance_km'}).json()
+        self.assertEqual(data['results'], [{'neo_reference_id': '1000001', 'miss_distance_km': 7500000.25}])
+
+    def test_asteroid_fields_keep_the_same_rows(self):
+        for n in range(3):
+            CachedAsteroid.objects.create(
+                neo_reference_id=f'old{n}', name=f'(old{n})', diameter_max_meters=10,
+                is_potentially_hazardous=False, close_approach_date='2020-01-01', miss_distance_km=1e6,
+            )
+        CachedAsteroid.objects.update(last_updated=timezone.now() - timedelta(days=3))
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            plain = self.client.get(reverse('asteroids')).json()
+            projected = self.client.get(reverse('asteroids'), {'fields': 'name'}).json()
+        self.assertEqual(len(projected['results']), len(plain))
+        self.assertEqual({row['name'] for row in projected['results']}, {row['name'] for row in plain})
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_since_is_paged(self):
+        since = delta.encode_token(timezone.now() - timedelta(minutes=1))
+        for n in range(5):
+            CachedAsteroid.objects.create(
+                neo_reference_id=str(n), name=f'({n})', diameter_max_meters=10,
+                is_potentially_hazardous=False, close_approach_date='2030-01-01', miss_distance_km=1e6,
+            )
+        seen = []
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            while since:
+                data = self.client.get(reverse('asteroids'), {'since': since, 'fields': 'name'}).json()
+                self.assertLessEqual(len(data['results']), 2)
+                self.assertEqual(set(data['results'][0]), {'neo_reference_id', 'name'})
+                seen += [row['neo_reference_id'] for row in data['results']]
+                since = data['sync_token'] if data.get('has_more') else None
+        self.assertEqual(set(seen), {'0', '1', '2', '3', '4'})
+
+    def test_favorites_fields_and_deletions(self):
+        from django.contrib.auth.models import User
+
+        user = User.objects.create_user('delta')
+        self.client.force_login(user)
+        apods = [APOD.objects.create(**apod_entry(f'2024-01-0{day}')) for day in (1, 2)]
+        favorites = [Favorite.objects.create(user=user, apod=apod_obj) for apod_obj in apods]
+
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        data = self.client.get(reverse('list_favorites'), {'fields': 'apod.title,apod.date', 'since': since}).json()
+        self.assertEqual(data['favorites'][0], {'id': favorites[0].id, 'apod': {'title': apods[0].title, 'date': '2024-01-01'}})
+
+        self.client.delete(reverse('unfavorite_apod', args=[apods[0].id]))
+        data = self.client.get(reverse('list_favorites'), {'since': data['sync_token']}).json()
+        self.assertEqual((data['favorites'], data['deleted']), ([], [str(favorites[0].id)]))
+
+
+class AsteroidQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for n in range(1, 6):
+            CachedAsteroid.objects.create(
+                neo_reference_id=str(n),
+                name=f'Asteroid {n}',
+                diameter_max_meters=100.0 * n,
+                is_potentially_hazardous=n % 2 == 0,
+                close_approach_date=f'2030-01-0{n}',
+                miss_distance_km=1e6 * (6 - n),
+            )
+
+    def query(self, **params):
+        with mock.patch('space_explorer.upstream.get_json', return_value={'near_earth_objects': {}}) as get_json:
+            response = self.client.get(reverse('query_asteroids'), params)
+        self.get_json = get_json
+        return response
+
+    def test_filters(self):
+        response = self.query(hazardous='true', min_diameter='300')
+        self.assertEqual([row['neo_reference_id'] for row in response.json()['results']], ['4'])
+
+        response = self.query(start_date='2030-01-02', end_date='2030-01-03', max_miss_distance='3500000')
+        self.assertEqual([row['neo_reference_id'] for row in response.json()['results']], ['3'])
+        self.get_json.assert_not_called()
+
+    def test_keyset_pagination_walks_every_row_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'sort': '-miss_distance_km', 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            body = self.query(**params).json()
+            seen.extend(row['neo_reference_id'] for row in body['results'])
+            cursor = body['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['1', '2', '3', '4', '5'])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.query(sort='name').status_code, 400)
+        self.assertEqual(self.query(start_date='yesterday').status_code, 400)
+        self.assertEqual(self.query(cursor='not-a-cursor').status_code, 400)
+
+    def test_missing_dates_are_fetched_in_weekly_windows(self):
+        response = self.query(start_date='2030-01-01', end_date='2030-01-20')
+        self.assertEqual(response.status_code, 200)
+        windows = sorted(
+            (call.args[1]['start_date'], call.args[1]['end_date'])
+            for call in self.get_json.call_args_list
+        )
+        self.assertEqual(windows, [('2030-01-06', '2030-01-12'), ('2030-01-13', '2030-01-19'), ('2030-01-20', '2030-01-20')])
+
+        # Days that came back empty are not requested again
+        self.query(start_date='2030-01-01', end_date='2030-01-20')
+        self.get_json.assert_not_called()
+
+    def test_failed_window_keeps_the_others_and_reports_its_days(self):
+        def second_window_fails(endpoint, params):
+            if params['start_date'] == '2030-01-13':
+                raise requests.exceptions.ConnectionError('NeoWs down')
+            return {'near_earth_objects': {}}
+
+        with mock.patch('space_explorer.upstream.get_json', side_effect=second_window_fails), \
+                self.assertLogs('space_explorer.ingest', 'WARNING'):
+            response = self.client.get(reverse('query_asteroids'), {'start_date': '2030-01-01', 'end_date': '2030-01-20'})
+        self.assertEqual(response['X-Data-Stale'], 'true')
+        self.assertEqual(response.json()['missing_dates'], [f'2030-01-{day}' for day in range(13, 20)])
+
+        # Only the failed window is requested again
+        response = self.query(start_date='2030-01-01', end_date='2030-01-20')
+        self.assertNotIn('missing_dates', response.json())
+        self.assertEqual(
+            [(call.args[1]['start_date'], call.args[1]['end_date']) for call in self.get_json.call_args_list],
+            [('2030-01-13', '2030-01-19')],
+        )
+
+
+def apod_entry(date, **fields):
+    entry = {
+        'date': date,
+        'title': f'APOD {date}',
+        'explanation': 'A picture of space.',
+        'url': f'https://apod.nasa.gov/apod/image/{date}.jpg',
+        'media_type': 'image',
+    }
+    entry.update(fields)
+    return entry
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class APODTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_stored_apod_is_served_without_upstream_call(self):
+        ingest.save_apods([apod_entry('2024-03-01', copyright='Someone')])
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            response = self.client.get(reverse('apod'), {'date': '2024-03-01'})
+        get_json.assert_not_called()
+        self.assertEqual(response.json()['title'], 'APOD 2024-03-01')
+        self.assertEqual(response.json()['copyright'], 'Someone')
+
+    def test_fetched_apod_is_stored(self):
+        with mock.patch('space_explorer.upstream.get_json', return_value=apod_entry('2024-03-02')):
+            self.client.get(reverse('apod'), {'date': '2024-03-02'})
+        self.assertTrue(APOD.objects.filter(date='2024-03-02').exists())
+
+    def test_range_fetches_only_missing_span_once(self):
+        ingest.save_apods([apod_entry('2024-03-01'), apod_entry('2024-03-05')])
+        fetched = [apod_entry(f'2024-03-0{day}') for day in (2, 3, 4)]
+        with mock.patch('space_explorer.upstream.get_json', return_value=fetched) as get_json:
+            response = self.client.get(reverse('apod_range'), {'start_date': '2024-03-01', 'end_date': '2024-03-05'})
+        get_json.assert_called_once_with('apod', {'start_date': '2024-03-02', 'end_date': '2024-03-04'})
+        self.assertEqual([entry['date'] for entry in response.json()['results']],
+                         ['2024-03-01', '2024-03-02', '2024-03-03', '2024-03-04', '2024-03-05'])
+
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            response = self.client.get(reverse('apod_range'), {'count': 3, 'end_date': '2024-03-05'})
+        get_json.assert_not_called()
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_today_expires_at_the_apod_day_boundary(self):
+        today = queries.apod_today()
+        with mock.patch('space_explorer.upstream.get_json', return_value=apod_entry(today.isoformat())):
+            self.assertEqual(self.client.get(reverse('apod')).status_code, 200)
+        entry = cache.get(f'apod_{today}')
+        self.assertEqual(entry['expires_at'], queries.next_apod_day())
+        self.assertLessEqual(entry['fresh_until'], entry['expires_at'])
+
+        # An explicit date=today shares the entry
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            self.client.get(reverse('apod'), {'date': today.isoformat()})
+        get_json.assert_not_called()
+
+    def test_past_dates_never_expire(self):
+        with mock.patch('space_explorer.upstream.get_json', return_value=apod_entry('2024-03-02')):
+            self.client.get(reverse('apod'), {'date': '2024-03-02'})
+        entry = cache.get('apod_2024-03-02')
+        self.assertIsNone(entry['expires_at'])
+        self.assertEqual(entry['fresh_until'], math.inf)
+
+    def test_unpublished_today_is_served_stale(self):
+        yesterday = queries.apod_today() - timedelta(days=1)
+        with mock.patch('space_explorer.upstream.get_json', return_value=apod_entry(yesterday.isoformat())):
+            response = self.client.get(reverse('apod'))
+        self.assertEqual(response['X-Data-Stale'], 'true')
+
+    def test_invalid_dates_never_reach_upstream(self):
+        tomorrow = queries.apod_today() + timedelta(days=1)
+        with mock.patch('space_explorer.upstream.get_json') as get_json:
+            for date in ('not-a-date', '1990-01-01', tomorrow.isoformat()):
+                self.assertEqual(self.client.get(reverse('apod'), {'date': date}).status_code, 400)
+        get_json.assert_not_called()
+
+    def test_rejected_date_is_negatively_cached(self):
+        rejection = requests.Response()
+        rejection.status_code = 404
+        error = requests.exceptions.HTTPError(
+            '404 Client Error: Not Found for url: https://api.nasa.gov/planetary/apod?api_key=SECRET',
+            response=rejection,
+        )
+        with mock.patch('space_explorer.upstream.get_json', side_effect=error) as get_json, \
+                self.assertLogs('space_explorer.views', 'WARNING'):
+            for _ in range(3):
+                response = self.client.get(reverse('apod'), {'date': '2024-03-03'})
+                self.assertEqual(response.status_code, 404)
+                self.assertNotIn(b'SECRET', response.content)
+                self.assertIn('upstream status 404', response.json()['error'])
+        get_json.assert_called_once()
+
+    def test_range_validation(self):
+        self.assertEqual(self.client.get(reverse('apod_range')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('apod_range'), {'start_date': '1990-01-01'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('apod_range'), {'count': 1000}).status_code, 400)
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            call_command('run_ingestion', '--once', stdout=StringIO())
+
+    def test_unchanged_data_gets_bodyless_304(self):
+        for name in ('launches', 'asteroids'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+
+            repeat = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(repeat.status_code, 304)
+            self.assertEqual(repeat.content, b'')
+
+    def test_etag_changes_with_content(self):
+        etag = self.client.get(reverse('launches'))['ETag']
+        slipped = {'results': [dict(LAUNCHES_FEED['results'][0], status={'name': 'Hold'})]}
+        with mock.patch('space_explorer.upstream.get_json', return_value=slipped):
+            call_command('run_ingestion', 'launches', '--once', stdout=StringIO())
+
+        response = self.client.get(reverse('launches'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_uncached_read_views_hash_the_body(self):
+        ingest.save_apods([apod_entry('2024-03-01')])
+        params = {'start_date': '2024-03-01', 'end_date': '2024-03-01'}
+        response = self.client.get(reverse('apod_range'), params)
+        repeat = self.client.get(reverse('apod_range'), params, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False, SNAPSHOT_COMPRESS_MIN_SIZE=0)
+class SnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            call_command('run_ingestion', '--once', stdout=StringIO())
+
+    def test_snapshot_bytes_are_served_without_reencoding(self):
+        entry = cache.get('launches_data')
+        with mock.patch('json.dumps') as dumps:
+            response = self.client.get(reverse('launches'))
+        dumps.assert_not_called()
+        self.assertEqual(response.content, entry['body'])
+        self.assertEqual(response.json()['results'][0]['name'], 'Falcon 9 | Starlink Group 1')
+
+    def test_gzip_variant_is_negotiated(self):
+        response = self.client.get(reverse('asteroids'), HTTP_ACCEPT_ENCODING='br;q=0, gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content))[0]['neo_reference_id'], '1000001')
+
+        identity = self.client.get(reverse('asteroids'), HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(identity.has_header('Content-Encoding'))
+        self.assertNotEqual(identity['ETag'], response['ETag'])
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_are_served_from_l1(self):
+        cache.set('tiered_test', {'value': 1})
+        with mock.patch.object(caches['shared'], 'get', wraps=caches['shared'].get) as shared_get:
+            for _ in range(3):
+                self.assertEqual(cache.get('tiered_test'), {'value': 1})
+        fetched = [call for call in shared_get.call_args_list if call.args[0] == 'tiered_test']
+        self.assertEqual(fetched, [])
+
+    def test_write_in_another_worker_invalidates_l1(self):
+        cache.set('tiered_test', 'old')
+        self.assertEqual(cache.get('tiered_test'), 'old')
+
+        # Another worker writes straight to the shared tier and bumps the epoch
+        caches['shared'].set('tiered_test', 'new')
+        caches['shared'].incr(cache_backends.EPOCH_KEY)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 5):
+            self.assertEqual(cache.get('tiered_test'), 'new')
+
+    def test_add_is_atomic_in_shared_tier(self):
+        self.assertTrue(cache.add('tiered_lock', 1))
+        self.assertFalse(caches['shared'].add('tiered_lock', 1))
+        cache.delete('tiered_lock')
+        self.assertTrue(caches['shared'].add('tiered_lock', 1))
+
+    def test_writes_keep_other_l1_entries_and_publishing_drops_them(self):
+        cache.set('tiered_kept', 'old')
+        epoch = caches['shared'].get(cache_backends.EPOCH_KEY)
+        cache.set('tiered_other', 1)
+        cache.set_many({'tiered_a': 1, 'tiered_b': 2})
+        cache.delete('tiered_other')
+        self.assertEqual(caches['shared'].get(cache_backends.EPOCH_KEY), epoch)
+
+        caches['shared'].set('tiered_kept', 'new')  # Written by another worker
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 5):
+            self.assertEqual(cache.get('tiered_kept'), 'old')
+            cache_backends.invalidate(cache)
+            self.assertEqual(cache.get('tiered_kept'), 'new')
+
+    def test_clear_bumps_epoch(self):
+        cache.set('tiered_test', 1)
+        cache_backends.invalidate(cache)
+        epoch = caches['shared'].get(cache_backends.EPOCH_KEY)
+        cache.clear()
+        self.assertNotEqual(caches['shared'].get(cache_backends.EPOCH_KEY), epoch)
+
+    def test_stale_l1_copy_is_reloaded_before_refreshing(self):
+        caching.store('tiered_swr', ['new'], 'launches')
+        fresh = caches['shared'].get('tiered_swr')
+        cache.set('tiered_swr', dict(fresh, body=b'["old"]', fresh_until=time.time() - 1))
+        caches['shared'].set('tiered_swr', fresh)  # Another worker has refreshed it since
+
+        loader = mock.Mock(return_value=['newer'])
+        self.assertEqual(caching.get_or_refresh('tiered_swr', loader, 'launches'), ['new'])
+        loader.assert_not_called()
+
+    def test_l1_is_bounded(self):
+        for n in range(260):
+            cache.set(f'tiered_{n}', n)
+        self.assertLessEqual(len(cache_backends._stores['default']), 256)
+        self.assertEqual(cache.get('tiered_0'), 0)  # Still in the shared tier
+
+
+class LockingFileBasedCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.cache = cache_backends.LockingFileBasedCache(cache_dir, {})
+
+    def race(self, target, workers=8):
+        barrier = threading.Barrier(workers)
+        results = []
+
+        def run():
+            barrier.wait()
+            results.append(target())
+
+        threads = [threading.Thread(target=run) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_add_has_one_winner(self):
+        self.assertEqual(self.race(lambda: self.cache.add('lock', 1)).count(True), 1)
+
+    def test_incr_loses_no_updates(self):
+        self.cache.set('counter', 0)
+        self.race(lambda: [self.cache.incr('counter') for _ in range(20)])
+        self.assertEqual(self.cache.get('counter'), 160)
+
+    def test_lock_left_by_dead_process_is_broken(self):
+        lock_path = self.cache._key_to_file('lock') + self.cache.lock_suffix
+        open(lock_path, 'w').close()
+        os.utime(lock_path, (time.time() - 60, time.time() - 60))
+        self.assertTrue(self.cache.add('lock', 1))
+        self.assertFalse(os.path.exists(lock_path))
+
+
+@override_settings(
+    CACHE_REFRESH_ASYNC=False,
+    UPSTREAM_QUOTAS={'nasa': {'hourly_limit': 10, 'reserve': 3}},
+)
+class QuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_adhoc_calls_leave_the_reserve_for_scheduled_ones(self):
+        for _ in range(7):
+            quota.acquire('nasa')
+        with self.assertRaises(quota.QuotaExceeded):
+            quota.acquire('nasa')
+        with quota.scheduled():
+            for _ in range(3):
+                quota.acquire('nasa')
+            with self.assertRaises(quota.QuotaExceeded):
+                quota.acquire('nasa')
+        quota.acquire('spacedevs')  # No quota configured
+
+    def test_rate_limit_headers_shrink_the_budget(self):
+        quota.observe('nasa', mock.Mock(status_code=200, headers={'X-RateLimit-Remaining': '4'}))
+        self.assertLessEqual(quota.remaining('nasa'), 4.01)
+        quota.observe('nasa', mock.Mock(status_code=429, headers={}))
+        with quota.scheduled(), self.assertRaises(quota.QuotaExceeded):
+            quota.acquire('nasa')
+
+    def test_exhausted_budget_serves_stored_rows_without_calling_out(self):
+        CachedAsteroid.objects.create(
+            neo_reference_id='42', name='Old', diameter_max_meters=10, is_potentially_hazardous=False,
+            close_approach_date='2030-01-01', miss_distance_km=1e6,
+        )
+        CachedAsteroid.objects.update(last_updated=timezone.now() - timedelta(days=3))
+        quota.observe('nasa', mock.Mock(status_code=429, headers={}))
+
+        with mock.patch('requests.Session.get') as session_get:
+            response = self.client.get(reverse('asteroids'))
+        session_get.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['neo_reference_id'], '42')
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False, CIRCUIT_BREAKER={'failure_threshold': 2, 'recovery_timeout': 30})
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        breaker.reset_breakers()
+
+    def tearDown(self):
+        breaker.reset_breakers()
+
+    def test_opens_after_repeated_failures_and_probes_half_open(self):
+        circuit = breaker.get_breaker('nasa')
+        circuit.record_failure()
+        circuit.before_call()
+        circuit.record_failure()
+        with self.assertRaises(breaker.CircuitOpen):
+            circuit.before_call()
+
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 31):
+            circuit.before_call()  # The single half-open probe
+            with self.assertRaises(breaker.CircuitOpen):
+                circuit.before_call()
+            circuit.record_success()
+            circuit.before_call()
+        self.assertEqual(circuit.state, breaker.CLOSED)
+
+    def test_open_circuit_serves_last_known_rows_without_calling_out(self):
+        CachedAsteroid.objects.create(
+            neo_reference_id='42', name='Old', diameter_max_meters=10, is_potentially_hazardous=False,
+            close_approach_date='2030-01-01', miss_distance_km=1e6,
+        )
+        CachedAsteroid.objects.update(last_updated=timezone.now() - timedelta(days=3))
+
+        timeout = requests.exceptions.ConnectTimeout('timed out')
+        with mock.patch('requests.Session.get', side_effect=timeout) as session_get:
+            response = self.client.get(reverse('asteroids'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Data-Stale'], 'true')
+            self.assertEqual(response.json()[0]['neo_reference_id'], '42')
+
+            with self.assertRaises(requests.exceptions.ConnectTimeout):
+                upstream.get('neo_feed')
+            calls = session_get.call_count
+            with self.assertRaises(breaker.CircuitOpen):
+                upstream.get('neo_feed')
+            self.assertEqual(session_get.call_count, calls)
+
+    def test_no_stored_rows_is_a_fast_503(self):
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError('down')), \
+                self.assertLogs('space_explorer.views', 'WARNING'):
+            self.assertEqual(self.client.get(reverse('asteroids')).status_code, 503)
+
+
+@override_settings(CACHE_REFRESH_ASYNC=False)
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        breaker.reset_breakers()
+        metrics.reset()
+
+    def test_request_phases_and_cache_results_are_exported(self):
+        with mock.patch('space_explorer.upstream.get_json', side_effect=fake_get_json):
+            self.client.get(reverse('launches'))
+            self.client.get(reverse('launches'))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('space_request_duration_seconds_count{view="launches",method="GET",status="200"} 2', text)
+        self.assertIn('space_cache_lookups_total{family="launches",result="miss"} 1', text)
+        self.assertIn('space_cache_lookups_total{family="launches",result="hit"} 1', text)
+        for phase in ('cache', 'db', 'serialize', 'other'):
+            self.assertIn(f'space_request_phase_duration_seconds_count{{view="launches",phase="{phase}"}} 2', text)
+        self.assertIn('space_request_db_queries_bucket{view="launches",le="+Inf"} 2', text)
+
+    def test_upstream_calls_recorded_by_status(self):
+        with mock.patch('requests.Session.get', return_value=mock.Mock(status_code=503, headers={})):
+            upstream.get('neo_feed')
+        with mock.patch('requests.Session.get', side_effect=requests.exceptions.ReadTimeout('slow')):
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                upstream.get('neo_feed')
+
+        text = metrics.render()
+        self.assertIn('space_upstream_request_duration_seconds_count{host="nasa",endpoint="neo_feed",status="503"} 1', text)
+        self.assertIn(
+            'space_upstream_request_duration_seconds_count{host="nasa",endpoint="neo_feed",status="ReadTimeout"} 1', text,
+        )
@@ -0,0 +1,123 @@
+"""
+Shared HTTP client for the NASA and SpaceDevs upstreams.
+
+One ``requests.Session`` is kept per upstream host, so connections (and their
+TLS handshakes) are pooled and reused across requests within a worker. Every
+call has a connect/read timeout and a bounded number of retries, both taken
+from ``settings.UPSTREAM_HOSTS`` and ``settings.UPSTREAM_ENDPOINTS``.
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import breaker, metrics, quota
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host):
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = _sessions[host] = _build_session(settings.UPSTREAM_HOSTS[host])
+    return session
+
+
+def _build_session(config):
+    retry = Retry(
+        total=config['max_retries'],
+        backoff_factor=config['backoff_factor'],
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=('GET',),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config['pool_maxsize'],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def reset_sessions():
+    """Close every pooled session, e.g. after the upstream settings change."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get(endpoint, params=None, path='', stream=False):
+    """
+    Send a GET to the named upstream endpoint (plus ``path``, for endpoints
+    that cover a whole tree) and return the response. With ``stream``, the
+    body is left unread for the caller to iterate over.
+
+    Raises ``requests.exceptions.RequestException`` on connection errors and
+    timeouts, and its ``breaker.CircuitOpen`` / ``quota.QuotaExceeded``
+    subclasses when the host's circuit is open or its request budget is spent,
+    without calling out. HTTP error statuses are left for the caller to check.
+    """
+    config = settings.UPSTREAM_ENDPOINTS[endpoint]
+    host_config = settings.UPSTREAM_HOSTS[config['host']]
+
+    params = dict(params or {})
+    if host_config.get('api_key_setting'):
+        params['api_key'] = getattr(settings, host_config['api_key_setting'])
+
+    circuit = breaker.get_breaker(config['host'])
+    try:
+        circuit.before_call()
+    except breaker.CircuitOpen:
+        metrics.UPSTREAM_REJECTED.inc(host=config['host'], reason='circuit_open')
+        raise
+    try:
+        quota.acquire(config['host'])
+    except quota.QuotaExceeded:
+        circuit.cancel_call()
+        metrics.UPSTREAM_REJECTED.inc(host=config['host'], reason='quota')
+        raise
+
+    started = time.perf_counter()
+    try:
+        with metrics.phase('upstream'):
+            response = get_session(config['host']).get(
+                host_config['base_url'] + config['path'] + path,
+                params=params,
+                timeout=(config['connect_timeout'], config['read_timeout']),
+                stream=stream,
+            )
+    except requests.exceptions.RequestException as e:
+        circuit.record_failure()
+        metrics.UPSTREAM_DURATION.observe(
+            time.perf_counter() - started, host=config['host'], endpoint=endpoint, status=type(e).__name__,
+        )
+        raise
+    metrics.UPSTREAM_DURATION.observe(
+        time.perf_counter() - started, host=config['host'], endpoint=endpoint, status=response.status_code,
+    )
+
+    if response.status_code >= 500:
+        circuit.record_failure()
+    else:
+        circuit.record_success()
+    quota.observe(config['host'], response)
+    return response
+
+
+def get_json(endpoint, params=None):
+    """Like ``get``, but raise for HTTP error statuses and decode the body."""
+    response = get(endpoint, params)
+    response.raise_for_status()
+    return response.json()
@@ -1,15 +1,25 @@
 from django.urls import path
 from django.contrib.auth.views import LoginView
-from . import views
+from . import metrics, views
 
 urlpatterns = [
     path('apod/', views.apod, name='apod'),
+    path('apod/range/', views.apod_range, name='apod_range'),
+    path('apod/media/<str:date>/', views.apod_media, name='apod_media'),
+    path('apod/search/', views.search_apods, name='search_apods'),
+    path('apod/export/', views.export_apods, name='export_apods'),
     path('launches/', views.launches, name='launches'),
     path('mars-weather/', views.mars_weather, name='mars_weather'),
+    path('mars-weather/rollup/', views.mars_weather_rollup, name='mars_weather_rollup'),
     path('asteroids/', views.asteroids, name='asteroids'),
+    path('asteroids/query/', views.query_asteroids, name='query_asteroids'),
+    path('asteroids/export/', views.export_asteroids, name='export_asteroids'),
+    path('dashboard/', views.home_dashboard, name='dashboard'),
+    path('metrics', metrics.metrics_view, name='metrics'),
     # New endpoints for favorites
     path('accounts/login/', LoginView.as_view(template_name='registration/login.html'), name='login'),
     path('favorites/', views.list_favorites, name='list_favorites'),
+    path('favorites/batch/', views.batch_favorites, name='batch_favorites'),
     path('favorite-apod/', views.favorite_apod, name='favorite_apod'),
     path('unfavorite-apod/<int:apod_id>/', views.unfavorite_apod, name='unfavorite_apod'),
 ]
@@ -1,253 +1,411 @@
 import requests
-from django.http import JsonResponse
 from django.conf import settings
 from django.core.cache import cache
+from django.http import JsonResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import timedelta
-from .models import APOD, Favorite, CachedAsteroid, CachedMarsWeather, CachedLaunch
+from . import caching, dashboard, delta, exports, favorites, ingest, media, queries, responses, search, upstream
+from .models import APOD, Favorite, CachedAsteroid, CachedLaunch, CachedMarsWeather, SyncCheckpoint
 from django.contrib.auth.decorators import login_required
+from django.utils.cache import patch_cache_control
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ObjectDoesNotExist
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 def apod(request):
-    date = request.GET.get('date', None)  # Get date from query params
-    
-    # Check cache first
-    cache_key = f'apod_{date}' if date else 'apod_today'
-    cached_response = cache.get(cache_key)
-    
-    if cached_response:
-        return JsonResponse(cached_response)
-    
-    # Build NASA API URL
-    nasa_url = f'https://api.nasa.gov/planetary/apod?api_key={settings.NASA_API_KEY}'
-    if date:
-        nasa_url += f'&date={date}'
-    
+    today = queries.apod_today()
     try:
-        response = requests.get(nasa_url)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Save to database (only if not exists)
-        apod_obj, created = APOD.objects.get_or_create(
-            date=data.get('date', timezone.now().date()),
-            defaults={
-                'title': data['title'],
-                'explanation': data['explanation'],
-                'url': data['url'],
-                'hdurl': data.get('hdurl', ''),
-                'media_type': data.get('media_type', 'image'),
-                'copyright': data.get('copyright', '')
-            }
-        )
-        
-        # Cache for 24 hours
-        cache.set(cache_key, data, 86400)
-        return JsonResponse(data)
-        
+        day = queries.parse_apod_date(request.GET, today)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # NASA rejected this date recently; don't spend quota asking again
+    error_key = f'apod_{day}:error'
+    failure = cache.get(error_key)
+    if failure is not None:
+        return JsonResponse({'error': failure['error']}, status=failure['status'])
+
+    try:
+        entry = caching.get_entry(f'apod_{day}', lambda: load_apod(day), apod_policy(day, today))
+        return responses.cached_json_response(request, entry)
+
+    except requests.exceptions.RequestException as e:
+        response = upstream_error('NASA API', e)
+        if not is_unavailable(e):
+            failure = {'error': json.loads(response.content)['error'], 'status': response.status_code}
+            cache.set(error_key, failure, settings.APOD_ERROR_TTL)
+        return response
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def apod_policy(day, today):
+    # Today's APOD expires at the day boundary; past ones never change
+    return 'apod' if day == today else 'apod_archive'
+
+def load_apod(day):
+    today = queries.apod_today()
+    # Serve from the database when we already have this day's APOD
+    stored = APOD.objects.filter(date=day).first()
+    if stored:
+        return until_tomorrow(day, today, serialize_apod(stored))
+
+    params = {'date': day.isoformat()} if day != today else {}
+    try:
+        data = upstream.get_json('apod', params)
+    except requests.exceptions.RequestException as e:
+        if day != today or not is_unavailable(e):
+            raise
+        # Fall back to the latest APOD we have
+        latest = APOD.objects.order_by('-date').first()
+        if latest is None:
+            raise
+        return caching.Stale(serialize_apod(latest))
+    ingest.save_apods([data])
+    if data.get('date') != day.isoformat():
+        # Today's isn't published yet and NASA sent the latest it has
+        return caching.Stale(data)
+    return until_tomorrow(day, today, data)
+
+def until_tomorrow(day, today, data):
+    return caching.Until(data, queries.next_apod_day()) if day == today else data
+
+def is_unavailable(error):
+    # Outages, timeouts, open circuits and spent budgets, but not a 4xx
+    # telling us the request itself was bad.
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code >= 500 or response.status_code == 429
+
+def fallback_rows(queryset, error):
+    # The upstream can't be reached: answer with the rows we already have,
+    # marked stale, rather than an error.
+    if not is_unavailable(error):
+        raise error
+    rows = list(queryset)
+    if not rows:
+        raise error
+    return rows
+
+def upstream_error(source, error):
+    # The error's text can include the request URL, API key and all, so it
+    # is only logged; clients get the upstream's status code
+    logger.warning('Request to %s failed: %s', source, error)
+    status = 503 if is_unavailable(error) else error.response.status_code
+    message = f'Failed to fetch data from {source}'
+    response = getattr(error, 'response', None)
+    if response is not None:
+        message += f' (upstream status {response.status_code})'
+    return JsonResponse({'error': message}, status=status)
+
+def delta_response(request, entry, dataset, queryset):
+    # The cache entry is still read so a stale dataset gets refreshed, but
+    # deltas and projections come straight from the table
+    model, key, _ = delta.DATASETS[dataset]
+    try:
+        since = delta.parse_since(request.GET)
+        fields = delta.parse_fields(request.GET, delta.model_fields(model), key)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = JsonResponse(delta.changes(dataset, queryset, since, fields))
+    if entry.get('stale'):
+        response['X-Data-Stale'] = 'true'
+    return response
+
+def serialize_apod(apod_obj):
+    # Same shape as the NASA APOD API, which omits empty optional fields
+    data = {
+        'date': apod_obj.date.isoformat(),
+        'title': apod_obj.title,
+        'explanation': apod_obj.explanation,
+        'url': apod_obj.url,
+        'media_type': apod_obj.media_type,
+    }
+    if apod_obj.hdurl:
+        data['hdurl'] = apod_obj.hdurl
+    if apod_obj.copyright:
+        data['copyright'] = apod_obj.copyright
+    return data
+
+@require_http_methods(["GET"])
+@responses.conditional
+def apod_range(request):
+    try:
+        start, end = queries.parse_apod_range(request.GET, queries.apod_today())
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    stored = {
+        apod_obj.date: serialize_apod(apod_obj)
+        for apod_obj in APOD.objects.filter(date__range=(start, end))
+    }
+
+    # Fetch only the span of days we don't have, in a single upstream call
+    days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+    missing = [day for day in days if day not in stored]
+    partial = False
+    if missing:
+        try:
+            entries = ingest.fetch_apod_range(missing[0], missing[-1])
+        except requests.exceptions.RequestException as e:
+            if not is_unavailable(e):
+                return upstream_error('NASA API', e)
+            entries, partial = [], True  # Serve what we have
+        for entry in entries:
+            stored.setdefault(parse_date(entry['date']), entry)
+
+    response = JsonResponse({'results': [stored[day] for day in days if day in stored]})
+    if partial:
+        response['X-Data-Stale'] = 'true'
+    return response
+
+@require_http_methods(["GET", "HEAD"])
+def apod_media(request, date):
+    try:
+        day = parse_date(date)
+    except ValueError:
+        day = None
+    if day is None:
+        return JsonResponse({'error': 'date must be a YYYY-MM-DD date'}, status=400)
+    apod_obj = APOD.objects.filter(date=day).first()
+    if apod_obj is None or apod_obj.media_type != 'image':
+        return JsonResponse({'error': f'No APOD image stored for {day}'}, status=404)
+
+    url = media.media_url({'url': apod_obj.url, 'hdurl': apod_obj.hdurl}, request.GET.get('size'))
+    try:
+        stored = media.fetch(url)
+    except requests.exceptions.RequestException as e:
+        return upstream_error('APOD', e)
+    except media.MediaError as e:
+        return JsonResponse({'error': str(e)}, status=502)
+    return responses.file_response(request, stored['path'], stored['content_type'], stored['digest'])
+
 def launches(request):
-    # Try to get cached data
-    cached_data = cache.get('launches_data')
-
-    if not cached_data:
-        # Check if DB has fresh data (<24 hours old)
-        recent_launches = CachedLaunch.objects.filter(
-            last_updated__gte=timezone.now() - timedelta(hours=24)
-        ).values()
-
-        if recent_launches.exists():
-            cached_data = list(recent_launches)
-            cache.set('launches_data', cached_data, 86400)  # Cache for 24 hours
-        else:
-            # Fetch fresh data from SpaceDevs API
-            base_url = "https://lldev.thespacedevs.com/2.3.0/launches/upcoming/"
-            params = {
-                'mode': 'detailed',
-                'limit': 20,
-                'ordering': 'net',
-                'hide_recent_previous': 'true'
-            }
-            response = requests.get(base_url, params=params).json()
-
-            # Save to database
-            cached_data = []
-            for launch in response.get('results', []):
-                obj, _ = CachedLaunch.objects.update_or_create(
-                    name=launch.get('name', 'Unnamed Launch'),
-                    net=launch.get('net', None),
-                    defaults={
-                        'status': launch.get('status', {}).get('name', 'Status unknown'),
-                        'mission': launch.get('mission', {}).get('name', 'No mission'),
-                        'rocket': launch.get('rocket', {}).get('configuration', {}).get('name', 'Unknown rocket'),
-                        'pad': launch.get('pad', {}).get('name', 'Unknown pad'),
-                        'agency': launch.get('launch_service_provider', {}).get('name', 'Unknown agency'),
-                    }
-                )
-                cached_data.append({
-                    'name': obj.name,
-                    'net': obj.net,
-                    'status': obj.status,
-                    'mission': obj.mission,
-                    'rocket': obj.rocket,
-                    'pad': obj.pad,
-                    'agency': obj.agency,
-                })
-
-            cache.set('launches_data', cached_data, 86400)  # Cache for 24 hours
-
-    return JsonResponse({'results': cached_data})
+    try:
+        entry = caching.get_entry('launches_data', load_launches, 'launches')
+    except requests.exceptions.RequestException as e:
+        return upstream_error('SpaceDevs API', e)
+
+    if 'since' in request.GET or 'fields' in request.GET:
+        cutoff = timezone.now() - timedelta(seconds=settings.LAUNCH_PRUNE_AFTER)
+        queryset = CachedLaunch.objects.filter(net__gte=cutoff).order_by('net')
+        return delta_response(request, entry, 'launches', queryset)
+    return responses.cached_json_response(request, entry)
+
+def load_launches():
+    # Serve the stored launches while the last sync is recent (<24 hours old)
+    synced = SyncCheckpoint.objects.filter(
+        name='launches', updated_at__gte=timezone.now() - timedelta(hours=24)
+    )
+
+    if synced.exists():
+        return ingest.launches_payload(ingest.upcoming_launches())
+
+    # Sync the changes from SpaceDevs
+    try:
+        return ingest.synced_launches_payload(ingest.fetch_launches())
+    except requests.exceptions.RequestException as e:
+        rows = fallback_rows(ingest.upcoming_launches(), e)
+        return caching.Stale(ingest.launches_payload(rows))
 
 def mars_weather(request):
-    url = f'https://api.nasa.gov/insight_weather/?api_key={settings.NASA_API_KEY}&feedtype=json&ver=1.0'
-    response = requests.get(url)
-    return JsonResponse(response.json())
-
-def mars_weather2(request):
-    # Try to get cached data
-    cached_data = cache.get('mars_weather_data')
-
-    if not cached_data:
-        # Check if DB has fresh data (<24 hours old)
-        recent_weather = CachedMarsWeather.objects.filter(
-            last_updated__gte=timezone.now() - timedelta(hours=24)
-        ).values()
-
-        if recent_weather.exists():
-            cached_data = list(recent_weather)
-            cache.set('mars_weather_data', cached_data, 86400)  # Cache for 24 hours
-        else:
-            # Fetch fresh data from NASA API
-            url = f'https://api.nasa.gov/insight_weather/?api_key={settings.NASA_API_KEY}&feedtype=json&ver=1.0'
-            try:
-                response = requests.get(url)
-                response.raise_for_status()
-                data = response.json()
-            except requests.exceptions.RequestException as e:
-                return JsonResponse({'error': f'Failed to fetch data from NASA API: {str(e)}'}, status=500)
-
-            # Validate response
-            sol_keys = data.get('sol_keys', [])
-            if not sol_keys:
-                return JsonResponse({'error': 'No Mars weather data available'}, status=500)
-
-            # Save to database
-            cached_data = []
-            for sol in sol_keys:
-                sol_data = data.get(sol, {})
-                obj, _ = CachedMarsWeather.objects.update_or_create(
-                    sol=int(sol),  # Convert sol to an integer
-                    defaults={
-                        'temperature': sol_data.get('AT', {}).get('av', None),
-                        'temperature_min': sol_data.get('AT', {}).get('mn', None),
-                        'temperature_max': sol_data.get('AT', {}).get('mx', None),
-                        'wind_speed': sol_data.get('HWS', {}).get('av', None),
-                        'wind_speed_max': sol_data.get('HWS', {}).get('mx', None),
-                        'pressure': sol_data.get('PRE', {}).get('av', None),
-                        'first_utc': sol_data.get('First_UTC', None),
-                        'last_utc': sol_data.get('Last_UTC', None),
-                        'most_common_wind_direction': sol_data.get('WD', {}).get('most_common', {}).get('compass_point', None),
-                    }
-                )
-                cached_data.append({
-                    'sol': obj.sol,
-                    'temperature': obj.temperature,
-                    'temperature_min': obj.temperature_min,
-                    'temperature_max': obj.temperature_max,
-                    'wind_speed': obj.wind_speed,
-                    'wind_speed_max': obj.wind_speed_max,
-                    'pressure': obj.pressure,
-                    'first_utc': obj.first_utc,
-                    'last_utc': obj.last_utc,
-                    'most_common_wind_direction': obj.most_common_wind_direction,
-                })
-
-            cache.set('mars_weather_data', cached_data, 86400)  # Cache for 24 hours
-
-    return JsonResponse(cached_data, safe=False)
+    try:
+        entry = caching.get_entry('mars_weather_data', load_mars_weather, 'mars_weather')
+    except requests.exceptions.RequestException as e:
+        return upstream_error('NASA API', e)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+    return responses.cached_json_response(request, entry)
+
+def load_mars_weather():
+    # Check if DB has fresh data (<24 hours old)
+    recent_weather = CachedMarsWeather.objects.filter(
+        last_updated__gte=timezone.now() - timedelta(hours=24)
+    )
+
+    if recent_weather.exists():
+        return ingest.insight_payload(ingest.recent_mars_weather())
+
+    # Fetch fresh data from NASA API and merge it into the stored sols. An
+    # empty feed (ingest.EmptyFeed) falls back to them like an outage does.
+    try:
+        return ingest.mars_weather_payload(ingest.fetch_mars_weather())
+    except requests.exceptions.RequestException as e:
+        rows = fallback_rows(ingest.recent_mars_weather(), e)
+        return caching.Stale(ingest.insight_payload(rows))
+
+@require_http_methods(["GET"])
+@responses.conditional
+def mars_weather_rollup(request):
+    try:
+        start, end, bucket = queries.parse_sol_rollup(request.GET, CachedMarsWeather.objects.all())
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    results = []
+    if start is not None:
+        results = queries.rollup_mars_weather(CachedMarsWeather.objects.all(), start, end, bucket)
+    return JsonResponse({'start_sol': start, 'end_sol': end, 'bucket_sols': bucket, 'results': results})
 
 def asteroids(request):
-    # Try to get cached data
-    cached_data = cache.get('asteroids_data')
-    
-    if not cached_data:
-        # Check if DB has fresh data (<24 hours old)
-        recent_asteroids = CachedAsteroid.objects.filter(
-            last_updated__gte=timezone.now() - timedelta(hours=24)
-        )
-        
-        if recent_asteroids.exists():
-            cached_data = list(recent_asteroids.values())
-            cache.set('asteroids_data', cached_data, 86400)  # Cache for 24h
-        else:
-            # Fetch fresh from NASA API
-            fresh_data = fetch_from_nasa_api()
-            cache.set('asteroids_data', fresh_data, 86400)
-            cached_data = fresh_data
-            
-    return JsonResponse(cached_data, safe=False)
-
-def fetch_from_nasa_api():
-    url = f'https://api.nasa.gov/neo/rest/v1/feed?api_key={settings.NASA_API_KEY}'
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        entry = caching.get_entry('asteroids_data', load_asteroids, 'asteroids')
     except requests.exceptions.RequestException as e:
-        return JsonResponse({'error': f'Failed to fetch data from NASA API: {str(e)}'}, status=500)
-    
-    # Save to database
-    asteroids = []
-    for neo in data['near_earth_objects'].values():
-        for item in neo:
-            obj, _ = CachedAsteroid.objects.update_or_create(
-                neo_reference_id=item['neo_reference_id'],
-                defaults={
-                    'name': item['name'],
-                    'diameter_max_meters': item['estimated_diameter']['meters']['estimated_diameter_max'],
-                    'is_potentially_hazardous': item['is_potentially_hazardous_asteroid'],
-                    'close_approach_date': item['close_approach_data'][0]['close_approach_date'],
-                    'miss_distance_km': float(item['close_approach_data'][0]['miss_distance']['kilometers']),
-                }
-            )
-            asteroids.append({
-                'neo_reference_id': obj.neo_reference_id,
-                'name': obj.name,
-                'diameter_max_meters': obj.diameter_max_meters,
-                'is_potentially_hazardous': obj.is_potentially_hazardous,
-                'close_approach_date': obj.close_approach_date,
-                'miss_distance_km': obj.miss_distance_km,
-            })
-    return asteroids
+        return upstream_error('NASA API', e)
+
+    if 'since' in request.GET or 'fields' in request.GET:
+        # The rows the plain response holds: the recent feed, or every stored
+        # row when that is the stale fallback
+        queryset = CachedAsteroid.objects.all() if entry.get('stale') else recent_asteroids()
+        return delta_response(request, entry, 'asteroids', queryset.order_by('close_approach_date', 'id'))
+    return responses.cached_json_response(request, entry)
+
+def recent_asteroids():
+    # Rows written by a fetch in the last 24 hours
+    return CachedAsteroid.objects.filter(last_updated__gte=timezone.now() - timedelta(hours=24))
+
+def load_asteroids():
+    # Check if DB has fresh data (<24 hours old)
+    recent = recent_asteroids()
+
+    if recent.exists():
+        return list(recent.values())
+
+    # Fetch fresh from NASA API
+    try:
+        return ingest.fetch_asteroids()
+    except requests.exceptions.RequestException as e:
+        return caching.Stale(fallback_rows(CachedAsteroid.objects.order_by('close_approach_date').values(), e))
+
+@require_http_methods(["GET"])
+@responses.conditional
+def query_asteroids(request):
+    sort = request.GET.get('sort', 'close_approach_date')
+    if sort not in queries.ASTEROID_SORTS:
+        return JsonResponse({'error': f'sort must be one of: {", ".join(sorted(queries.ASTEROID_SORTS))}'}, status=400)
+    try:
+        filters = queries.parse_asteroid_filters(request.GET)
+        limit = queries.parse_limit(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Fill in any part of the requested range we haven't stored yet
+    unfetched = []
+    if filters['start_date'] and filters['end_date']:
+        missing = ingest.missing_asteroid_dates(filters['start_date'], filters['end_date'])
+        if missing:
+            try:
+                _, unfetched = ingest.fetch_asteroid_dates(missing)
+            except requests.exceptions.RequestException as e:
+                if not is_unavailable(e):
+                    return upstream_error('NASA API', e)
+                unfetched = missing  # Serve what we have
+
+    queryset = queries.filter_asteroids(CachedAsteroid.objects.values(), filters)
+    try:
+        results, next_cursor = queries.keyset_page(queryset, sort, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    body = {'results': results, 'next_cursor': next_cursor}
+    if unfetched:
+        body['missing_dates'] = [day.isoformat() for day in unfetched]
+    response = JsonResponse(body)
+    if unfetched:
+        response['X-Data-Stale'] = 'true'
+    return response
+
+@require_http_methods(["GET"])
+@responses.conditional
+def search_apods(request):
+    if not search.available():
+        return JsonResponse({'error': 'Search is not available on this database'}, status=501)
+    try:
+        filters = queries.parse_apod_filters(request.GET)
+        limit = queries.parse_limit(request.GET)
+        results, next_cursor = search.search_apods(request.GET.get('q', ''), filters, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+@require_http_methods(["GET"])
+def export_apods(request):
+    try:
+        filters = queries.parse_apod_filters(request.GET)
+        export_format = exports.parse_format(request.GET)
+        fields = delta.parse_fields(request.GET, delta.model_fields(APOD), 'date') or delta.model_fields(APOD)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    queryset = queries.filter_apods(APOD.objects.order_by('date'), filters)
+    return exports.export_response(request, queryset, fields, 'apod', export_format)
+
+@require_http_methods(["GET"])
+def export_asteroids(request):
+    fields = delta.model_fields(CachedAsteroid)
+    try:
+        filters = queries.parse_asteroid_filters(request.GET, limit_range=False)
+        export_format = exports.parse_format(request.GET)
+        fields = delta.parse_fields(request.GET, fields, 'neo_reference_id') or fields
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    queryset = queries.filter_asteroids(CachedAsteroid.objects.order_by('close_approach_date', 'id'), filters)
+    return exports.export_response(request, queryset, fields, 'asteroids', export_format)
+
+def dashboard_sections():
+    # Same cache entries as the individual endpoints
+    today = queries.apod_today()
+    return {
+        'apod': (f'apod_{today}', lambda: load_apod(today), apod_policy(today, today), dashboard.summarize_apod),
+        'launches': ('launches_data', load_launches, 'launches', dashboard.summarize_launches),
+        'asteroids': ('asteroids_data', load_asteroids, 'asteroids', dashboard.summarize_asteroids),
+        'mars_weather': ('mars_weather_data', load_mars_weather, 'mars_weather', dashboard.summarize_mars_weather),
+    }
+
+@require_http_methods(["GET"])
+@responses.conditional
+def home_dashboard(request):
+    available = dashboard_sections()
+    names = [name for name in request.GET.get('sections', '').split(',') if name] or list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        return JsonResponse({'error': f'sections must be among: {", ".join(available)}'}, status=400)
+
+    sections = dashboard.gather({name: available[name] for name in names})
+    response = JsonResponse({'sections': sections})
+    if any(section.get('stale') or 'error' in section for section in sections.values()):
+        response['X-Data-Stale'] = 'true'
+    return response
 
 @login_required
 @require_http_methods(["POST"])
 def favorite_apod(request):
     try:
         data = json.loads(request.body)
-        
-        # Get or create the APOD in your database
-        apod_obj, created = APOD.objects.get_or_create(
-            date=data.get('date'),
-            defaults={
-                'title': data['title'],
-                'explanation': data['explanation'],
-                'url': data['url'],
-                'hdurl': data.get('hdurl', ''),
-                'media_type': data.get('media_type', 'image'),
-                'copyright': data.get('copyright', '')
-            }
-        )
-        
+        day = favorites.parse_favorite_date(data, queries.apod_today())
+
+        # The stored APOD, or NASA's; the rest of the body is ignored, since
+        # everyone is served the APOD rows
+        try:
+            apod_id = favorites.resolve_apods([day]).get(day)
+        except requests.exceptions.RequestException as e:
+            return upstream_error('NASA API', e)
+        if apod_id is None:
+            return JsonResponse({'status': 'error', 'message': f'No APOD for {day}'}, status=404)
+
         # Create the favorite relationship
         favorite, created = Favorite.objects.get_or_create(
             user=request.user,
-            apod=apod_obj
+            apod_id=apod_id
         )
+        if created:
+            favorites.invalidate(request.user.id)
         
         return JsonResponse({
             'status': 'success',
@@ -265,27 +423,33 @@ def favorite_apod(request):
 @require_http_methods(["GET"])
 def list_favorites(request):
     try:
-        favorites = Favorite.objects.filter(user=request.user).select_related('apod')
-        
-        favorites_data = [{
-            'id': fav.id,
-            'apod': {
-                'id': fav.apod.id,
-                'title': fav.apod.title,
-                'explanation': fav.apod.explanation,
-                'url': fav.apod.url,
-                'hdurl': fav.apod.hdurl,
-                'date': fav.apod.date,
-                'copyright': fav.apod.copyright,
-                'media_type': fav.apod.media_type
-            },
-            'created_at': fav.created_at
-        } for fav in favorites]
-        
-        return JsonResponse({
-            'status': 'success',
-            'favorites': favorites_data
-        })
+        try:
+            since = delta.parse_since(request.GET)
+            fields, sort = favorites.parse_list_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        if since is not None:
+            # Deltas depend on the time they're asked for, so aren't cached
+            queryset = Favorite.objects.filter(user=request.user).order_by('id')
+            changes = delta.changes('favorites', queryset, since, fields, user=request.user)
+            data = {
+                'status': 'success',
+                'favorites': [delta.nest_favorite(row) for row in changes['results']],
+            }
+            data.update((key, value) for key, value in changes.items() if key != 'results')
+            return JsonResponse(data)
+
+        try:
+            entry = favorites.get_entry(
+                request.user.id, request.GET,
+                lambda: favorites.list_page(request.user, fields, sort, request.GET),
+            )
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        response = responses.cached_json_response(request, entry)
+        patch_cache_control(response, private=True)
+        return response
         
     except Exception as e:
         return JsonResponse({
@@ -301,7 +465,8 @@ def unfavorite_apod(request, apod_id):
             user=request.user,
             apod__id=apod_id
         )
-        favorite.delete()
+        delta.delete(Favorite.objects.filter(pk=favorite.pk))
+        favorites.invalidate(request.user.id)
         
         return JsonResponse({
             'status': 'success',
@@ -317,4 +482,25 @@ def unfavorite_apod(request, apod_id):
         return JsonResponse({
             'status': 'error',
             'message': str(e)
-        }, status=400)
\ No newline at end of file
+        }, status=400)
+
+@login_required
+@require_http_methods(["POST"])
+def batch_favorites(request):
+    try:
+        days, apod_ids = favorites.validate_batch(json.loads(request.body), queries.apod_today())
+    except ValueError as e:  # Includes malformed JSON
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    try:
+        resolved = favorites.resolve_apods(days)
+    except requests.exceptions.RequestException as e:
+        return upstream_error('NASA API', e)
+    favorited, unfavorited = favorites.apply_batch(request.user, sorted(set(resolved.values())), apod_ids)
+    return JsonResponse({
+        'status': 'success',
+        'favorited': favorited,
+        'unfavorited': unfavorited,
+        'not_found': sorted(set(apod_ids) - set(unfavorited)),
+        'unavailable': sorted({day.isoformat() for day in days if day not in resolved}),
+    })